@@ -136,6 +136,80 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 DATA_DIR = '/mnt/data/work/Plasmids/datafiles'
-BLAST_PROT_DB = '/mnt/data/work/Plasmids/plasmidoro/data/blast_prot'
-BLAST_NUCL_DB = '/mnt/data/work/Plasmids/plasmidoro/data/blast_nucl'
+# Number of processes parsing plasmid map files in import_plasmids.
+# With 1, files are parsed and imported one by one.
+IMPORT_WORKERS = config('IMPORT_WORKERS', default=1, cast=int)
+# Timing and resource usage of update_all_data stages are saved
+# into a JSON file per run. RUN_LOG_TRACEMALLOC adds peak Python memory
+# allocation per stage, which slows the run down.
+RUN_LOG_DIR = '/mnt/data/work/Plasmids/plasmidoro/data/runlogs'
+RUN_LOG_TRACEMALLOC = config('RUN_LOG_TRACEMALLOC', default=False, cast=bool)
+# BLAST databases. Every build goes to a new version directory under
+# BLAST_DB_DIR, and the "current" symlink is switched to it after validation.
+# Superseded versions are deleted after BLAST_DB_GC_DELAY seconds, which
+# must be longer than the longest search.
+BLAST_DB_DIR = '/mnt/data/work/Plasmids/plasmidoro/data/blastdb'
+BLAST_PROT_DB = BLAST_DB_DIR + '/current/blast_prot'
+BLAST_NUCL_DB = BLAST_DB_DIR + '/current/blast_nucl'
+BLAST_DB_GC_DELAY = config('BLAST_DB_GC_DELAY', default=3600, cast=int)
 TEMP_DIR = '/mnt/data/work/Plasmids/plasmidoro/tmp'
+# pLannotate command line, without the "batch" subcommand and its options,
+# and number of plasmids annotated at a time by annotate_all_plasmids
+PLANNOTATE_COMMAND = config('PLANNOTATE_COMMAND', default='conda run --no-capture-output -n plannotate plannotate')
+PLANNOTATE_WORKERS = config('PLANNOTATE_WORKERS', default=2, cast=int)
+# pLannotate version for the result cache. If empty, the version
+# is obtained by running pLannotate with --version.
+PLANNOTATE_VERSION = config('PLANNOTATE_VERSION', default='')
+# Annotate new and changed plasmids at the end of update_all_data
+PLANNOTATE_AFTER_UPDATE = config('PLANNOTATE_AFTER_UPDATE', default=False, cast=bool)
+# Library of curated feature sequences for annotation of FASTA files,
+# made by the build_feature_library command. Shorter features are not included.
+FEATURE_LIBRARY_FILE = '/mnt/data/work/Plasmids/plasmidoro/data/feature_library.json'
+FEATURE_LIBRARY_MIN_LENGTH = config('FEATURE_LIBRARY_MIN_LENGTH', default=15, cast=int)
+
+# Sequence search job queue. Jobs are stored in the database and run by
+# a bounded pool of worker threads in each web process.
+SEARCH_JOB_WORKERS = config('SEARCH_JOB_WORKERS', default=2, cast=int)
+SEARCH_JOB_MAX_QUEUED = config('SEARCH_JOB_MAX_QUEUED', default=50, cast=int)
+SEARCH_JOB_POLL_INTERVAL = config('SEARCH_JOB_POLL_INTERVAL', default=3, cast=int)
+SEARCH_JOB_TIMEOUT = config('SEARCH_JOB_TIMEOUT', default=3600, cast=int)
+SEARCH_JOB_EXPIRE_DAYS = config('SEARCH_JOB_EXPIRE_DAYS', default=7, cast=int)
+# Workers update the heartbeat of running jobs every SEARCH_JOB_HEARTBEAT_INTERVAL
+# seconds. Running jobs without a heartbeat for SEARCH_JOB_HEARTBEAT_TIMEOUT
+# seconds belong to a stopped worker and are queued again.
+SEARCH_JOB_HEARTBEAT_INTERVAL = config('SEARCH_JOB_HEARTBEAT_INTERVAL', default=30, cast=int)
+SEARCH_JOB_HEARTBEAT_TIMEOUT = config('SEARCH_JOB_HEARTBEAT_TIMEOUT', default=120, cast=int)
+# Maximum number of sequences in a multi-FASTA batch search
+BATCH_SEARCH_MAX_QUERIES = config('BATCH_SEARCH_MAX_QUERIES', default=500, cast=int)
+# Number of rows per page in lists and text search results. The page size
+# can be changed with the "size" URL parameter up to LIST_MAX_PAGE_SIZE.
+LIST_PAGE_SIZE = config('LIST_PAGE_SIZE', default=100, cast=int)
+LIST_MAX_PAGE_SIZE = config('LIST_MAX_PAGE_SIZE', default=1000, cast=int)
+
+# Sequence search result cache. Entries are evicted in least recently used
+# order when either limit is exceeded, and dropped when BLAST databases are rebuilt.
+SEARCH_CACHE_ENABLED = config('SEARCH_CACHE_ENABLED', default=True, cast=bool)
+SEARCH_CACHE_MAX_ENTRIES = config('SEARCH_CACHE_MAX_ENTRIES', default=1000, cast=int)
+SEARCH_CACHE_MAX_SIZE = config('SEARCH_CACHE_MAX_SIZE', default=50000000, cast=int)
+# Memory-mapped index of plasmid and oligo sequences for short queries,
+# rebuilt together with BLAST databases
+SEQUENCE_INDEX_DIR = '/mnt/data/work/Plasmids/plasmidoro/data/seqindex'
+SEQUENCE_INDEX_MAX_MISMATCHES = config('SEQUENCE_INDEX_MAX_MISMATCHES', default=2, cast=int)
+# Oligo binding site search: length of the oligo 3' end that must anneal,
+# shortest oligo to search, allowed mismatches and number of 3'-terminal
+# bases that must match exactly
+OLIGO_BINDING_LENGTH = config('OLIGO_BINDING_LENGTH', default=20, cast=int)
+OLIGO_BINDING_MIN_LENGTH = config('OLIGO_BINDING_MIN_LENGTH', default=15, cast=int)
+OLIGO_BINDING_MISMATCHES = config('OLIGO_BINDING_MISMATCHES', default=2, cast=int)
+OLIGO_BINDING_EXACT_3PRIME = config('OLIGO_BINDING_EXACT_3PRIME', default=10, cast=int)
+# Sequence search backend: 'blast' (NCBI BLAST+), 'local' (built-in
+# Smith-Waterman search over the database, no BLAST+ needed) or 'auto'
+# (local search if BLAST+ is not installed or the collection is small)
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='blast')
+LOCAL_SEARCH_MAX_RESIDUES = config('LOCAL_SEARCH_MAX_RESIDUES', default=1000000, cast=int)
+# BLAST database shards. Plasmids and their proteins are split into shards
+# by plasmid ID range, and only shards with changed content are rebuilt.
+# BLAST_NUCL_DB and BLAST_PROT_DB are alias databases combining the shards.
+BLAST_SHARD_SIZE = config('BLAST_SHARD_SIZE', default=500, cast=int)
+# Number of makeblastdb processes run at once
+BLAST_DB_BUILD_WORKERS = config('BLAST_DB_BUILD_WORKERS', default=2, cast=int)
@@ -21,3 +21,11 @@ admin.site.register(Feature)
 admin.site.register(Plasmid_info)
 admin.site.register(Strain)
 admin.site.register(Strain_info)
+admin.site.register(Search_job)
+admin.site.register(Search_cache)
+admin.site.register(Search_cache_counter)
+admin.site.register(Oligo_binding_site)
+admin.site.register(Oligo_binding_scan)
+admin.site.register(Sequence_file_manifest)
+admin.site.register(Plannotate_cache)
+admin.site.register(Plasmid_annotation)
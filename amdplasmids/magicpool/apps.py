@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MagicpoolConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'magicpool'
+
+    def ready(self):
+        # Connects signal receivers updating the full-text index
+        from magicpool import signals
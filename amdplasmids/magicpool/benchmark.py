@@ -0,0 +1,536 @@
+"""
+    Sequence search benchmark.
+
+    generate_corpus() fills the database with synthetic plasmids assembled
+    from a shared library of parts (origins, markers, promoters, CDS and
+    terminators), so the collection has the redundancy of a real plasmid
+    collection. Every plasmid gets features, proteins for its CDS and
+    a few oligos. All objects are named with the CORPUS_PREFIX, so the corpus
+    can be removed by delete_corpus().
+
+    run_benchmark() measures latency of search functions and search views
+    for combinations of query length and number of hits and returns
+    a JSON-serializable report with p50/p95 latencies.
+
+    run_import_benchmark() imports synthetic GenBank-like records with
+    the per-feature path (create_feature) and the bulk path
+    (import_features) and reports queries and time per plasmid.
+
+    run_storage_benchmark() reports size of the database and of the feature
+    table and latency of plasmid and feature pages on the current database.
+"""
+import io
+import time
+import random
+import contextlib
+import hashlib
+import platform
+from datetime import datetime
+import django
+from django.db import transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from Bio.Seq import Seq
+from Bio.SeqFeature import SeqFeature, SimpleLocation
+from magicpool.models import Plasmid, Oligo, Feature, Feature_type, Protein, Search_job
+from magicpool.blast_search import run_nucleotide_search, run_protein_search
+from magicpool.search_jobs import JOB_QUEUED, JOB_RUNNING
+from magicpool import search_cache, text_index
+from magicpool.feature_import import import_features
+from magicpool.plannotate_cache import sequence_hash
+from magicpool.util import create_feature
+from amdplasmids.settings import ALLOWED_HOSTS, SEARCH_BACKEND
+
+CORPUS_PREFIX = 'bench_'
+# Part type, number of parts in the library, min. and max. length
+PART_LIBRARY = [
+    ('rep_origin', 10, 500, 900),
+    ('marker', 8, 600, 1200),
+    ('promoter', 40, 100, 300),
+    ('CDS', 300, 300, 2000),
+    ('terminator', 20, 40, 120),
+]
+MAX_CASSETTES = 4
+OLIGOS_PER_PLASMID = 3
+NUCLEOTIDE_MUTATION_RATE = 0.02
+PROTEIN_MUTATION_RATE = 0.05
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+STOP_CODONS = ('TAA', 'TAG', 'TGA')
+VIEW_POLL_INTERVAL = 0.01
+VIEW_TIMEOUT = 600
+# Labels of misc_feature parts, so that feature type rules are used
+MISC_FEATURE_LABELS = {'rep_origin': 'ColE1', 'promoter': 'lac promoter', 'terminator': 'rrnB terminator'}
+
+
+def _random_dna(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def _random_orf(rng, length):
+    codons = ['ATG']
+    while len(codons) < length // 3 - 1:
+        codon = _random_dna(rng, 3)
+        if codon not in STOP_CODONS:
+            codons.append(codon)
+    codons.append(rng.choice(STOP_CODONS))
+    return ''.join(codons)
+
+
+def _make_part_library(rng):
+    '''
+        Returns dictionary of part type: list of sequences
+    '''
+    library = {}
+    for part_type, count, min_length, max_length in PART_LIBRARY:
+        parts = []
+        for _ in range(count):
+            length = rng.randint(min_length, max_length)
+            if part_type in ('CDS', 'marker'):
+                parts.append(_random_orf(rng, length))
+            else:
+                parts.append(_random_dna(rng, length))
+        library[part_type] = parts
+    return library
+
+
+def _assemble_plasmid(rng, library):
+    '''
+        Returns plasmid sequence and list of (part type, part index,
+        start, end, strand) tuples
+    '''
+    layout = [('rep_origin', 1), ('marker', rng.choice((1, -1)))]
+    for _ in range(rng.randint(1, MAX_CASSETTES)):
+        strand = rng.choice((1, -1))
+        cassette = [('promoter', strand), ('CDS', strand), ('terminator', strand)]
+        if strand == -1:
+            cassette.reverse()
+        layout += cassette
+    sequence = []
+    parts = []
+    position = 0
+    for part_type, strand in layout:
+        spacer = _random_dna(rng, rng.randint(10, 200))
+        sequence.append(spacer)
+        position += len(spacer)
+        part_index = rng.randrange(len(library[part_type]))
+        part = library[part_type][part_index]
+        if strand == -1:
+            part = str(Seq(part).reverse_complement())
+        sequence.append(part)
+        parts.append((part_type, part_index, position, position + len(part), strand))
+        position += len(part)
+    return ''.join(sequence), parts
+
+
+def delete_corpus():
+    '''
+        Deletes all objects of the synthetic corpus
+    '''
+    plasmids = Plasmid.objects.filter(name__startswith=CORPUS_PREFIX)
+    oligos = Oligo.objects.filter(name__startswith=CORPUS_PREFIX)
+    plasmid_ids = list(plasmids.values_list('id', flat=True))
+    feature_ids = list(Feature.objects.filter(plasmid__in=plasmid_ids).values_list('id', flat=True))
+    oligo_ids = list(oligos.values_list('id', flat=True))
+    plasmids.delete()
+    oligos.delete()
+    text_index.delete(Plasmid, plasmid_ids)
+    text_index.delete(Feature, feature_ids)
+    text_index.delete(Oligo, oligo_ids)
+
+
+def corpus_stats():
+    '''
+        Returns dictionary with statistics of the existing corpus
+    '''
+    plasmids = Plasmid.objects.filter(name__startswith=CORPUS_PREFIX)
+    return {'plasmids': plasmids.count(),
+            'features': Feature.objects.filter(plasmid__in=plasmids).count(),
+            'proteins': Protein.objects.filter(feature__plasmid__in=plasmids).count(),
+            'oligos': Oligo.objects.filter(name__startswith=CORPUS_PREFIX).count(),
+            'total_length': sum(len(sequence) for sequence in plasmids.values_list('sequence', flat=True))
+            }
+
+
+def generate_corpus(plasmid_count, seed=1):
+    '''
+        Replaces synthetic corpus with plasmid_count new plasmids.
+        Returns dictionary with corpus statistics.
+    '''
+    rng = random.Random(seed)
+    library = _make_part_library(rng)
+    feature_types = {}
+    for part_type, _, _, _ in PART_LIBRARY:
+        feature_type_name = 'CDS' if part_type == 'marker' else part_type
+        feature_types[part_type], _ = Feature_type.objects.get_or_create(name=feature_type_name)
+    stats = {'plasmids': plasmid_count, 'features': 0, 'proteins': 0, 'oligos': 0, 'total_length': 0}
+    with transaction.atomic():
+        delete_corpus()
+        layouts = []
+        plasmids = []
+        for i in range(plasmid_count):
+            sequence, parts = _assemble_plasmid(rng, library)
+            layouts.append(parts)
+            plasmids.append(Plasmid(name=CORPUS_PREFIX + 'p' + str(i + 1),
+                                    description='Synthetic benchmark plasmid',
+                                    sequence=sequence,
+                                    footprint=hashlib.md5(sequence.encode('utf-8')).hexdigest(),
+                                    sequence_hash=sequence_hash(sequence)
+                                    ))
+            stats['total_length'] += len(sequence)
+        plasmids = Plasmid.objects.bulk_create(plasmids)
+        features = []
+        coding = []
+        oligos = []
+        for plasmid, parts in zip(plasmids, layouts):
+            for part_type, part_index, start, end, strand in parts:
+                location_str = '[' + str(start) + ':' + str(end) + '](' + ('+' if strand == 1 else '-') + ')'
+                features.append(Feature(name=part_type + '_' + str(part_index + 1),
+                                        plasmid=plasmid,
+                                        feature_type=feature_types[part_type],
+                                        sequence_id=plasmid.name,
+                                        start=start,
+                                        end=end,
+                                        strand=strand,
+                                        location_str=location_str,
+                                        description='Synthetic ' + part_type
+                                        ))
+                coding.append(part_type in ('CDS', 'marker'))
+            for k in range(OLIGOS_PER_PLASMID):
+                length = rng.randint(18, 30)
+                start = rng.randrange(len(plasmid.sequence) - length)
+                oligo_sequence = plasmid.sequence[start:start + length]
+                if rng.random() < 0.5:
+                    oligo_sequence = str(Seq(oligo_sequence).reverse_complement())
+                oligos.append(Oligo(name=plasmid.name + '_o' + str(k + 1),
+                                    sequence=oligo_sequence,
+                                    description='Synthetic benchmark oligo'
+                                    ))
+        features = Feature.objects.bulk_create(features, batch_size=500)
+        proteins = []
+        for feature, is_coding in zip(features, coding):
+            if not is_coding:
+                continue
+            cds = Seq(feature.sequence)
+            proteins.append(Protein(name=feature.name,
+                                    sequence=str(cds.translate(to_stop=True)),
+                                    function='synthetic protein',
+                                    feature=feature
+                                    ))
+        Protein.objects.bulk_create(proteins, batch_size=500)
+        Oligo.objects.bulk_create(oligos, batch_size=500)
+    stats['features'] = len(features)
+    stats['proteins'] = len(proteins)
+    stats['oligos'] = len(oligos)
+    return stats
+
+
+def _mutate(rng, sequence, alphabet, rate):
+    sequence = list(sequence)
+    for i in range(len(sequence)):
+        if rng.random() < rate:
+            sequence[i] = rng.choice(alphabet)
+    return ''.join(sequence)
+
+
+def _nucleotide_queries(rng, length, count):
+    sequences = list(Plasmid.objects.filter(name__startswith=CORPUS_PREFIX).values_list('sequence', flat=True))
+    queries = []
+    while len(queries) < count:
+        sequence = rng.choice(sequences)
+        if len(sequence) <= length:
+            continue
+        start = rng.randrange(len(sequence) - length)
+        queries.append(_mutate(rng, sequence[start:start + length], 'ACGT', NUCLEOTIDE_MUTATION_RATE))
+    return queries
+
+
+def _protein_queries(rng, length, count):
+    sequences = list(Protein.objects.filter(
+        feature__plasmid__name__startswith=CORPUS_PREFIX
+    ).values_list('sequence', flat=True))
+    queries = []
+    if not sequences:
+        return queries
+    for _ in range(count):
+        sequence = rng.choice(sequences)
+        start = rng.randrange(max(len(sequence) - length, 1))
+        queries.append(_mutate(rng, sequence[start:start + length], AMINO_ACIDS, PROTEIN_MUTATION_RATE))
+    return queries
+
+
+def _percentile(values, fraction):
+    '''
+        Returns percentile of values with linear interpolation
+    '''
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _summary(name, tool, query_length, hitstoshow, timings, hit_counts):
+    return {'name': name,
+            'tool': tool,
+            'query_length': query_length,
+            'hitstoshow': hitstoshow,
+            'repeats': len(timings),
+            'p50': round(_percentile(timings, 0.5), 6),
+            'p95': round(_percentile(timings, 0.95), 6),
+            'mean': round(sum(timings) / len(timings), 6),
+            'min': round(min(timings), 6),
+            'max': round(max(timings), 6),
+            'mean_hits': round(sum(hit_counts) / len(hit_counts), 2)
+            }
+
+
+def _benchmark_function(search_function, tool, queries, hitstoshow):
+    timings = []
+    hit_counts = []
+    for query in queries:
+        params = {'sequence': '>query\n' + query,
+                  'evalue': '0.0001',
+                  'hitstoshow': str(hitstoshow),
+                  'tool': tool
+                  }
+        start = time.perf_counter()
+        hits, searchcontext, _, _ = search_function(params)
+        timings.append(time.perf_counter() - start)
+        hit_counts.append(len(hits))
+    return timings, hit_counts
+
+
+def _client():
+    host = 'localhost'
+    for allowed_host in ALLOWED_HOSTS:
+        if allowed_host and allowed_host != '*':
+            host = allowed_host.lstrip('.')
+            break
+    return Client(HTTP_HOST=host)
+
+
+def _benchmark_view(client, url_name, tool, queries, hitstoshow):
+    '''
+        Measures time from form submission until the result page is rendered
+    '''
+    timings = []
+    hit_counts = []
+    for query in queries:
+        data = {'sequence': '>query\n' + query,
+                'evalue': '0.0001',
+                'hitstoshow': str(hitstoshow),
+                'tool': tool
+                }
+        start = time.perf_counter()
+        response = client.post(reverse(url_name), data)
+        if response.status_code != 302:
+            raise RuntimeError('Search was not submitted: ' + url_name)
+        job_id = response.url.rstrip('/').split('/')[-1]
+        while Search_job.objects.filter(job_id=job_id, status__in=(JOB_QUEUED, JOB_RUNNING)).exists():
+            if time.perf_counter() - start > VIEW_TIMEOUT:
+                raise RuntimeError('Search job timed out: ' + job_id)
+            time.sleep(VIEW_POLL_INTERVAL)
+        response = client.get(response.url)
+        timings.append(time.perf_counter() - start)
+        hit_counts.append(len(Search_job.objects.get(job_id=job_id).hits.splitlines()))
+    return timings, hit_counts
+
+
+def run_benchmark(nucleotide_lengths, protein_lengths, hitstoshow_values, repeats, seed=1, views=True):
+    '''
+        Runs searches with random corpus fragments as queries.
+        Search cache is disabled, so every search is executed.
+        Returns list of result dictionaries.
+    '''
+    rng = random.Random(seed)
+    results = []
+    cache_enabled = search_cache.SEARCH_CACHE_ENABLED
+    search_cache.SEARCH_CACHE_ENABLED = False
+    client = _client() if views else None
+    try:
+        for hitstoshow in hitstoshow_values:
+            for length in nucleotide_lengths:
+                queries = _nucleotide_queries(rng, length, repeats)
+                timings, hit_counts = _benchmark_function(run_nucleotide_search, 'blastn', queries, hitstoshow)
+                results.append(_summary('run_nucleotide_search', 'blastn', length, hitstoshow, timings, hit_counts))
+                if views:
+                    timings, hit_counts = _benchmark_view(client, 'nucleotidesearch', 'blastn', queries, hitstoshow)
+                    results.append(_summary('nucleotidesearch', 'blastn', length, hitstoshow, timings, hit_counts))
+            for length in protein_lengths:
+                queries = _protein_queries(rng, length, repeats)
+                if not queries:
+                    # Corpus without proteins
+                    continue
+                for tool in ('blastp', 'tblastn'):
+                    timings, hit_counts = _benchmark_function(run_protein_search, tool, queries, hitstoshow)
+                    results.append(_summary('run_protein_search', tool, length, hitstoshow, timings, hit_counts))
+                    if views:
+                        timings, hit_counts = _benchmark_view(client, 'proteinsearch', tool, queries, hitstoshow)
+                        results.append(_summary('proteinsearch', tool, length, hitstoshow, timings, hit_counts))
+    finally:
+        search_cache.SEARCH_CACHE_ENABLED = cache_enabled
+    return results
+
+
+def make_report(corpus, results, options):
+    '''
+        Returns benchmark report as a dictionary
+    '''
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'search_backend': SEARCH_BACKEND,
+            'options': options,
+            'corpus': corpus,
+            'results': results
+            }
+
+
+def _import_records(rng, library, plasmid_count):
+    '''
+        Returns list of (sequence, list of SeqFeature) for synthetic plasmids
+        with features as SnapGene and GenBank files have them
+    '''
+    records = []
+    for _ in range(plasmid_count):
+        sequence, parts = _assemble_plasmid(rng, library)
+        features = [SeqFeature(SimpleLocation(0, len(sequence), 1), type='source',
+                               qualifiers={'organism': ['synthetic DNA construct']})]
+        for part_type, part_index, start, end, strand in parts:
+            name = part_type + '_' + str(part_index + 1)
+            if part_type in ('CDS', 'marker'):
+                cds = Seq(sequence[start:end])
+                if strand == -1:
+                    cds = cds.reverse_complement()
+                qualifiers = {'label': [name],
+                              'gene': [name],
+                              'product': ['synthetic protein'],
+                              'translation': [str(cds.translate(to_stop=True))]
+                              }
+                feature_type = 'CDS'
+            else:
+                qualifiers = {'label': [MISC_FEATURE_LABELS[part_type]], 'note': ['Synthetic ' + part_type]}
+                feature_type = 'misc_feature'
+            features.append(SeqFeature(SimpleLocation(start, end, strand), type=feature_type, qualifiers=qualifiers))
+        # Duplicated feature and feature without name are skipped by import
+        features.append(features[1])
+        features.append(SeqFeature(SimpleLocation(0, 10, 1), type='misc_feature', qualifiers={}))
+        records.append((sequence, features))
+    return records
+
+
+def _plasmid_rows(plasmid):
+    return sorted((feature.name, feature.feature_type.name, feature.sequence_id,
+                   feature.start, feature.end, feature.strand, feature.location_str, feature.description,
+                   tuple(sorted((protein.name, protein.sequence, protein.function)
+                                for protein in feature.protein_set.all())))
+                  for feature in plasmid.feature_set.all())
+
+
+def run_import_benchmark(plasmid_count, seed=1):
+    '''
+        Imports the same synthetic records with the per-feature and
+        the bulk path. Returns dictionary with query counts and time per
+        plasmid for both paths and a flag that both created the same rows.
+    '''
+    rng = random.Random(seed)
+    records = _import_records(rng, _make_part_library(rng), plasmid_count)
+    results = {'plasmids': plasmid_count,
+               'features_per_plasmid': sum(len(features) for _, features in records) / max(plasmid_count, 1)
+               }
+    rows = {}
+    for path_name in ('per_feature', 'bulk'):
+        delete_corpus()
+        query_count = 0
+        elapsed = 0.0
+        for i, (sequence, features) in enumerate(records):
+            with CaptureQueriesContext(connection) as queries:
+                start_time = time.perf_counter()
+                plasmid = Plasmid.objects.create(name=CORPUS_PREFIX + 'p' + str(i + 1),
+                                                 description='Synthetic benchmark plasmid',
+                                                 sequence=sequence,
+                                                 footprint=hashlib.md5(sequence.encode('utf-8')).hexdigest(),
+                                                 sequence_hash=sequence_hash(sequence)
+                                                 )
+                if path_name == 'bulk':
+                    import_features(features, plasmid)
+                else:
+                    for feature in features:
+                        create_feature(feature, plasmid)
+                elapsed += time.perf_counter() - start_time
+            query_count += len(queries)
+        rows[path_name] = [_plasmid_rows(plasmid)
+                           for plasmid in Plasmid.objects.filter(name__startswith=CORPUS_PREFIX).order_by('id')]
+        results[path_name] = {'queries_per_plasmid': query_count / max(plasmid_count, 1),
+                              'seconds_per_plasmid': elapsed / max(plasmid_count, 1)
+                              }
+    delete_corpus()
+    results['identical_rows'] = rows['per_feature'] == rows['bulk']
+    return results
+
+
+def _table_size(table):
+    '''
+        Returns size of SQLite table and its indexes in bytes
+        or None if the dbstat virtual table is not available
+    '''
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s OR name IN '
+                           '(SELECT name FROM sqlite_master WHERE type = \'index\' AND tbl_name = %s)',
+                           [table, table])
+            return cursor.fetchone()[0]
+    except django.db.Error:
+        return None
+
+
+def _benchmark_page(client, url):
+    start = time.perf_counter()
+    # Views print their context
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.get(url)
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError('Page was not rendered: ' + url)
+    return elapsed
+
+
+def run_storage_benchmark(samples, seed=1):
+    '''
+        Measures database size and rendering time of plasmid pages
+        and feature search results for plasmids with features
+        sampled from the database. Returns dictionary.
+    '''
+    results = {}
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA page_size')
+            page_size = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_count')
+            results['database_size'] = cursor.fetchone()[0] * page_size
+            cursor.execute('PRAGMA freelist_count')
+            results['free_space'] = cursor.fetchone()[0] * page_size
+        results['feature_table_size'] = _table_size(Feature._meta.db_table)
+    results['features'] = Feature.objects.count()
+    rng = random.Random(seed)
+    plasmid_ids = sorted(set(Feature.objects.values_list('plasmid_id', flat=True)))
+    plasmid_ids = rng.sample(plasmid_ids, min(samples, len(plasmid_ids)))
+    client = _client()
+    timings = {'plasmiddetails': [], 'plasmidviewer': [], 'textsearch': []}
+    for plasmid_id in plasmid_ids:
+        for url_name in ('plasmiddetails', 'plasmidviewer'):
+            timings[url_name].append(_benchmark_page(client, reverse(url_name, args=[plasmid_id])))
+        feature_name = Feature.objects.filter(plasmid_id=plasmid_id).values_list('name', flat=True).first()
+        timings['textsearch'].append(_benchmark_page(client, reverse('textsearch') + '?type=feature&query=' +
+                                                     feature_name))
+    results['pages'] = {}
+    for name, values in timings.items():
+        if values:
+            results['pages'][name] = {'repeats': len(values),
+                                      'p50': round(_percentile(values, 0.5), 6),
+                                      'p95': round(_percentile(values, 0.95), 6),
+                                      'mean': round(sum(values) / len(values), 6)
+                                      }
+    return results
@@ -0,0 +1,403 @@
+"""
+    Versioned BLAST databases.
+
+    BLAST databases are built from shards: plasmids and proteins are
+    grouped by plasmid ID range (BLAST_SHARD_SIZE plasmids per shard)
+    and all oligos make one shard. Each shard has a fingerprint of its
+    FASTA content, and only shards with changed fingerprints are rebuilt.
+    Shards are never modified after they are built.
+
+    Every build that changes any shard creates a new version directory
+    with alias databases combining the shards. The version is validated
+    (number of sequences must match the database tables) and then
+    activated by replacing the "current" symlink, which BLAST_NUCL_DB and
+    BLAST_PROT_DB point to. Searches resolve the symlink when they start,
+    so a search keeps reading its version after a swap. Superseded versions
+    and shards used only by them are deleted BLAST_DB_GC_DELAY seconds
+    after the swap.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from subprocess import Popen, PIPE, STDOUT, CalledProcessError
+from magicpool.models import Plasmid, Oligo, Protein
+from magicpool.sequence_index import SequenceIndexWriter
+from amdplasmids.settings import BLAST_DB_DIR, BLAST_SHARD_SIZE, BLAST_DB_GC_DELAY
+from amdplasmids.settings import BLAST_NUCL_DB, BLAST_PROT_DB, BLAST_DB_BUILD_WORKERS
+
+SHARDS_DIR = os.path.join(BLAST_DB_DIR, 'shards')
+VERSIONS_DIR = os.path.join(BLAST_DB_DIR, 'versions')
+CURRENT_LINK = os.path.join(BLAST_DB_DIR, 'current')
+VERSION_MANIFEST = 'manifest.json'
+# Marks shards built completely
+BUILT_MARKER = '.built'
+# Changes in FASTA header format must change fingerprints of all shards
+FASTA_FORMAT_VERSION = '1'
+# Number of rows fetched from the database at once
+EXPORT_CHUNK_SIZE = 2000
+
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+class BlastDatabaseError(Exception):
+    '''
+        Raised if a new BLAST database version fails validation
+    '''
+    pass
+
+
+def get_blast_db_version():
+    '''
+        Returns version of the active BLAST databases
+        or empty string if databases were never built
+    '''
+    try:
+        return os.path.basename(os.readlink(CURRENT_LINK))
+    except OSError:
+        return ''
+
+
+def active_db_path(db_path):
+    '''
+        Returns path of the database in the active version directory
+    '''
+    return os.path.join(os.path.realpath(os.path.dirname(db_path)), os.path.basename(db_path))
+
+
+def _ascii_name(name):
+    '''
+        Replaces spaces with underscores and non-ASCII characters with dots
+    '''
+    name = name.replace(' ', '_')
+    if name.isascii():
+        return name
+    return _NON_ASCII.sub('.', name)
+
+
+def plasmid_fasta_header(plasmid_id, name, amd_number):
+    return str(plasmid_id) + '|' + _ascii_name(name) + '|plasmid|' + amd_number
+
+
+def oligo_fasta_header(oligo_id, name):
+    return str(oligo_id) + '|' + _ascii_name(name) + '|oligo|'
+
+
+def protein_fasta_header(protein_id, name, plasmid_name, location_str):
+    return str(protein_id) + '|' + _ascii_name(name.replace('&nbsp;', '_')) + '|' + \
+        _ascii_name(plasmid_name) + '|' + location_str
+
+
+def _shard_batch(plasmid_id):
+    return (plasmid_id - 1) // BLAST_SHARD_SIZE
+
+
+def _plasmid_shards():
+    '''
+        Yields (shard name, list of (header, sequence)) for plasmids
+    '''
+    shard = None
+    records = []
+    for item in Plasmid.objects.exclude(sequence='').order_by('id').values('id', 'name', 'amd_number', 'sequence').iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        batch = _shard_batch(item['id'])
+        if batch != shard and records:
+            yield 'plasmids_{:05d}'.format(shard), records
+            records = []
+        shard = batch
+        records.append((plasmid_fasta_header(item['id'], item['name'], item['amd_number']), item['sequence']))
+    if records:
+        yield 'plasmids_{:05d}'.format(shard), records
+
+
+def _oligo_records():
+    return [(oligo_fasta_header(item['id'], item['name']), item['sequence'])
+            for item in Oligo.objects.exclude(sequence='').order_by('id').values('id', 'name', 'sequence').iterator(chunk_size=EXPORT_CHUNK_SIZE)]
+
+
+def _protein_shards():
+    '''
+        Yields (shard name, list of (header, sequence)) for proteins
+        grouped by plasmid shards
+    '''
+    shard = None
+    records = []
+    for item in Protein.objects.exclude(sequence='').order_by('feature__plasmid_id', 'id').values(
+        'id', 'name', 'sequence', 'feature__location_str', 'feature__plasmid_id', 'feature__plasmid__name'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        batch = _shard_batch(item['feature__plasmid_id'])
+        if batch != shard and records:
+            yield 'proteins_{:05d}'.format(shard), records
+            records = []
+        shard = batch
+        records.append((protein_fasta_header(item['id'],
+                                             item['name'],
+                                             item['feature__plasmid__name'],
+                                             item['feature__location_str']
+                                             ), item['sequence']))
+    if records:
+        yield 'proteins_{:05d}'.format(shard), records
+
+
+def _run(cmd):
+    print(' '.join(cmd))
+    with Popen(cmd, stdout=PIPE, bufsize=1, universal_newlines=True) as proc:
+        for line in proc.stdout:
+            print(line.rstrip('\n\r'))
+    if proc.returncode != 0:
+        # Suppress false positive no-member error
+        # (see https://github.com/PyCQA/pylint/issues/1860)
+        # pylint: disable=no-member
+        raise CalledProcessError(proc.returncode, proc.args)
+
+
+def _read_manifest(version):
+    try:
+        with open(os.path.join(VERSIONS_DIR, version, VERSION_MANIFEST), 'r') as infile:
+            return json.load(infile)
+    except (FileNotFoundError, NotADirectoryError):
+        return {'shards': {}}
+
+
+def _export_shard(current_shards, shards, name, dbtype, records, version):
+    '''
+        Reuses shard of the current version if its fingerprint is the same,
+        otherwise writes FASTA file for a new shard.
+        Returns path of the new shard or None if the shard is reused.
+    '''
+    fingerprint = hashlib.sha256((FASTA_FORMAT_VERSION + dbtype + '\n').encode('utf-8'))
+    for header, sequence in records:
+        fingerprint.update(('>' + header + '\n' + sequence + '\n').encode('utf-8'))
+    fingerprint = fingerprint.hexdigest()
+    previous = current_shards.get(name)
+    if previous is not None and previous['fingerprint'] == fingerprint and \
+            os.path.exists(previous['path'] + BUILT_MARKER):
+        shards[name] = previous
+        return None
+    path = os.path.join(SHARDS_DIR, name + '_' + version)
+    with open(path + '.fasta', 'w') as outfile:
+        for i in range(0, len(records), EXPORT_CHUNK_SIZE):
+            outfile.write(''.join('>' + header + '\n' + sequence + '\n'
+                                  for header, sequence in records[i:i + EXPORT_CHUNK_SIZE]))
+    shards[name] = {'fingerprint': fingerprint,
+                    'path': path,
+                    'dbtype': dbtype,
+                    'sequences': len(records)
+                    }
+    return path
+
+
+def _build_shard(shard):
+    '''
+        Runs makeblastdb for exported shard.
+        Returns time spent in seconds.
+    '''
+    start_time = time.perf_counter()
+    fasta_file = shard['path'] + '.fasta'
+    try:
+        _run(['makeblastdb', '-dbtype', shard['dbtype'], '-in', fasta_file, '-out', shard['path'],
+              '-title', os.path.basename(shard['path'])])
+    finally:
+        os.remove(fasta_file)
+    with open(shard['path'] + BUILT_MARKER, 'w') as outfile:
+        outfile.write(shard['fingerprint'] + '\n')
+    return time.perf_counter() - start_time
+
+
+def _make_alias(db_path, dbtype, shard_paths, title):
+    '''
+        Writes alias database combining shards
+    '''
+    if not shard_paths:
+        return
+    dblist_file = db_path + '.dblist'
+    with open(dblist_file, 'w') as outfile:
+        for shard_path in shard_paths:
+            outfile.write(shard_path + '\n')
+    try:
+        _run(['blastdb_aliastool', '-dblist_file', dblist_file, '-dbtype', dbtype,
+              '-out', db_path, '-title', title])
+    finally:
+        os.remove(dblist_file)
+
+
+def _count_sequences(db_path, dbtype):
+    '''
+        Returns number of sequences in BLAST database reported by blastdbcmd
+    '''
+    cmd = ['blastdbcmd', '-db', db_path, '-dbtype', dbtype, '-info']
+    with Popen(cmd, stdout=PIPE, stderr=STDOUT, universal_newlines=True) as proc:
+        output, _ = proc.communicate()
+    if proc.returncode != 0:
+        raise BlastDatabaseError('blastdbcmd failed for ' + db_path + ':\n' + output)
+    match = re.search(r'([\d,]+) sequences', output)
+    if match is None:
+        raise BlastDatabaseError('Cannot read number of sequences in ' + db_path + ':\n' + output)
+    return int(match.group(1).replace(',', ''))
+
+
+def _validate_version(version_dir):
+    '''
+        Checks that the new databases have as many sequences
+        as the database tables
+    '''
+    expected = {'nucl': Plasmid.objects.exclude(sequence='').count() + Oligo.objects.exclude(sequence='').count(),
+                'prot': Protein.objects.exclude(sequence='').count()
+                }
+    for db_path, dbtype in ((BLAST_NUCL_DB, 'nucl'), (BLAST_PROT_DB, 'prot')):
+        if not expected[dbtype]:
+            continue
+        sequence_count = _count_sequences(os.path.join(version_dir, os.path.basename(db_path)), dbtype)
+        if sequence_count != expected[dbtype]:
+            raise BlastDatabaseError(os.path.basename(db_path) + ' database has ' + str(sequence_count) +
+                                     ' sequences, expected ' + str(expected[dbtype]))
+
+
+def _activate_version(version):
+    '''
+        Points the "current" symlink to the version directory
+    '''
+    tmp_link = CURRENT_LINK + '.tmp'
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.join('versions', version), tmp_link)
+    os.replace(tmp_link, CURRENT_LINK)
+
+
+def collect_garbage():
+    '''
+        Deletes versions superseded more than BLAST_DB_GC_DELAY seconds ago,
+        unfinished builds and shards not used by any remaining version.
+        Returns list of deleted versions.
+    '''
+    current = get_blast_db_version()
+    now = time.time()
+    deleted = []
+    versions = sorted(os.listdir(VERSIONS_DIR))
+    for i, version in enumerate(versions):
+        version_dir = os.path.join(VERSIONS_DIR, version)
+        if version.endswith('.tmp'):
+            if now - os.path.getmtime(version_dir) > BLAST_DB_GC_DELAY:
+                shutil.rmtree(version_dir)
+            continue
+        if not current or version >= current:
+            continue
+        # A version is superseded when the next version is created
+        successor = os.path.join(VERSIONS_DIR, versions[i + 1])
+        if now - os.path.getmtime(successor) > BLAST_DB_GC_DELAY:
+            shutil.rmtree(version_dir)
+            deleted.append(version)
+    used_shards = set()
+    for version in os.listdir(VERSIONS_DIR):
+        for shard in _read_manifest(version)['shards'].values():
+            used_shards.add(os.path.basename(shard['path']))
+    for filename in os.listdir(SHARDS_DIR):
+        shard = filename.split('.')[0]
+        if shard in used_shards:
+            continue
+        if now - os.path.getmtime(os.path.join(SHARDS_DIR, filename)) > BLAST_DB_GC_DELAY:
+            os.remove(os.path.join(SHARDS_DIR, filename))
+    return deleted
+
+
+def update_blast_databases(force=False):
+    '''
+        Builds shards with changed content and activates a new
+        database version. Rewrites the sequence index if nucleotide
+        sequences changed. If force is True, all shards are rebuilt.
+        Shards are exported one at a time, and makeblastdb runs
+        for exported shards in BLAST_DB_BUILD_WORKERS threads,
+        so nucleotide and protein shards are built concurrently.
+        Returns lists of rebuilt and deleted shards, the active version
+        and dictionary of stage timings in seconds.
+    '''
+    Path(SHARDS_DIR).mkdir(parents=True, exist_ok=True)
+    Path(VERSIONS_DIR).mkdir(parents=True, exist_ok=True)
+    current_version = get_blast_db_version()
+    current_shards = {} if force else _read_manifest(current_version)['shards']
+    version = 'v' + datetime.now().strftime('%Y%m%d%H%M%S%f')
+    version_dir = os.path.join(VERSIONS_DIR, version)
+    shards = {}
+    rebuilt = []
+    builds = {}
+    timings = {'export': 0.0, 'makeblastdb nucl': 0.0, 'makeblastdb prot': 0.0}
+    index_writer = SequenceIndexWriter()
+
+    def export(name, dbtype, records, circular=None):
+        start_time = time.perf_counter()
+        if circular is not None:
+            for header, sequence in records:
+                index_writer.add(header, sequence, circular=circular)
+        if _export_shard(current_shards, shards, name, dbtype, records, version) is not None:
+            rebuilt.append(name)
+            builds[name] = executor.submit(_build_shard, shards[name])
+        timings['export'] += time.perf_counter() - start_time
+
+    try:
+        with ThreadPoolExecutor(max_workers=BLAST_DB_BUILD_WORKERS) as executor:
+            # Plasmid and protein shards alternate, so that both database
+            # types are built while the rest is exported
+            plasmid_shards = _plasmid_shards()
+            protein_shards = _protein_shards()
+            while plasmid_shards is not None or protein_shards is not None:
+                if plasmid_shards is not None:
+                    item = next(plasmid_shards, None)
+                    if item is None:
+                        plasmid_shards = None
+                    else:
+                        export(item[0], 'nucl', item[1], circular=True)
+                if protein_shards is not None:
+                    item = next(protein_shards, None)
+                    if item is None:
+                        protein_shards = None
+                    else:
+                        export(item[0], 'prot', item[1])
+            records = _oligo_records()
+            if records:
+                export('oligos', 'nucl', records, circular=False)
+            for name, build in builds.items():
+                timings['makeblastdb ' + shards[name]['dbtype']] += build.result()
+        deleted = sorted(set(current_shards) - set(shards))
+        nucl_changed = deleted or any(shards[name]['dbtype'] == 'nucl' for name in rebuilt)
+        if current_version and not rebuilt and not deleted:
+            if index_writer.exists():
+                index_writer.abort()
+            else:
+                index_writer.close()
+            collect_garbage()
+            return rebuilt, deleted, current_version, timings
+        start_time = time.perf_counter()
+        os.mkdir(version_dir + '.tmp')
+        _make_alias(os.path.join(version_dir + '.tmp', os.path.basename(BLAST_NUCL_DB)),
+                    'nucl',
+                    [shard['path'] for shard in shards.values() if shard['dbtype'] == 'nucl'],
+                    'Plasmidoro plasmids and oligos ' + version
+                    )
+        _make_alias(os.path.join(version_dir + '.tmp', os.path.basename(BLAST_PROT_DB)),
+                    'prot',
+                    [shard['path'] for shard in shards.values() if shard['dbtype'] == 'prot'],
+                    'Plasmidoro proteins ' + version
+                    )
+        timings['aliases'] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        _validate_version(version_dir + '.tmp')
+        timings['validation'] = time.perf_counter() - start_time
+        with open(os.path.join(version_dir + '.tmp', VERSION_MANIFEST), 'w') as outfile:
+            json.dump({'version': version, 'shards': shards}, outfile, indent=1, sort_keys=True)
+    except Exception:
+        index_writer.abort()
+        if os.path.exists(version_dir + '.tmp'):
+            shutil.rmtree(version_dir + '.tmp')
+        raise
+    os.rename(version_dir + '.tmp', version_dir)
+    _activate_version(version)
+    if nucl_changed or force or not index_writer.exists():
+        index_writer.close()
+    else:
+        index_writer.abort()
+    collect_garbage()
+    return rebuilt, deleted, version, timings
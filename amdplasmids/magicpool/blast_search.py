@@ -1,11 +1,18 @@
-import os
 import re
 import logging
 from Bio.SeqRecord import SeqRecord
 from Bio.Seq import Seq
-from subprocess import Popen, PIPE, STDOUT
 from django.core.exceptions import SuspiciousOperation
-from amdplasmids.settings import BLAST_PROT_DB, BLAST_NUCL_DB
+from magicpool import search_cache
+from magicpool.blast_db import get_blast_db_version
+from magicpool.sequence_index import search_short_query
+from magicpool.search_backends import get_search_backend, SearchBackendError
+from amdplasmids.settings import BATCH_SEARCH_MAX_QUERIES
+
+PROTEIN_ALPHABET = 'ACDEFGHIKLMNPQRSTVWYBXZJUO'
+DNA_ALPHABET = 'GATCRYWSMKHBVDN'
+# Queries shorter than this are searched with blastn instead of megablast
+SHORT_QUERY_LENGTH = 30
 
 
 def _verify_alphabet(sequence, alphabet):
@@ -29,6 +36,47 @@ def _sanitize_sequence(query):
     sequence = ''.join([i if ord(i) < 128 else '' for i in sequence])
     sequence = re.sub(r"[^^a-zA-Z]", '', sequence)
     return query_id, sequence
+
+def _parse_fasta(query):
+    '''
+        Splits multi-FASTA text into a list of (query_id, sequence) tuples.
+        Query IDs are trimmed to the first word, as reported by BLAST,
+        and made unique.
+    '''
+    records = []
+    query = query.replace('\r', '').strip()
+    if not query:
+        return records
+    if query.startswith('>'):
+        chunks = ['>' + chunk for chunk in ('\n' + query).split('\n>')[1:]]
+    else:
+        chunks = [query]
+    seen_ids = set()
+    for chunk in chunks:
+        query_id, sequence = _sanitize_sequence(chunk)
+        query_id = query_id.split()[0] if query_id.split() else 'query'
+        unique_id = query_id
+        suffix = 1
+        while unique_id in seen_ids:
+            suffix += 1
+            unique_id = query_id + '_' + str(suffix)
+        seen_ids.add(unique_id)
+        records.append((unique_id, sequence))
+    return records
+
+def _rename_query(hits, sequence_id):
+    '''
+        Replaces query ID in cached hits with ID of the current query
+    '''
+    if not sequence_id.split():
+        return hits
+    query_id = sequence_id.split()[0]
+    result = []
+    for hit in hits:
+        row = hit.split('\t')
+        row[0] = query_id
+        result.append('\t'.join(row))
+    return result
     
 def validate_params(params):
     '''
@@ -118,7 +166,6 @@ def run_protein_search(params):
         print('Parameters: %s', str(params))
         return result, searchcontext, 0, ''
     query = params['sequence']
-    PROTEIN_ALPHABET = 'ACDEFGHIKLMNPQRSTVWYBXZJUO'
     
     searchcontext = ''
     query_id, query_sequence = _sanitize_sequence(query)
@@ -135,77 +182,28 @@ def run_protein_search(params):
                         'FASTA header and valid sequence required.'
         return result, searchcontext, 0, params['tool']
     query_len = len(seq_record)
-    if params['tool'] == 'blastp':
-        blast_db = BLAST_PROT_DB
-        args = [
-            'blastp',
-            '-db',
-            blast_db,
-            '-max_target_seqs', params['hitstoshow'],
-            '-evalue', params['evalue'],
-            '-matrix=PAM30',
-            '-outfmt',
-            '6'
-            ]
-        with Popen(args,
-                   stdin=PIPE,
-                   stdout=PIPE,
-                   stderr=STDOUT,
-                   bufsize=1,
-                   universal_newlines=True
-                   ) as p:
-            blastoutput, err = p.communicate('>' + sequence_id + '\n' + sequence)
-        if p.returncode != 0:
-            searchcontext = 'BLASTP finished with error:\n' + '\n'.join(err)
-            print('BLASTP finished with error. Parameters: %s \n %s',
-                         str(params), '\n'.join(err)
-                         )
-            return result, searchcontext, 0, params['tool']
-    elif params['tool'] == 'tblastn':
-        blast_db = BLAST_NUCL_DB
-        args = [
-            'tblastn',
-            '-db', blast_db,
-            '-max_target_seqs', params['hitstoshow'],
-            '-evalue', params['evalue'],
-            '-soft_masking', 'false',
-            '-outfmt', '6'
-            ]
-        print(' '.join(args))
-        with Popen(args,
-                   stdin=PIPE,
-                   stdout=PIPE,
-                   stderr=STDOUT,
-                   bufsize=1,
-                   universal_newlines=True
-                   ) as p:
-            blastoutput, err = p.communicate('>' + sequence_id + '\n' + sequence)
-        if p.returncode != 0:
-            if err is None:
-                err = ['Execution error',]
-            searchcontext = 'BLASTN finished with error:\n' + '\n'.join(err)
-            print('BLASTN finished with error. Parameters: %s \n %s',
-                         str(params), '\n'.join(err)
-                         )
-            return result, searchcontext, 0, params['tool']
-    else:
+    if params['tool'] not in ('blastp', 'tblastn'):
         return result, searchcontext, 0, params['tool']
-        
-    for line in blastoutput.split('\n'):
-        print(line)
-        if line.startswith('#'):
-            continue
-        row = line.rstrip('\n\r').split('\t')
-        if len(row) < 12:
-            continue
-        if not sequence_id.startswith(row[0]):
-            continue
-        result.append('\t'.join(row))
+    backend = get_search_backend(params['tool'])
+    if backend.cacheable:
+        db_version = get_blast_db_version()
+        cache_key = search_cache.make_key(params['tool'], sequence, params, db_version)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            hits, searchcontext, _ = cached
+            return _rename_query(hits, sequence_id), searchcontext, query_len, params['tool']
+    try:
+        result = backend.search(params['tool'], [(sequence_id, sequence)], params)
+    except SearchBackendError as e:
+        searchcontext = params['tool'].upper() + ' finished with error:\n' + str(e)
+        print(params['tool'].upper() + ' finished with error. Parameters: %s \n %s',
+                     str(params), str(e)
+                     )
+        return [], searchcontext, 0, params['tool']
     if not result:
         searchcontext = 'No hits found'
-    if len(result) > int(params['hitstoshow']):
-        result = result[:int(params['hitstoshow'])]
-    print(result)
+    if backend.cacheable:
+        search_cache.put(cache_key, params['tool'], result, searchcontext, query_len, db_version)
     return result, searchcontext, query_len, params['tool']
 
 def run_nucleotide_search(params):
@@ -220,8 +218,6 @@ def run_nucleotide_search(params):
         print('Parameters: %s', str(params))
         return result, searchcontext, 0, ''
     query = params['sequence']
-    DNA_ALPHABET = 'GATCRYWSMKHBVDN'
-    blast_db = BLAST_NUCL_DB
     searchcontext = ''
     query_id, query_sequence = _sanitize_sequence(query)
     seq_record = SeqRecord(Seq(query_sequence), id=query_id)
@@ -238,45 +234,93 @@ def run_nucleotide_search(params):
         searchcontext = 'Wrong sequence format. FASTA header and sequence required.' +\
                         'Multiple entries not supported.'
         return result, searchcontext, 0, sequence_id
-    args = [
-        'blastn',
-        '-db', blast_db,
-        '-max_target_seqs', params['hitstoshow'],
-        '-evalue', params['evalue'],
-        '-dust', 'no',
-        '-soft_masking', 'false',
-        '-outfmt', '6'
-        ]
-    if len(sequence) < 30:
-        args.append('-task')
-        args.append('blastn')
-    with Popen(args,
-               stdin=PIPE,
-               stdout=PIPE,
-               stderr=STDOUT,
-               bufsize=1,
-               universal_newlines=True
-               ) as p:
-        blastoutput, err = p.communicate('>' + sequence_id + '\n' + sequence)
-    if p.returncode != 0:
-        if err is None:
-            err = ['Execution error',]
-        searchcontext = 'BLASTN finished with error:\n' + '\n'.join(err)
+    if len(sequence) < SHORT_QUERY_LENGTH:
+        # Short queries are served from the in-process sequence index if possible
+        index_query_id = sequence_id.split()[0] if sequence_id.split() else 'Query_1'
+        hits = search_short_query(index_query_id, sequence, params)
+        if hits:
+            return hits, '', query_len, sequence_id
+    backend = get_search_backend('blastn')
+    if backend.cacheable:
+        db_version = get_blast_db_version()
+        cache_key = search_cache.make_key('blastn', sequence, params, db_version)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            hits, searchcontext, _ = cached
+            return _rename_query(hits, sequence_id), searchcontext, query_len, sequence_id
+    try:
+        result = backend.search('blastn',
+                                [(sequence_id, sequence)],
+                                params,
+                                short_query=len(sequence) < SHORT_QUERY_LENGTH
+                                )
+    except SearchBackendError as e:
+        searchcontext = 'BLASTN finished with error:\n' + str(e)
         print('BLASTN finished with error. Parameters: %s \n %s',
-                     str(params), '\n'.join(err)
+                     str(params), str(e)
                      )
-        return result, searchcontext, 0, sequence_id
-    for line in blastoutput.split('\n'):
-        if line.startswith('#'):
-            continue
-        row = line.rstrip('\n\r').split('\t')
-        if len(row) < 12:
-            continue
-        if not sequence_id.startswith(row[0]):
-            continue
-        result.append('\t'.join(row))
+        return [], searchcontext, 0, sequence_id
     if not result:
         searchcontext = 'No hits found'
-    if len(result) > int(params['hitstoshow']):
-        result = result[:int(params['hitstoshow'])]
+    if backend.cacheable:
+        search_cache.put(cache_key, 'blastn', result, searchcontext, query_len, db_version)
     return result, searchcontext, query_len, sequence_id
+
+
+def run_batch_search(params):
+    '''
+        Runs one BLAST search for all sequences of a multi-FASTA query.
+        Hits are returned in tabular format with query length 
+        in the 13th column.
+    '''
+    result = []
+    try:
+        params = validate_params(params)
+    except SuspiciousOperation as e:
+        searchcontext = str(e)
+        print('Parameters: %s', str(params))
+        return result, searchcontext, 0, ''
+    tool = params['tool']
+    records = _parse_fasta(params['sequence'])
+    if not records:
+        searchcontext = 'Wrong sequence format. FASTA header and sequence required.'
+        return result, searchcontext, 0, tool
+    if len(records) > BATCH_SEARCH_MAX_QUERIES:
+        searchcontext = 'Too many sequences: ' + str(len(records)) +\
+                        '. Maximum number of sequences is ' +\
+                        str(BATCH_SEARCH_MAX_QUERIES) + '.'
+        return result, searchcontext, 0, tool
+    if tool == 'blastn':
+        alphabet = DNA_ALPHABET
+    else:
+        alphabet = PROTEIN_ALPHABET
+    for query_id, sequence in records:
+        if not sequence or not _verify_alphabet(sequence.upper(), alphabet):
+            searchcontext = 'Wrong sequence format for ' + query_id + '. ' +\
+                            'FASTA header and valid sequence required.'
+            return result, searchcontext, 0, tool
+    query_len = sum(len(sequence) for _, sequence in records)
+    query_fasta = ''.join('>' + query_id + '\n' + sequence + '\n' for query_id, sequence in records)
+    backend = get_search_backend(tool)
+    if backend.cacheable:
+        db_version = get_blast_db_version()
+        cache_key = search_cache.make_key(tool, query_fasta, params, db_version)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            hits, searchcontext, _ = cached
+            return hits, searchcontext, query_len, tool
+    short_query = min(len(sequence) for _, sequence in records) < SHORT_QUERY_LENGTH
+    try:
+        result = backend.search(tool, records, params, short_query=short_query, with_qlen=True)
+    except SearchBackendError as e:
+        searchcontext = tool.upper() + ' finished with error:\n' + str(e)
+        print(tool.upper() + ' finished with error. Parameters: %s \n %s',
+                     str(params), str(e)
+                     )
+        return [], searchcontext, 0, tool
+    searchcontext = ''
+    if not result:
+        searchcontext = 'No hits found'
+    if backend.cacheable:
+        search_cache.put(cache_key, tool, result, searchcontext, query_len, db_version)
+    return result, searchcontext, query_len, tool
@@ -73,7 +73,7 @@ def export_plasmid(plasmid, output_buffer):
     source_location = sf.FeatureLocation(sf.ExactPosition(0), sf.ExactPosition(len(seqrecord)), strand=+1)
     source_feature = sf.SeqFeature(source_location, type='source', qualifiers={'organism':plasmid.name,'mol_type':'genomic DNA', 'db_xref':'taxon:29278'})
     seqrecord.features.append(source_feature)
-    for feature in Feature.objects.filter(plasmid=plasmid):
+    for feature in plasmid.feature_set.select_related('feature_type'):
         feature_location = sf.FeatureLocation(feature.start, feature.end, strand=feature.strand)
         feature_obj = sf.SeqFeature(feature_location, type=feature.feature_type.name, qualifiers={'note':feature.description,'name':feature.name,'location':feature.location_str})
         seqrecord.features.append(feature_obj)
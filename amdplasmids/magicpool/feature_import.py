@@ -0,0 +1,153 @@
+"""
+    Bulk import of plasmid features and proteins.
+
+    import_features() creates the same Feature and Protein rows as
+    calling create_feature() for every SeqFeature of a record, but
+    checks duplicates in memory, resolves feature types from a dictionary
+    loaded once and inserts features and proteins with bulk_create
+    in a single transaction.
+"""
+from django.db import transaction
+from magicpool.models import Feature, Feature_type, Protein
+from magicpool import text_index
+
+# Names of misc_feature types guessed from feature name
+MISC_FEATURE_RULES = [
+    (lambda name: name.endswith('romoter'), 'promoter'),
+    (lambda name: 'origin of replication' in name, 'rep_origin'),
+    (lambda name: name.startswith('Ori'), 'rep_origin'),
+    (lambda name: name == 'ColE1', 'rep_origin'),
+    (lambda name: 'BsmBI' in name, 'restriction_site'),
+    (lambda name: 'inverted repeat' in name, 'IR'),
+    (lambda name: 'transposase enzyme' in name, 'gene'),
+]
+
+
+def feature_type_name(name, type_label):
+    '''
+        Returns name of feature type for feature name and GenBank feature key
+    '''
+    if type_label == 'misc_feature':
+        for rule, feature_type in MISC_FEATURE_RULES:
+            if rule(name):
+                return feature_type
+        return 'misc_feature'
+    return type_label
+
+
+class FeatureTypeCache:
+    '''
+        Feature types by name, loaded from the database once.
+        Missing types are created.
+    '''
+    def __init__(self):
+        self.feature_types = {item.name: item for item in Feature_type.objects.all()}
+
+    def get(self, name):
+        if name not in self.feature_types:
+            self.feature_types[name] = Feature_type.objects.create(name=name)
+        return self.feature_types[name]
+
+
+def feature_name(feature):
+    '''
+        Returns feature name or empty string if the feature has no name
+    '''
+    if 'locus_tag' in feature.qualifiers:
+        name = str(feature.qualifiers['locus_tag'][0])
+    elif 'label' in feature.qualifiers:
+        name = str(feature.qualifiers['label'][0])
+    elif 'name' in feature.qualifiers:
+        name = str(feature.qualifiers['name'][0])
+    else:
+        return ''
+    return name.replace('\n', '')
+
+
+def feature_description(feature):
+    description = ''
+    if 'gene' in feature.qualifiers:
+        description += str(';' .join(feature.qualifiers['gene']))
+    if 'label' in feature.qualifiers:
+        if description != '':
+            description += '; '
+        description += str(';' .join(feature.qualifiers['label']))
+    if 'note' in feature.qualifiers:
+        if description != '':
+            description += '; '
+        description += str(feature.qualifiers['note'][0])
+    return description.replace('\n', '')
+
+
+def make_protein(feature, feature_obj):
+    '''
+        Returns unsaved Protein for a gene or CDS feature
+    '''
+    if 'gene' in feature.qualifiers:
+        protein_name = str(feature.qualifiers['gene'][0])
+    elif 'label' in feature.qualifiers:
+        protein_name = str(feature.qualifiers['label'][0])
+    elif 'locus_tag' in feature.qualifiers:
+        protein_name = str(feature.qualifiers['locus_tag'][0])
+    else:
+        protein_name = 'unknown_protein'
+    protein_name = protein_name.replace('\n', '')
+    protein_name = protein_name.replace('&nbsp;', ' ')
+    if 'product' in feature.qualifiers:
+        protein_function = str(feature.qualifiers['product'][0])
+    elif 'note' in feature.qualifiers:
+        protein_function = str(feature.qualifiers['note'][0])
+    elif 'label' in feature.qualifiers:
+        protein_function = str(feature.qualifiers['label'][0])
+    else:
+        protein_function = 'unidentified function'
+    if 'translation' in feature.qualifiers:
+        protein_sequence = ''.join(feature.qualifiers['translation'])
+    else:
+        protein_sequence = ''
+    return Protein(name=protein_name,
+                   sequence=protein_sequence,
+                   function=protein_function,
+                   feature=feature_obj
+                   )
+
+
+def import_features(seq_features, plasmid_obj, feature_types=None):
+    '''
+        Creates features and proteins of a plasmid.
+        Features with the same coordinates as an existing
+        or previously imported feature are skipped.
+        Returns number of created features.
+    '''
+    if feature_types is None:
+        feature_types = FeatureTypeCache()
+    with transaction.atomic():
+        seen = set(Feature.objects.filter(plasmid=plasmid_obj).values_list('start', 'end', 'strand'))
+        features = []
+        for feature in seq_features:
+            coordinates = (int(feature.location.start), int(feature.location.end), int(feature.location.strand))
+            if coordinates in seen or feature.type == 'source':
+                continue
+            name = feature_name(feature)
+            if name == '':
+                print('This feature has no name:')
+                print(str(feature))
+                continue
+            seen.add(coordinates)
+            feature_start, feature_end, feature_strand = coordinates
+            feature_type = feature_types.get(feature_type_name(name, feature.type))
+            features.append((feature, Feature(name=name,
+                                              plasmid=plasmid_obj,
+                                              feature_type=feature_type,
+                                              sequence_id=plasmid_obj.name,
+                                              start=feature_start,
+                                              end=feature_end,
+                                              strand=feature_strand,
+                                              location_str=str(feature.location),
+                                              description=feature_description(feature)
+                                              )))
+        Feature.objects.bulk_create([feature_obj for _, feature_obj in features])
+        Protein.objects.bulk_create([make_protein(feature, feature_obj) for feature, feature_obj in features
+                                     if feature_obj.feature_type.name == 'gene' or 'translation' in feature.qualifiers])
+        text_index.update(Feature, [feature_obj.id for _, feature_obj in features])
+    return len(features)
@@ -0,0 +1,168 @@
+"""
+    Feature library built from curated plasmid features.
+
+    build_library() collects sequences of existing features, one entry per
+    distinct sequence with its most frequent name and feature type, and
+    save_library() writes them into FEATURE_LIBRARY_FILE. Features spanning
+    the origin are included, with the sequence joined across the origin
+    (see feature_sequence). FeatureAnnotator finds exact copies of library
+    sequences in a plasmid on both strands, including copies spanning
+    the origin of a circular plasmid, which get a compound location.
+    Candidate positions are found by looking up every k-mer of the plasmid
+    in a dictionary of library sequence prefixes, where k is
+    the shortest library sequence length. Every library sequence is at
+    least k bases long, so the dictionary is used instead of
+    an Aho-Corasick automaton.
+"""
+import os
+import json
+from collections import Counter, defaultdict
+from Bio.SeqFeature import SeqFeature, FeatureLocation
+from magicpool.models import Plasmid, Feature, feature_sequence
+from amdplasmids.settings import FEATURE_LIBRARY_FILE, FEATURE_LIBRARY_MIN_LENGTH
+
+_COMPLEMENT = str.maketrans('ACGTRYKMBVDHN', 'TGCAYRMKVBHDN')
+# Note added to features found by the annotator
+LIBRARY_NOTE = 'Feature library match'
+
+_library = None
+_library_mtime = None
+
+
+def _reverse_complement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def build_library(min_length=FEATURE_LIBRARY_MIN_LENGTH):
+    '''
+        Returns list of feature library entries (dictionaries with name,
+        feature type and sequence) for distinct feature sequences
+        not shorter than min_length, including features spanning the origin
+    '''
+    plasmid_sequences = dict(Plasmid.objects.exclude(sequence='').values_list('id', 'sequence'))
+    names = defaultdict(Counter)
+    for plasmid_id, name, feature_type, start, end, strand, location_str in Feature.objects.values_list(
+        'plasmid_id', 'name', 'feature_type__name', 'start', 'end', 'strand', 'location_str'
+    ).iterator(chunk_size=2000):
+        if feature_type is None or plasmid_id not in plasmid_sequences:
+            continue
+        sequence = feature_sequence(plasmid_sequences[plasmid_id], start, end, strand, location_str).upper()
+        if len(sequence) < min_length:
+            continue
+        names[sequence][(name, feature_type)] += 1
+    result = []
+    for sequence, counter in names.items():
+        # Most frequent name, then alphabetically first
+        name, feature_type = min(counter, key=lambda item: (-counter[item], item))
+        result.append({'name': name, 'type': feature_type, 'sequence': sequence})
+    result.sort(key=lambda item: (item['name'], item['sequence']))
+    return result
+
+
+def save_library(entries, path=FEATURE_LIBRARY_FILE):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as outfile:
+        json.dump(entries, outfile)
+    os.replace(temp_path, path)
+
+
+class FeatureAnnotator:
+    '''
+        Finds library sequences in plasmid sequences
+    '''
+    def __init__(self, entries):
+        self.entries = entries
+        self.k = min((len(entry['sequence']) for entry in entries), default=0)
+        self.max_length = max((len(entry['sequence']) for entry in entries), default=0)
+        # (pattern, strand, entry) by first k bases of the pattern
+        self.index = defaultdict(list)
+        for entry in entries:
+            sequence = entry['sequence']
+            self.index[sequence[:self.k]].append((sequence, 1, entry))
+            reverse = _reverse_complement(sequence)
+            if reverse != sequence:
+                self.index[reverse[:self.k]].append((reverse, -1, entry))
+
+    def find(self, sequence, circular=True):
+        '''
+            Returns list of (start, end, strand, library entry) for library
+            sequences found in the sequence. For matches spanning the origin,
+            end is greater than the sequence length.
+        '''
+        if not self.entries:
+            return []
+        sequence = sequence.upper()
+        seq_len = len(sequence)
+        text = sequence
+        if circular:
+            text = sequence + sequence[:self.max_length - 1]
+        k = self.k
+        index = self.index
+        result = []
+        for start in range(min(seq_len, len(text) - k + 1)):
+            candidates = index.get(text[start:start + k])
+            if candidates is None:
+                continue
+            for pattern, strand, entry in candidates:
+                if len(pattern) <= seq_len and text.startswith(pattern, start):
+                    result.append((start, start + len(pattern), strand, entry))
+        return result
+
+    def seq_features(self, sequence, circular=True):
+        '''
+            Returns list of SeqFeature objects for library sequences
+            found in the sequence
+        '''
+        seq_len = len(sequence)
+        result = []
+        for start, end, strand, entry in self.find(sequence, circular):
+            if end > seq_len:
+                location = FeatureLocation(start, seq_len, strand=strand) + \
+                    FeatureLocation(0, end - seq_len, strand=strand)
+                if strand == -1:
+                    location.parts.reverse()
+            else:
+                location = FeatureLocation(start, end, strand=strand)
+            result.append(SeqFeature(location, type=entry['type'],
+                                     qualifiers={'label': [entry['name']], 'note': [LIBRARY_NOTE]}))
+        return result
+
+
+def get_annotator():
+    '''
+        Returns FeatureAnnotator for the saved library or None
+        if there is no library. The library is reloaded if the file changes.
+    '''
+    global _library, _library_mtime
+    try:
+        mtime = os.stat(FEATURE_LIBRARY_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _library is None or mtime != _library_mtime:
+        with open(FEATURE_LIBRARY_FILE, 'r') as infile:
+            _library = FeatureAnnotator(json.load(infile))
+        _library_mtime = mtime
+    return _library
+
+
+def annotate_records(records):
+    '''
+        Yields SeqRecords with library features added to the first record
+    '''
+    for i, seq_record in enumerate(records):
+        if i == 0:
+            annotate_record(seq_record)
+        yield seq_record
+
+
+def annotate_record(seq_record):
+    '''
+        Adds features found by the library annotator to the SeqRecord
+        and returns number of added features
+    '''
+    annotator = get_annotator()
+    if annotator is None:
+        return 0
+    features = annotator.seq_features(str(seq_record.seq))
+    seq_record.features.extend(features)
+    return len(features)
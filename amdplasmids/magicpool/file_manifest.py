@@ -0,0 +1,118 @@
+"""
+    Manifest of imported plasmid map files.
+
+    Sequence_file_manifest keeps size, modification time and checksum of
+    every plasmid map file seen by import_plasmids. A file with the same
+    size and modification time as in the manifest is skipped without
+    opening it. If the stats differ, the file is hashed, and it is parsed
+    only if the checksum has changed too.
+"""
+import os
+from django.utils import timezone
+from magicpool.models import Plasmid, Sequence_file_manifest
+from magicpool.plasmid_parser import file_checksum
+
+SKIP = 'skip'
+PARSE = 'parse'
+STATUS_IMPORTED = 'imported'
+STATUS_NOT_IMPORTED = 'not imported'
+# Existing plasmid was not updated because overwrite was not allowed
+STATUS_NO_OVERWRITE = 'not imported, no overwrite'
+STATUS_ERROR = 'error'
+
+
+def import_status(ret_val, overwrite_existing):
+    '''
+        Returns manifest status for the return value of a plasmid file import
+    '''
+    if ret_val:
+        return STATUS_IMPORTED
+    if overwrite_existing:
+        return STATUS_NOT_IMPORTED
+    return STATUS_NO_OVERWRITE
+
+
+class FileManifest:
+    '''
+        Checks plasmid map files against the manifest and records
+        import results. Changes are written by save().
+    '''
+    def __init__(self):
+        self.entries = {item.path: item for item in Sequence_file_manifest.objects.all()}
+        # A file is skipped only if its plasmid still exists
+        self.plasmid_names = set(Plasmid.objects.values_list('name', flat=True))
+        self.seen = set()
+        self.changed = {}
+        self.counts = {'skipped': 0, 'hashed': 0, 'reparsed': 0}
+
+    def check(self, filepath, sequence_file, seq_name, overwrite_existing):
+        '''
+            Returns SKIP or PARSE and checksum of the file.
+            Files that failed to import and files not imported because
+            overwrite was not allowed are parsed again.
+        '''
+        self.seen.add(sequence_file)
+        stat = os.stat(filepath)
+        entry = self.entries.get(sequence_file)
+        if entry is None or seq_name not in self.plasmid_names:
+            reusable = False
+        elif entry.status == STATUS_NO_OVERWRITE:
+            reusable = not overwrite_existing
+        else:
+            reusable = entry.status != STATUS_ERROR
+        if reusable:
+            if entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+                self.counts['skipped'] += 1
+                return SKIP, entry.checksum
+            checksum = file_checksum(filepath)
+            self.counts['hashed'] += 1
+            if checksum == entry.checksum:
+                self._update(sequence_file, stat, checksum, entry.status)
+                return SKIP, checksum
+        else:
+            checksum = file_checksum(filepath)
+            self.counts['hashed'] += 1
+        self.counts['reparsed'] += 1
+        return PARSE, checksum
+
+    def record(self, filepath, sequence_file, checksum, status):
+        '''
+            Records result of the file import
+        '''
+        self._update(sequence_file, os.stat(filepath), checksum, status)
+
+    def _update(self, sequence_file, stat, checksum, status):
+        entry = self.entries.get(sequence_file)
+        if entry is None:
+            entry = Sequence_file_manifest(path=sequence_file)
+            self.entries[sequence_file] = entry
+        entry.size = stat.st_size
+        entry.mtime_ns = stat.st_mtime_ns
+        entry.checksum = checksum
+        entry.status = status
+        entry.updated = timezone.now()
+        self.changed[sequence_file] = entry
+
+    def save(self):
+        '''
+            Writes changed entries and deletes entries of files
+            that were not seen
+        '''
+        Sequence_file_manifest.objects.bulk_create(
+            [entry for entry in self.changed.values() if entry.pk is None], batch_size=500
+        )
+        Sequence_file_manifest.objects.bulk_update(
+            [entry for entry in self.changed.values() if entry.pk is not None],
+            ['size', 'mtime_ns', 'checksum', 'status', 'updated'],
+            batch_size=500
+        )
+        removed = [entry.pk for path, entry in self.entries.items()
+                   if path not in self.seen and entry.pk is not None]
+        for i in range(0, len(removed), 500):
+            Sequence_file_manifest.objects.filter(pk__in=removed[i:i + 500]).delete()
+        self.changed = {}
+
+    def report(self):
+        return 'Plasmid files skipped: ' + str(self.counts['skipped']) + \
+            ', hashed: ' + str(self.counts['hashed']) + \
+            ', reparsed: ' + str(self.counts['reparsed'])
@@ -0,0 +1,184 @@
+"""
+    Timing and resource usage of data update stages.
+
+    A stage is measured with "with stage('name'):". It records wall time,
+    CPU time of the process and its child processes (rclone, makeblastdb),
+    RSS at the end of the stage and its change during the stage, number
+    of database queries and counters added by the stage code with count().
+    Peak RSS is known only for the whole process lifetime, so the stage
+    records the process peak so far and how much the stage raised it.
+    With RUN_LOG_TRACEMALLOC, peak memory allocated by Python during
+    the stage is recorded too.
+
+    Stages run inside a RunLog are collected into its report lines and
+    written into a JSON file in RUN_LOG_DIR, one file per run.
+"""
+import os
+import json
+import time
+import resource
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from django.db import connection
+from amdplasmids.settings import RUN_LOG_DIR, RUN_LOG_TRACEMALLOC
+
+_run_log = None
+_stages = []
+PAGE_SIZE = resource.getpagesize()
+
+
+def _current_rss_mb():
+    '''
+        Returns current resident set size of the process in MB,
+        or None where /proc is not available
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as infile:
+            return int(infile.read().split()[1]) * PAGE_SIZE / 1048576
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _cpu_time():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_utime + self_usage.ru_stime + children_usage.ru_utime + children_usage.ru_stime
+
+
+def count(name, value=1):
+    '''
+        Adds value to a counter of the current stage
+    '''
+    if _stages:
+        counters = _stages[-1].counters
+        counters[name] = counters.get(name, 0) + value
+
+
+class stage:
+    '''
+        Context manager measuring a stage
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.counters = {}
+        self.queries = 0
+        self.result = None
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = _cpu_time()
+        self.start_rss = _current_rss_mb()
+        self.start_peak_rss = _peak_rss_mb()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.query_wrapper = connection.execute_wrapper(self._count_query)
+        self.query_wrapper.__enter__()
+        _stages.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _stages.remove(self)
+        self.query_wrapper.__exit__(exc_type, exc_value, traceback)
+        end_rss = _current_rss_mb()
+        process_peak_rss = _peak_rss_mb()
+        self.result = {'stage': self.name,
+                       'wall_seconds': round(time.perf_counter() - self.start_wall, 3),
+                       'cpu_seconds': round(_cpu_time() - self.start_cpu, 3),
+                       'rss_mb': None if end_rss is None else round(end_rss, 1),
+                       'rss_change_mb': None if end_rss is None or self.start_rss is None
+                       else round(end_rss - self.start_rss, 1),
+                       # Peak values are lifetime maximums, not peaks of the stage
+                       'process_peak_rss_mb': round(process_peak_rss, 1),
+                       'peak_rss_increase_mb': round(process_peak_rss - self.start_peak_rss, 1),
+                       'children_process_peak_rss_mb': round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+                       'queries': self.queries,
+                       'counters': self.counters
+                       }
+        if tracemalloc.is_tracing():
+            self.result['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1048576, 1)
+        if exc_type is not None:
+            self.result['error'] = str(exc_value)
+        print(stage_report(self.result))
+        if _run_log is not None:
+            _run_log.stages.append(self.result)
+        return False
+
+
+def stage_report(result):
+    '''
+        Returns one-line summary of a stage
+    '''
+    report = result['stage'] + ': {:.1f} s, CPU {:.1f} s'.format(result['wall_seconds'], result['cpu_seconds'])
+    if result['rss_mb'] is not None:
+        report += ', RSS {:.0f} MB ({:+.0f} MB)'.format(result['rss_mb'], result['rss_change_mb'])
+    report += ', process peak RSS so far {:.0f} MB (+{:.0f} MB), queries {}'.format(
+        result['process_peak_rss_mb'], result['peak_rss_increase_mb'], result['queries']
+    )
+    if 'tracemalloc_peak_mb' in result:
+        report += ', Python peak {:.0f} MB'.format(result['tracemalloc_peak_mb'])
+    for name, value in result['counters'].items():
+        report += ', ' + name + ' ' + str(value)
+    if 'error' in result:
+        report += ', failed: ' + result['error']
+    return report
+
+
+class RunLog:
+    '''
+        Collects stages of a run. Use as a context manager around the run.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.started = None
+        self.path = None
+
+    def __enter__(self):
+        global _run_log
+        _run_log = self
+        self.started = datetime.now()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = _cpu_time()
+        self.own_tracemalloc = RUN_LOG_TRACEMALLOC and not tracemalloc.is_tracing()
+        if self.own_tracemalloc:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _run_log
+        _run_log = None
+        if self.own_tracemalloc:
+            tracemalloc.stop()
+        result = {'run': self.name,
+                  'started': self.started.isoformat(timespec='seconds'),
+                  'finished': datetime.now().isoformat(timespec='seconds'),
+                  'wall_seconds': round(time.perf_counter() - self.start_wall, 3),
+                  'cpu_seconds': round(_cpu_time() - self.start_cpu, 3),
+                  'peak_rss_mb': round(_peak_rss_mb(), 1),
+                  'stages': self.stages
+                  }
+        if exc_type is not None:
+            result['error'] = str(exc_value)
+        Path(RUN_LOG_DIR).mkdir(parents=True, exist_ok=True)
+        self.path = os.path.join(RUN_LOG_DIR, self.name + '_' + self.started.strftime('%Y%m%d_%H%M%S') + '.json')
+        with open(self.path, 'w') as outfile:
+            json.dump(result, outfile, indent=1)
+        return False
+
+    def report(self):
+        '''
+            Returns list of report lines for stages finished so far
+        '''
+        total_wall = time.perf_counter() - self.start_wall
+        return ['Stage timings (total {:.1f} s):'.format(total_wall)] + \
+            [stage_report(result) for result in self.stages]
@@ -1,10 +1,27 @@
-from django.core.management.base import BaseCommand
-from magicpool.plannotate import application
-from magicpool.models import Plasmid
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from magicpool.plannotate import application, plasmids_to_annotate
+from amdplasmids.settings import PLANNOTATE_WORKERS
 
 class Command(BaseCommand):
-    help = '''Annotates all plasmids
+    help = '''Annotates new plasmids and plasmids with sequences changed since the last annotation
     '''
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=PLANNOTATE_WORKERS,
+                            help='Number of pLannotate processes running at a time')
+        parser.add_argument('--since', default='',
+                            help='Also annotate plasmids last annotated before this date (YYYY-MM-DD)')
+        parser.add_argument('--limit', type=int, default=None, help='Max. number of plasmids to annotate')
+        parser.add_argument('--all', action='store_true',
+                            help='Annotate all plasmids with sequences, not only new and changed ones')
+        parser.add_argument('--no-cache', action='store_true', help='Ignore cached pLannotate results')
     def handle(self, *args, **options):
-        plasmids = Plasmid.objects.all()
-        application(plasmids)
+        since = None
+        if options['since'] != '':
+            try:
+                since = timezone.make_aware(datetime.fromisoformat(options['since']))
+            except ValueError:
+                raise CommandError('Invalid date: ' + options['since'])
+        plasmids = plasmids_to_annotate(options['all'], since, options['limit'])
+        print(application(plasmids, options['workers'], options['no_cache']))
@@ -12,10 +12,11 @@ class Command(BaseCommand):
             default='',
             help='Plasmid name'
         )
+        parser.add_argument('--no-cache', action='store_true', help='Ignore cached pLannotate results')
     def handle(self, *args, **options):
         if options['i'] != '':
             plasmid_name = options['i']
             plasmids = Plasmid.objects.filter(name = plasmid_name)
-            application(plasmids)
+            print(application(plasmids, no_cache=options['no_cache']))
         else:
             print('Plasmid name should not be empty')
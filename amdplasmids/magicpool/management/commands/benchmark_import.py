@@ -0,0 +1,17 @@
+import json
+from django.core.management.base import BaseCommand
+from magicpool.benchmark import run_import_benchmark, make_report
+
+class Command(BaseCommand):
+    help = '''Imports synthetic plasmid records with per-feature and bulk
+    feature import and reports number of queries per plasmid.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plasmids', type=int, default=50, help='Number of synthetic plasmids')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    def handle(self, *args, **options):
+        results = run_import_benchmark(options['plasmids'], options['seed'])
+        report = make_report({'plasmids': options['plasmids']}, results,
+                             {key: options[key] for key in ('plasmids', 'seed')})
+        print(json.dumps(report, indent=2))
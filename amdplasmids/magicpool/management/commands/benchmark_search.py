@@ -0,0 +1,77 @@
+import sys
+import json
+import contextlib
+from django.core.management.base import BaseCommand, CommandError
+from magicpool.benchmark import generate_corpus, corpus_stats, delete_corpus
+from magicpool.benchmark import run_benchmark, make_report
+from magicpool.util import make_blast_databases
+
+class Command(BaseCommand):
+    help = '''Generates synthetic plasmid corpus and measures sequence search latency.
+    Rebuilds BLAST databases from the whole database, and again after the corpus
+    is deleted: run it on a development copy. The report is written to standard output
+    or to the output file, progress messages to standard error.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plasmids', type=int, default=200, help='Number of synthetic plasmids')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed')
+        parser.add_argument('--repeats', type=int, default=10, help='Number of searches per measurement')
+        parser.add_argument('--nucleotide-lengths', default='25,100,500,2000', help='Comma-separated nucleotide query lengths')
+        parser.add_argument('--protein-lengths', default='50,200,500', help='Comma-separated protein query lengths')
+        parser.add_argument('--hitstoshow', default='10,100,1000', help='Comma-separated numbers of hits')
+        parser.add_argument('--output', default='', help='Output JSON file (default: standard output)')
+        parser.add_argument('--reuse-corpus', action='store_true', help='Use existing synthetic corpus')
+        parser.add_argument('--no-blast-db', action='store_true', help='Do not rebuild BLAST databases')
+        parser.add_argument('--skip-views', action='store_true', help='Benchmark search functions only')
+        parser.add_argument('--keep', action='store_true', help='Keep synthetic corpus in the database')
+
+    def handle(self, *args, **options):
+        try:
+            nucleotide_lengths = [int(x) for x in options['nucleotide_lengths'].split(',') if x]
+            protein_lengths = [int(x) for x in options['protein_lengths'].split(',') if x]
+            hitstoshow_values = [int(x) for x in options['hitstoshow'].split(',') if x]
+        except ValueError:
+            raise CommandError('Query lengths and hitstoshow must be comma-separated integers')
+        for hitstoshow in hitstoshow_values:
+            if hitstoshow not in (10, 20, 50, 100, 500, 1000):
+                raise CommandError('Unsupported hitstoshow value: ' + str(hitstoshow))
+        # Progress messages and BLAST output go to standard error,
+        # so the report on standard output can be parsed
+        with contextlib.redirect_stdout(sys.stderr):
+            if options['reuse_corpus']:
+                corpus = corpus_stats()
+            else:
+                print('Generating corpus of ' + str(options['plasmids']) + ' plasmids')
+                corpus = generate_corpus(options['plasmids'], options['seed'])
+            if not corpus['plasmids']:
+                raise CommandError('Synthetic corpus is empty')
+            if not options['no_blast_db']:
+                make_blast_databases()
+            try:
+                results = run_benchmark(nucleotide_lengths,
+                                        protein_lengths,
+                                        hitstoshow_values,
+                                        options['repeats'],
+                                        options['seed'],
+                                        views=not options['skip_views']
+                                        )
+            finally:
+                if not options['keep']:
+                    delete_corpus()
+                    if not options['no_blast_db']:
+                        # Remove the corpus from BLAST databases and the sequence index
+                        make_blast_databases()
+        report = make_report(corpus, results, {key: options[key] for key in ('plasmids',
+                                                                         'seed',
+                                                                         'repeats',
+                                                                         'nucleotide_lengths',
+                                                                         'protein_lengths',
+                                                                         'hitstoshow'
+                                                                         )})
+        if options['output']:
+            with open(options['output'], 'w') as outfile:
+                json.dump(report, outfile, indent=2)
+            print('Benchmark report written to ' + options['output'], file=sys.stderr)
+        else:
+            print(json.dumps(report, indent=2))
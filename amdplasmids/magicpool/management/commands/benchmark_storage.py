@@ -0,0 +1,16 @@
+import json
+from django.core.management.base import BaseCommand
+from magicpool.benchmark import run_storage_benchmark, make_report
+
+class Command(BaseCommand):
+    help = '''Reports database and feature table size and rendering time
+    of plasmid pages and feature search results.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=50, help='Number of plasmids')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    def handle(self, *args, **options):
+        results = run_storage_benchmark(options['samples'], options['seed'])
+        report = make_report({}, results, {key: options[key] for key in ('samples', 'seed')})
+        print(json.dumps(report, indent=2))
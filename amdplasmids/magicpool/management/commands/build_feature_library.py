@@ -0,0 +1,17 @@
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from magicpool.feature_library import build_library, save_library
+from amdplasmids.settings import FEATURE_LIBRARY_FILE, FEATURE_LIBRARY_MIN_LENGTH
+
+class Command(BaseCommand):
+    help = '''Builds library of distinct feature sequences used for annotation
+    of plasmids imported from FASTA files
+    '''
+    def add_arguments(self, parser):
+        parser.add_argument('--min-length', type=int, default=FEATURE_LIBRARY_MIN_LENGTH,
+                            help='Min. length of feature sequence')
+    def handle(self, *args, **options):
+        entries = build_library(options['min_length'])
+        Path(FEATURE_LIBRARY_FILE).parent.mkdir(parents=True, exist_ok=True)
+        save_library(entries)
+        print('Feature library entries:', len(entries), 'saved to', FEATURE_LIBRARY_FILE)
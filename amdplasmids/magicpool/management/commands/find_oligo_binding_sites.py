@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from magicpool.oligo_binding import update_oligo_binding_sites
+
+class Command(BaseCommand):
+    help = '''Finds oligo binding sites in plasmids with new or changed sequences
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recompute binding sites for all plasmids and oligos'
+        )
+    def handle(self, *args, **options):
+        print(update_oligo_binding_sites(options['force']))
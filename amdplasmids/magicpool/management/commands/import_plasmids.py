@@ -1,6 +1,7 @@
+import os
 from django.core.management.base import BaseCommand
 from magicpool.util import import_plasmids
-from amdplasmids.settings import DATA_DIR
+from amdplasmids.settings import DATA_DIR, IMPORT_WORKERS
 
 class Command(BaseCommand):
     help = '''Imports or updates plasmid records from directory tree
@@ -17,10 +18,16 @@ class Command(BaseCommand):
             action='store_true',
             help='Overwrite existing entries'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=IMPORT_WORKERS,
+            help='Number of processes parsing plasmid files'
+        )
     def handle(self, *args, **options):
         if options['i'] == '':
             work_dir = os.path.join(DATA_DIR, 'plasmid_maps')
         else:
             work_dir = options['i']
         print(work_dir)
-        import_plasmids(work_dir, options['overwrite'])
+        import_plasmids(work_dir, options['overwrite'], options['workers'])
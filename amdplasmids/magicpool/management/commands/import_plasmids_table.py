@@ -1,3 +1,4 @@
+import os
 from django.core.management.base import BaseCommand
 from magicpool.util import import_plasmids_table
 from amdplasmids.settings import DATA_DIR
@@ -22,4 +23,5 @@ class Command(BaseCommand):
             xlsx_path = os.path.join(DATA_DIR, 'plasmid_maps', 'All_plasmids_Sept6_2024.xlsx')
         else:
             xlsx_path = options['i']
-        import_plasmids_table(xlsx_path)
+        names, report = import_plasmids_table(xlsx_path, options['overwrite'])
+        print(report)
@@ -5,5 +5,11 @@ class Command(BaseCommand):
     help = '''Generates blast databases
     '''
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild all database shards'
+        )
     def handle(self, *args, **options):
-        make_blast_databases()
+        print(make_blast_databases(options['force']))
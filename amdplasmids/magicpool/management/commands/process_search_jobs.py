@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from magicpool.search_jobs import process_queue, expire_jobs
+from amdplasmids.settings import SEARCH_JOB_POLL_INTERVAL
+
+class Command(BaseCommand):
+    help = '''Runs queued sequence search jobs
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty'
+        )
+    def handle(self, *args, **options):
+        while True:
+            expire_jobs()
+            process_queue()
+            if options['once']:
+                break
+            time.sleep(SEARCH_JOB_POLL_INTERVAL)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from magicpool.text_index import rebuild
+
+class Command(BaseCommand):
+    help = '''Rebuilds the full-text index used by the text search.
+    Run it after migrating an existing database to 0019_text_index.
+    '''
+    def handle(self, *args, **options):
+        counts = rebuild()
+        for entity, row_count in counts.items():
+            self.stdout.write(entity + ': ' + str(row_count))
+        self.stdout.write('Text index rows: ' + str(sum(counts.values())))
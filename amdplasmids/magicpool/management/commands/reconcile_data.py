@@ -0,0 +1,29 @@
+import os
+from django.core.management.base import BaseCommand
+from magicpool.reconcile import Reconciliation, plasmid_table_names, oligo_table_names, strain_table_amd_numbers
+from amdplasmids.settings import DATA_DIR
+
+class Command(BaseCommand):
+    help = '''Deletes plasmids, oligos and strains missing from the data files
+    in DATA_DIR without importing anything. Plasmids without maps are compared
+    with the plasmid tables as they are before the next import.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report objects to be deleted without deleting them'
+        )
+    def handle(self, *args, **options):
+        plasmid_maps_dir = os.path.join(DATA_DIR, 'plasmid_maps')
+        reconciliation = Reconciliation(dry_run=options['dry_run'])
+        reports = [reconciliation.plasmids_without_files(plasmid_maps_dir),
+                   reconciliation.plasmids_without_maps(plasmid_table_names(plasmid_maps_dir)),
+                   reconciliation.oligos(oligo_table_names(os.path.join(DATA_DIR, 'oligos.xlsx'))),
+                   reconciliation.strains(strain_table_amd_numbers(os.path.join(DATA_DIR, 'strains.xlsx')))
+                   ]
+        reports = [report for report in reports if report]
+        if not reports:
+            reports = ['Nothing to delete']
+        print('\n'.join(reports))
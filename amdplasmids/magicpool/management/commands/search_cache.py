@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from magicpool import search_cache
+
+class Command(BaseCommand):
+    help = '''Shows sequence search cache statistics
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete all cached search results and reset counters'
+        )
+    def handle(self, *args, **options):
+        if options['clear']:
+            search_cache.clear()
+            print('Search cache cleared')
+        for key, value in search_cache.stats().items():
+            print(key + ': ' + str(value))
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:12
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0010_plasmid_magic_pool_part'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Search_job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('search_type', models.CharField(max_length=32)),
+                ('params', models.TextField()),
+                ('status', models.CharField(default='queued', max_length=32)),
+                ('tool', models.CharField(blank=True, max_length=32)),
+                ('query_len', models.PositiveIntegerField(default=0)),
+                ('hits', models.TextField(blank=True)),
+                ('searchcontext', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
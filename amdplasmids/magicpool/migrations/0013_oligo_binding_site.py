@@ -0,0 +1,38 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0012_search_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Oligo_binding_site',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.PositiveIntegerField()),
+                ('end', models.PositiveIntegerField()),
+                ('strand', models.IntegerField()),
+                ('mismatches', models.PositiveIntegerField(default=0)),
+                ('location_str', models.CharField(max_length=255)),
+                ('oligo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='magicpool.oligo')),
+                ('plasmid', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='magicpool.plasmid')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Oligo_binding_scan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence_hash', models.CharField(max_length=32)),
+                ('params', models.CharField(max_length=255)),
+                ('scanned', models.DateTimeField(auto_now=True)),
+                ('oligo', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='magicpool.oligo')),
+                ('plasmid', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='magicpool.plasmid')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0013_oligo_binding_site'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='search_job',
+            name='db_version',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0014_search_job_db_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence_file_manifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('checksum', models.CharField(max_length=32)),
+                ('status', models.CharField(max_length=32)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
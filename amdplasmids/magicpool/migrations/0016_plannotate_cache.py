@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0015_sequence_file_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Plannotate_cache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence_hash', models.CharField(max_length=32)),
+                ('annotator_version', models.CharField(max_length=255)),
+                ('result', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('sequence_hash', 'annotator_version')},
+            },
+        ),
+    ]
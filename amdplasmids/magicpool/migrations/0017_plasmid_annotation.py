@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0016_plannotate_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Plasmid_annotation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence_hash', models.CharField(max_length=32)),
+                ('annotator_version', models.CharField(max_length=255)),
+                ('annotated', models.DateTimeField(auto_now=True)),
+                ('plasmid', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='magicpool.plasmid')),
+            ],
+        ),
+    ]
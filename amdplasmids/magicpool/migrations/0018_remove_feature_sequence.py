@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 21:40
+
+from django.db import migrations
+
+
+def vacuum(apps, schema_editor):
+    # Return pages freed by the removed column to the file system
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('VACUUM')
+
+
+class Migration(migrations.Migration):
+    # VACUUM cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('magicpool', '0017_plasmid_annotation'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='feature',
+            name='sequence',
+        ),
+        migrations.RunPython(vacuum, migrations.RunPython.noop),
+    ]
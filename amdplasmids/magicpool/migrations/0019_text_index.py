@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 23:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0018_remove_feature_sequence'),
+    ]
+
+    operations = [
+        # Full-text index of magicpool.text_index. The trigram tokenizer
+        # matches any part of a word, like the former "icontains" search.
+        # Names weigh ten times more than other text in ranking.
+        # The table is created empty, existing objects are indexed
+        # by the rebuild_text_index command run after migrate.
+        migrations.RunSQL(
+            [
+                "CREATE VIRTUAL TABLE magicpool_text_index USING fts5("
+                "name, content, tokenize='trigram')",
+                "INSERT INTO magicpool_text_index (magicpool_text_index, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+            ],
+            'DROP TABLE magicpool_text_index',
+        ),
+    ]
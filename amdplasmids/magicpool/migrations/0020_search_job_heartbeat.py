@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0019_text_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='search_job',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-19 11:05
+
+import hashlib
+from django.db import migrations, models
+
+# Number of plasmids hashed in one query
+BATCH_SIZE = 500
+
+
+def hash_sequences(apps, schema_editor):
+    Plasmid = apps.get_model('magicpool', 'Plasmid')
+    ids = list(Plasmid.objects.values_list('id', flat=True).order_by('id'))
+    for i in range(0, len(ids), BATCH_SIZE):
+        plasmids = list(Plasmid.objects.filter(id__in=ids[i:i + BATCH_SIZE]).only('id', 'sequence'))
+        for plasmid in plasmids:
+            plasmid.sequence_hash = hashlib.md5(plasmid.sequence.upper().encode('utf-8')).hexdigest()
+        Plasmid.objects.bulk_update(plasmids, ['sequence_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicpool', '0020_search_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plasmid',
+            name='sequence_hash',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.RunPython(hash_sequences, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,33 @@
+import re
+import uuid
 from django.db import models
 
+_COMPLEMENT = str.maketrans('ACGTRYKMBVDHNacgtrykmbvdhn', 'TGCAYRMKVBHDNtgcayrmkvbhdn')
+# Parts of a compound location string, like "join{[90:100](+), [0:10](+)}"
+_LOCATION_PART = re.compile(r'\[[<>]?(\d+):[<>]?(\d+)\](?:\(([+-])\))?')
+
+
+def feature_sequence(plasmid_sequence, start, end, strand, location_str=''):
+    '''
+        Returns sequence of a feature on its strand. Parts of compound
+        locations, like features spanning the origin, are joined
+        in the order of the location string.
+    '''
+    if location_str.startswith('join'):
+        parts = _LOCATION_PART.findall(location_str)
+    else:
+        parts = []
+    if not parts:
+        parts = [(start, end, '-' if strand == -1 else '+')]
+    result = []
+    for part_start, part_end, part_strand in parts:
+        part = plasmid_sequence[int(part_start):int(part_end)]
+        if part_strand == '-':
+            part = part.translate(_COMPLEMENT)[::-1]
+        result.append(part)
+    return ''.join(result)
+
+
 # Create your models here.
 class Contact(models.Model):
     '''
@@ -197,6 +225,8 @@ class Plasmid(models.Model):
     contact = models.ForeignKey(Contact, on_delete=models.SET_NULL, blank=True, null=True)
     sequence_file = models.CharField(max_length=255, blank=True)
     footprint = models.CharField(max_length=32)
+    # MD5 of the upper case sequence, compared with Plasmid_annotation
+    sequence_hash = models.CharField(max_length=32, blank=True)
 
     def __str__(self):
         return self.name
@@ -210,7 +240,6 @@ class Feature(models.Model):
     name = models.CharField(max_length=255)
     plasmid = models.ForeignKey(Plasmid, on_delete=models.CASCADE)
     feature_type = models.ForeignKey(Feature_type, on_delete=models.SET_NULL, blank=True, null=True)
-    sequence = models.TextField(blank=True)
     drug_marker = models.ForeignKey(Drug_marker, on_delete=models.SET_NULL, blank=True, null=True)
     sequence_id = models.CharField(max_length=255)
     start = models.PositiveIntegerField()
@@ -219,6 +248,22 @@ class Feature(models.Model):
     location_str = models.CharField(max_length=255)
     description = models.TextField(blank=True)
 
+    def sequence_in(self, plasmid_sequence):
+        '''
+            feature sequence from an already loaded plasmid sequence,
+            reverse complement for features on the minus strand
+        '''
+        return feature_sequence(plasmid_sequence, self.start, self.end, self.strand, self.location_str)
+
+    @property
+    def sequence(self):
+        '''
+            feature sequence from the plasmid sequence. Loads the plasmid
+            if it is not loaded yet: use select_related('plasmid') or
+            sequence_in() when going through many features.
+        '''
+        return self.sequence_in(self.plasmid.sequence)
+
     def __str__(self):
         return self.plasmid.name + ': ' + self.name + ' (' + self.feature_type.name + ')'
 
@@ -263,3 +308,143 @@ class Plasmid_info(models.Model):
         return self.plasmid.name + ': ' + self.param
 
 
+class Search_job(models.Model):
+    '''
+        sequence search submitted from the nucleotide or protein search form,
+        queued in the database and run by a pool of local workers
+        
+    '''
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    search_type = models.CharField(max_length=32)
+    params = models.TextField()
+    status = models.CharField(max_length=32, default='queued')
+    tool = models.CharField(max_length=32, blank=True)
+    query_len = models.PositiveIntegerField(default=0)
+    hits = models.TextField(blank=True)
+    searchcontext = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    db_version = models.CharField(max_length=255, blank=True)
+    heartbeat = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return str(self.job_id) + ' [' + self.search_type + ': ' + self.status + ']'
+
+
+class Search_cache(models.Model):
+    '''
+        cached sequence search results keyed by query, search parameters 
+        and BLAST database version
+        
+    '''
+    key = models.CharField(max_length=64, unique=True)
+    tool = models.CharField(max_length=32)
+    db_version = models.CharField(max_length=255)
+    hits = models.TextField(blank=True)
+    searchcontext = models.TextField(blank=True)
+    query_len = models.PositiveIntegerField(default=0)
+    size = models.PositiveIntegerField(default=0)
+    hit_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.tool + ': ' + self.key
+
+
+class Search_cache_counter(models.Model):
+    '''
+        search cache hit, miss and eviction counters
+        
+    '''
+    name = models.CharField(max_length=32, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return self.name + ': ' + str(self.value)
+
+
+class Oligo_binding_site(models.Model):
+    '''
+        oligo 3' end annealing site in a plasmid
+        
+    '''
+    oligo = models.ForeignKey(Oligo, on_delete=models.CASCADE)
+    plasmid = models.ForeignKey(Plasmid, on_delete=models.CASCADE)
+    start = models.PositiveIntegerField()
+    end = models.PositiveIntegerField()
+    strand = models.IntegerField()
+    mismatches = models.PositiveIntegerField(default=0)
+    location_str = models.CharField(max_length=255)
+
+    def __str__(self):
+        return self.oligo.name + ': ' + self.plasmid.name + ' ' + self.location_str
+
+
+class Oligo_binding_scan(models.Model):
+    '''
+        sequence hash of a plasmid or oligo at the time of 
+        the last binding site search
+        
+    '''
+    plasmid = models.OneToOneField(Plasmid, on_delete=models.CASCADE, blank=True, null=True)
+    oligo = models.OneToOneField(Oligo, on_delete=models.CASCADE, blank=True, null=True)
+    sequence_hash = models.CharField(max_length=32)
+    params = models.CharField(max_length=255)
+    scanned = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        if self.plasmid_id is not None:
+            return 'plasmid ' + str(self.plasmid_id) + ': ' + self.sequence_hash
+        return 'oligo ' + str(self.oligo_id) + ': ' + self.sequence_hash
+
+
+class Sequence_file_manifest(models.Model):
+    '''
+        size, modification time and checksum of a plasmid map file
+        at the time of the last import
+        
+    '''
+    path = models.CharField(max_length=1024, unique=True)
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    checksum = models.CharField(max_length=32)
+    status = models.CharField(max_length=32)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path + ' [' + self.status + ']'
+
+
+class Plannotate_cache(models.Model):
+    '''
+        pLannotate output for a plasmid sequence, keyed by sequence hash 
+        and pLannotate version
+        
+    '''
+    sequence_hash = models.CharField(max_length=32)
+    annotator_version = models.CharField(max_length=255)
+    result = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('sequence_hash', 'annotator_version',)
+
+    def __str__(self):
+        return self.sequence_hash + ' [' + self.annotator_version + ']'
+
+
+class Plasmid_annotation(models.Model):
+    '''
+        sequence hash of a plasmid and pLannotate version at the time of 
+        the last pLannotate annotation
+        
+    '''
+    plasmid = models.OneToOneField(Plasmid, on_delete=models.CASCADE)
+    sequence_hash = models.CharField(max_length=32)
+    annotator_version = models.CharField(max_length=255)
+    annotated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.plasmid.name + ': ' + self.sequence_hash + ' [' + self.annotator_version + ']'
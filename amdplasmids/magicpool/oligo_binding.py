@@ -0,0 +1,298 @@
+"""
+    Batch search of oligo binding sites in plasmids.
+
+    Only the 3' end of an oligo (last OLIGO_BINDING_LENGTH bases) has to
+    anneal, so 5' tails and overhangs are ignored. The last
+    OLIGO_BINDING_EXACT_3PRIME bases must match exactly and are used as
+    a seed; the rest of the 3' region may have up to
+    OLIGO_BINDING_MISMATCHES mismatches. Both plasmid strands are searched
+    and plasmids are treated as circular.
+
+    Sequence hashes of scanned plasmids and oligos are kept in
+    Oligo_binding_scan, so update_oligo_binding_sites() only searches
+    plasmids and oligos that are new or have changed since the last run.
+"""
+import hashlib
+import numpy as np
+from django.db import transaction
+from magicpool.models import Plasmid, Oligo, Oligo_binding_site, Oligo_binding_scan
+from amdplasmids.settings import OLIGO_BINDING_LENGTH, OLIGO_BINDING_MIN_LENGTH
+from amdplasmids.settings import OLIGO_BINDING_MISMATCHES, OLIGO_BINDING_EXACT_3PRIME
+
+# With few seeds, str.find over the plasmid is faster than a k-mer scan
+MAX_FIND_SEEDS = 32
+# Longest seed looked up by k-mer code. The lookup table has 4 ** length items.
+MAX_CODE_LENGTH = 11
+# Max. number of IDs in a single "IN (...)" query
+CHUNK_SIZE = 500
+
+_COMPLEMENT = str.maketrans('ACGTRYKMBVDHN', 'TGCAYRMKVBHDN')
+# 2-bit codes of bases, 4 for anything else
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+    _BASE_CODES[_base] = _code
+
+
+def _reverse_complement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def _sequence_hash(sequence):
+    return hashlib.md5(sequence.upper().encode('utf-8')).hexdigest()
+
+
+def scan_params():
+    '''
+        Returns string describing current search parameters.
+        All binding sites are recomputed if parameters change.
+    '''
+    return 'length={};min_length={};mismatches={};exact_3prime={}'.format(
+        OLIGO_BINDING_LENGTH, OLIGO_BINDING_MIN_LENGTH,
+        OLIGO_BINDING_MISMATCHES, OLIGO_BINDING_EXACT_3PRIME
+    )
+
+
+def binding_region(sequence):
+    '''
+        Returns 3' region of the oligo used for binding site search
+        or None if the oligo is too short or has non-ACGT characters
+    '''
+    sequence = ''.join(sequence.upper().split())
+    region = sequence[-OLIGO_BINDING_LENGTH:]
+    if len(region) < max(OLIGO_BINDING_MIN_LENGTH, OLIGO_BINDING_EXACT_3PRIME):
+        return None
+    if set(region) - set('ACGT'):
+        return None
+    return region
+
+
+def make_seeds(oligo_regions):
+    '''
+        Returns dictionary of seed sequences for oligo 3' regions.
+        Seed is the exact-match 3' end of the oligo (forward strand)
+        or its reverse complement (reverse strand).
+        Values are lists of (oligo ID, strand, pattern) tuples, where pattern
+        is the 3' region as it appears on the plasmid forward strand.
+    '''
+    seeds = {}
+    for oligo_id, region in oligo_regions.items():
+        forward_seed = region[-OLIGO_BINDING_EXACT_3PRIME:]
+        reverse = _reverse_complement(region)
+        reverse_seed = reverse[:OLIGO_BINDING_EXACT_3PRIME]
+        seeds.setdefault(forward_seed, []).append((oligo_id, 1, region))
+        seeds.setdefault(reverse_seed, []).append((oligo_id, -1, reverse))
+    return seeds
+
+
+def seed_codes(seeds):
+    '''
+        Returns array of seed numbers by k-mer code (-1 for k-mers
+        that are not seeds) and list of seeds by number, or None
+        for few seeds and seeds too long for the table. Computed once
+        for all plasmids scanned with the same seeds.
+    '''
+    if len(seeds) <= MAX_FIND_SEEDS or OLIGO_BINDING_EXACT_3PRIME > MAX_CODE_LENGTH:
+        return None
+    seed_list = list(seeds)
+    table = np.full(4 ** OLIGO_BINDING_EXACT_3PRIME, -1, dtype=np.int32)
+    table[_kmer_codes(''.join(seed_list))[0][::OLIGO_BINDING_EXACT_3PRIME]] = np.arange(len(seed_list))
+    return table, seed_list
+
+
+def _kmer_codes(text):
+    '''
+        Returns array of 2-bit codes of the OLIGO_BINDING_EXACT_3PRIME-mers
+        starting at every position of the text and array telling
+        which k-mers have only A, C, G and T
+    '''
+    bases = _BASE_CODES[np.frombuffer(text.encode('ascii', errors='replace'), dtype=np.uint8)]
+    kmer_count = max(len(bases) - OLIGO_BINDING_EXACT_3PRIME + 1, 0)
+    # Number of ambiguous bases before every position
+    ambiguous = np.concatenate(([0], np.cumsum(bases > 3)))
+    valid = ambiguous[OLIGO_BINDING_EXACT_3PRIME:OLIGO_BINDING_EXACT_3PRIME + kmer_count] == ambiguous[:kmer_count]
+    bases = (bases & 3).astype(np.int32)
+    codes = np.zeros(kmer_count, dtype=np.int32)
+    for j in range(OLIGO_BINDING_EXACT_3PRIME):
+        codes <<= 2
+        codes |= bases[j:j + kmer_count]
+    return codes, valid
+
+
+def _seed_positions(text, seeds, codes):
+    '''
+        Yields (position, seed) for all occurrences of seeds in text
+    '''
+    if codes is None and len(seeds) <= MAX_FIND_SEEDS:
+        for seed in seeds:
+            position = text.find(seed)
+            while position != -1:
+                yield position, seed
+                position = text.find(seed, position + 1)
+        return
+    if codes is None:
+        seed_length = OLIGO_BINDING_EXACT_3PRIME
+        for position in range(len(text) - seed_length + 1):
+            seed = text[position:position + seed_length]
+            if seed in seeds:
+                yield position, seed
+        return
+    # K-mers at all text positions are looked up in the seed table at once
+    table, seed_list = codes
+    text_codes, valid = _kmer_codes(text)
+    seed_numbers = table[text_codes]
+    found = np.flatnonzero((seed_numbers >= 0) & valid)
+    for position, seed_number in zip(found.tolist(), seed_numbers[found].tolist()):
+        yield position, seed_list[seed_number]
+
+
+def find_binding_sites(plasmid_sequence, seeds, codes=None):
+    '''
+        Returns list of (oligo ID, start, end, strand, mismatches) tuples
+        for the plasmid. Start is 0-based, end is exclusive and
+        may be lower than start for sites spanning the origin.
+        codes are seed_codes(seeds), computed here if not given.
+    '''
+    if codes is None:
+        codes = seed_codes(seeds)
+    plasmid_sequence = plasmid_sequence.upper()
+    plasmid_len = len(plasmid_sequence)
+    # Circular plasmid: append its beginning to find sites across the origin
+    pad_length = OLIGO_BINDING_LENGTH - 1
+    text = plasmid_sequence + (plasmid_sequence * (pad_length // max(plasmid_len, 1) + 1))[:pad_length]
+    result = set()
+    for seed_position, seed in _seed_positions(text, seeds, codes):
+        for oligo_id, strand, pattern in seeds[seed]:
+            if strand == 1:
+                position = seed_position + OLIGO_BINDING_EXACT_3PRIME - len(pattern)
+            else:
+                position = seed_position
+            if position < 0 or position >= plasmid_len:
+                continue
+            window = text[position:position + len(pattern)]
+            if len(window) < len(pattern):
+                continue
+            mismatches = 0
+            for a, b in zip(window, pattern):
+                if a != b:
+                    mismatches += 1
+                    if mismatches > OLIGO_BINDING_MISMATCHES:
+                        break
+            if mismatches > OLIGO_BINDING_MISMATCHES:
+                continue
+            end = (position + len(pattern)) % plasmid_len or plasmid_len
+            result.add((oligo_id, position, end, strand, mismatches))
+    return sorted(result, key=lambda x: (x[1], x[0]))
+
+
+def _location_str(start, end, strand, plasmid_len):
+    if end > start:
+        location = str(start + 1) + '..' + str(end)
+    else:
+        location = 'join(' + str(start + 1) + '..' + str(plasmid_len) + ',1..' + str(end) + ')'
+    if strand == -1:
+        location = 'complement(' + location + ')'
+    return location
+
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), CHUNK_SIZE):
+        yield items[i:i + CHUNK_SIZE]
+
+
+def update_oligo_binding_sites(force=False):
+    '''
+        Finds binding sites for new and changed oligos in all plasmids
+        and for all oligos in new and changed plasmids.
+        If force is True, all binding sites are recomputed.
+        Returns report string.
+    '''
+    params = scan_params()
+    plasmid_sequences = dict(Plasmid.objects.exclude(sequence='').values_list('id', 'sequence'))
+    oligo_regions = {}
+    for oligo_id, sequence in Oligo.objects.exclude(sequence='').values_list('id', 'sequence'):
+        region = binding_region(sequence)
+        if region is not None:
+            oligo_regions[oligo_id] = region
+    plasmid_hashes = {plasmid_id: _sequence_hash(sequence) for plasmid_id, sequence in plasmid_sequences.items()}
+    oligo_hashes = {oligo_id: _sequence_hash(region) for oligo_id, region in oligo_regions.items()}
+
+    scanned_plasmids = {}
+    scanned_oligos = {}
+    for scan in Oligo_binding_scan.objects.filter(params=params):
+        if scan.plasmid_id is not None:
+            scanned_plasmids[scan.plasmid_id] = scan.sequence_hash
+        elif scan.oligo_id is not None:
+            scanned_oligos[scan.oligo_id] = scan.sequence_hash
+    if force:
+        scanned_plasmids = {}
+        scanned_oligos = {}
+    changed_plasmids = {plasmid_id for plasmid_id, sequence_hash in plasmid_hashes.items()
+                        if scanned_plasmids.get(plasmid_id) != sequence_hash}
+    changed_oligos = {oligo_id for oligo_id, sequence_hash in oligo_hashes.items()
+                      if scanned_oligos.get(oligo_id) != sequence_hash}
+    # Plasmids and oligos that lost their sequence keep no binding sites
+    removed_plasmids = set(scanned_plasmids) - set(plasmid_hashes)
+    removed_oligos = set(scanned_oligos) - set(oligo_hashes)
+    print('Plasmids to scan: ' + str(len(changed_plasmids)) + ', oligos to scan: ' + str(len(changed_oligos)))
+    if force:
+        site_count = 0
+    else:
+        site_count = Oligo_binding_site.objects.count()
+
+    new_sites = []
+    all_seeds = make_seeds(oligo_regions)
+    all_codes = seed_codes(all_seeds)
+    for plasmid_id in changed_plasmids:
+        sequence = plasmid_sequences[plasmid_id]
+        for site in find_binding_sites(sequence, all_seeds, all_codes):
+            new_sites.append((plasmid_id, len(sequence)) + site)
+    if changed_oligos:
+        changed_seeds = make_seeds({oligo_id: oligo_regions[oligo_id] for oligo_id in changed_oligos})
+        changed_codes = seed_codes(changed_seeds)
+        for plasmid_id, sequence in plasmid_sequences.items():
+            if plasmid_id in changed_plasmids:
+                continue
+            for site in find_binding_sites(sequence, changed_seeds, changed_codes):
+                new_sites.append((plasmid_id, len(sequence)) + site)
+
+    with transaction.atomic():
+        if force:
+            Oligo_binding_site.objects.all().delete()
+            Oligo_binding_scan.objects.all().delete()
+        else:
+            # Scan records with other parameters are stale
+            Oligo_binding_scan.objects.exclude(params=params).delete()
+            for chunk in _chunks(changed_plasmids | removed_plasmids):
+                site_count -= Oligo_binding_site.objects.filter(plasmid_id__in=chunk).delete()[0]
+                Oligo_binding_scan.objects.filter(plasmid_id__in=chunk).delete()
+            for chunk in _chunks(changed_oligos | removed_oligos):
+                site_count -= Oligo_binding_site.objects.filter(oligo_id__in=chunk).delete()[0]
+                Oligo_binding_scan.objects.filter(oligo_id__in=chunk).delete()
+        Oligo_binding_site.objects.bulk_create(
+            [Oligo_binding_site(plasmid_id=plasmid_id,
+                                oligo_id=oligo_id,
+                                start=start,
+                                end=end,
+                                strand=strand,
+                                mismatches=mismatches,
+                                location_str=_location_str(start, end, strand, plasmid_len)
+                                ) for plasmid_id, plasmid_len, oligo_id, start, end, strand, mismatches in new_sites],
+            batch_size=CHUNK_SIZE
+        )
+        Oligo_binding_scan.objects.bulk_create(
+            [Oligo_binding_scan(plasmid_id=plasmid_id,
+                                sequence_hash=plasmid_hashes[plasmid_id],
+                                params=params
+                                ) for plasmid_id in changed_plasmids] +
+            [Oligo_binding_scan(oligo_id=oligo_id,
+                                sequence_hash=oligo_hashes[oligo_id],
+                                params=params
+                                ) for oligo_id in changed_oligos],
+            batch_size=CHUNK_SIZE
+        )
+    site_count += len(new_sites)
+    return 'Oligo binding sites: plasmids scanned ' + str(len(changed_plasmids)) + \
+        ', oligos scanned ' + str(len(changed_oligos)) + \
+        ', binding sites ' + str(site_count) + \
+        ', new binding sites ' + str(len(new_sites))
@@ -0,0 +1,130 @@
+"""
+    Keyset pagination of lists and text search results.
+
+    Rows are ordered by a sort key and ID, and a page starts right after
+    (or ends right before) the row given by ID in the "after" ("before")
+    URL parameter. The database finds the start of a page with the index
+    of the sort key, so the time of getting a page does not depend on
+    its position in the list. The "last" parameter shows the last page.
+    Text search hits come ordered by rank as a list of IDs, and
+    ranked_page() finds the cursor row in the list.
+"""
+from django.db.models import Q
+from amdplasmids.settings import LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE
+
+
+class KeysetPage:
+    '''
+        Page of rows with cursors for links to the neighbouring pages
+    '''
+    def __init__(self, object_list, count, has_previous, has_next):
+        self.object_list = object_list
+        self.count = count
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.previous_cursor = object_list[0].id if object_list else ''
+        self.next_cursor = object_list[-1].id if object_list else ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def is_paginated(self):
+        return self.has_previous or self.has_next
+
+
+def _int_param(request, name):
+    try:
+        return int(request.GET.get(name, ''))
+    except ValueError:
+        return None
+
+
+def page_size(request):
+    '''
+        Returns page size from the "size" URL parameter or LIST_PAGE_SIZE
+    '''
+    size = _int_param(request, 'size')
+    if size is None or size < 1:
+        return LIST_PAGE_SIZE
+    return min(size, LIST_MAX_PAGE_SIZE)
+
+
+def _seek(key, value, row_id, unique, direction):
+    '''
+        Returns filter for rows after (direction 'gt') or before
+        (direction 'lt') the row with given sort key value and ID
+    '''
+    if unique:
+        return Q(**{key + '__' + direction: value})
+    return Q(**{key + '__' + direction: value}) | Q(**{key: value, 'id__' + direction: row_id})
+
+
+def keyset_page(request, queryset, key):
+    '''
+        Returns KeysetPage of the queryset ordered by the key field
+        for the "after", "before", "last" and "size" URL parameters
+    '''
+    model = queryset.model
+    unique = model._meta.get_field(key).unique
+    size = page_size(request)
+    after = _int_param(request, 'after')
+    before = _int_param(request, 'before')
+    last = request.GET.get('last', '') != ''
+    count = queryset.count()
+    cursor = after if after is not None else before
+    if cursor is not None:
+        value = model._default_manager.filter(id=cursor).values_list(key, flat=True).first()
+        if value is None:
+            # Row was deleted, start from the beginning
+            after = before = cursor = None
+    if after is not None:
+        rows = list(queryset.filter(_seek(key, value, after, unique, 'gt')).order_by(key, 'id')[:size + 1])
+        has_previous = True
+        has_next = len(rows) > size
+        rows = rows[:size]
+    elif before is not None or last:
+        if before is not None:
+            queryset = queryset.filter(_seek(key, value, before, unique, 'lt'))
+        rows = list(queryset.order_by('-' + key, '-id')[:size + 1])
+        has_previous = len(rows) > size
+        has_next = before is not None
+        rows = rows[:size]
+        rows.reverse()
+    else:
+        rows = list(queryset.order_by(key, 'id')[:size + 1])
+        has_previous = False
+        has_next = len(rows) > size
+        rows = rows[:size]
+    return KeysetPage(rows, count, has_previous, has_next)
+
+
+def ranked_page(request, queryset, ids):
+    '''
+        Returns KeysetPage of objects from the queryset with IDs given
+        as list in display order, e.g. text search hits ordered by rank.
+        IDs missing from the queryset are skipped.
+    '''
+    size = page_size(request)
+    positions = {object_id: i for i, object_id in enumerate(ids)}
+    after = positions.get(_int_param(request, 'after'))
+    before = positions.get(_int_param(request, 'before'))
+    if after is not None:
+        start = after + 1
+        end = start + size
+    elif before is not None:
+        end = before
+        start = max(end - size, 0)
+    elif request.GET.get('last', '') != '':
+        end = len(ids)
+        start = max(end - size, 0)
+    else:
+        start = 0
+        end = size
+    page_ids = ids[start:end]
+    objects = queryset.in_bulk(page_ids)
+    rows = [objects[object_id] for object_id in page_ids if object_id in objects]
+    return KeysetPage(rows, len(ids), start > 0, end < len(ids))
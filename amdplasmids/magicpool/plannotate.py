@@ -1,14 +1,32 @@
 """
     Annotate features with pLannotate
+
+    Every plasmid is annotated by a separate pLannotate process in its own
+    working subdirectory. PLANNOTATE_WORKERS processes run at a time.
+    Results are cached by plasmid sequence (see plannotate_cache).
 """
+import io
 import os
 import uuid
 import csv
+import time
+import shlex
 import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from subprocess import Popen, PIPE, CalledProcessError
-from amdplasmids.settings import TEMP_DIR
-from magicpool.models import Feature, Feature_type
+from amdplasmids.settings import TEMP_DIR, PLANNOTATE_COMMAND, PLANNOTATE_WORKERS
+from django.db import transaction
+from django.db.models import F, Q
+from magicpool.models import Plasmid, Feature, Plasmid_annotation
+from magicpool.feature_import import FeatureTypeCache
+from magicpool import text_index
+from magicpool.plannotate_cache import sequence_hash, annotator_version, get_results, save_results
+
+# Number of last lines of pLannotate output printed for a failed plasmid
+OUTPUT_LINES_ON_ERROR = 20
+# Number of plasmids whose features are written in one transaction
+POSTPROCESS_BATCH_SIZE = 500
 
 def export_plasmid_fasta(plasmid, working_dir):
     """
@@ -30,134 +48,258 @@ def export_plasmid_fasta(plasmid, working_dir):
 def preprocess(plasmids, working_dir):
     """
         Creates all directories and input files. 
+        Every plasmid gets its own subdirectory named by plasmid ID.
         Input:
             plasmids(list(Plasmid)): list of Plasmid objects
             working_dir(str): working directory, full path
         Output:
-            path of the shell script running plannotate in conda environment
+            list of (Plasmid, plasmid directory, FASTA file path) tuples
     """
     # Create directory
     if os.path.exists(working_dir) and os.path.isdir(working_dir):
         shutil.rmtree(working_dir)
     Path(working_dir).mkdir(parents=True, exist_ok=True)
     
-    # Create shell script
-    plannotate_script = os.path.join(working_dir, 'run_plannotate.sh')
-    with open(plannotate_script, 'w') as outfile:
-        outfile.write('#!/usr/bin/bash\n')
-        outfile.write('source /home/aekazakov/tools/anaconda3/etc/profile.d/conda.sh\n')
-        outfile.write('conda activate plannotate\n')
-        for plasmid in plasmids:
-            if plasmid.sequence is None or plasmid.sequence == '':
-                continue
-                print(f"Plasmid {plasmid.name} has no sequence")
-            outfile.write('echo "' + plasmid.name + '"\n')
-            outfile.write(' '.join(['plannotate', 'batch', '-i',
-                export_plasmid_fasta(plasmid, working_dir), '-c',
-                '-o', working_dir
-                ])
-                + '\n')
-        outfile.write('conda deactivate\n')
-    return plannotate_script
+    jobs = []
+    for plasmid in plasmids:
+        if plasmid.sequence is None or plasmid.sequence == '':
+            print(f"Plasmid {plasmid.name} has no sequence")
+            continue
+        plasmid_dir = os.path.join(working_dir, str(plasmid.id))
+        Path(plasmid_dir).mkdir()
+        jobs.append((plasmid, plasmid_dir, export_plasmid_fasta(plasmid, plasmid_dir)))
+    return jobs
 
 
-def run(script_path):
+def annotate_plasmid(plasmid_dir, fasta_file):
     """
-        Runs pLannotate for all plasmids.
+        Runs pLannotate for one plasmid in its directory.
+        Output:
+            (exit code, pLannotate output, run time in seconds)
     """
-    cmd = ['/bin/bash', script_path]
-    print(' '.join(cmd))
-    with Popen(cmd, stdout=PIPE, bufsize=1, universal_newlines=True) as proc:
-        for line in proc.stdout:
-            print(line, end='')
-    if proc.returncode != 0:
-        # Suppress false positive no-member error (see https://github.com/PyCQA/pylint/issues/1860)
-        # pylint: disable=no-member
-        raise CalledProcessError(proc.returncode, proc.args)
+    start_time = time.perf_counter()
+    cmd = shlex.split(PLANNOTATE_COMMAND) + ['batch', '-i', fasta_file, '-c', '-o', plasmid_dir]
+    proc = subprocess.run(cmd, cwd=plasmid_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True)
+    return proc.returncode, proc.stdout, time.perf_counter() - start_time
 
 
-def postprocess(plasmids, working_dir):
+def run(jobs, workers=PLANNOTATE_WORKERS):
     """
-        Finds pLannotate output files and creates new Features
+        Runs pLannotate for all plasmids, with up to "workers" pLannotate
+        processes at a time. A failed plasmid does not stop other plasmids.
         Input:
-            plasmids(list(Plasmid)): list of Plasmid objects
-            working_dir(str): working directory, full path
+            jobs(list): output of preprocess
+            workers(int): number of pLannotate processes
+        Output:
+            list of Plasmid objects successfully annotated
     """
-    features_created = 0
-    features_updated = 0
-    for plasmid in plasmids:
-        if plasmid.sequence is None or plasmid.sequence == '':
-            continue
-            print(f"Plasmid {plasmid.name} was skipped")
-        print(plasmid.name)
-        feature_type_dict = {item.name:item for item in Feature_type.objects.all()}
-        in_file = os.path.join(working_dir, str(plasmid.id) + '_pLann.csv')
-        with open(in_file, 'r') as infile:
-            reader = csv.DictReader(infile)
-            for row in reader:
-                feature_type_label = row['Type']
-                feature_start = int(row['start location'])
-                feature_end = int(row['end location'])
-                feature_strand = int(row['strand'])
-                feature_sequence = row['sequence']
-                description = 'pLannotate: ' + row['Feature'] + ' [' + row['Type'] + '] - ' + row['percent identity'].split('.')[0] + '% ident.; ' + row['percent match length'].split('.')[0] + '% length; ' + row['Description']
-                if feature_type_label not in feature_type_dict:
-                    Feature_type.objects.create(name=feature_type_label)
-                    feature_type_dict = {item.name:item for item in Feature_type.objects.all()}
-                feature_type = feature_type_dict[feature_type_label]
-                if Feature.objects.filter(plasmid = plasmid,
-                        start = feature_start,
-                        end = feature_end,
-                        strand = feature_strand,
-                        feature_type = feature_type
-                        ).exists():
-                    # Feature exists. Update description.
-                    feature = Feature.objects.get(plasmid = plasmid,
-                        start = feature_start,
-                        end = feature_end,
-                        strand = feature_strand,
-                        feature_type = feature_type
-                        )
-                    if description not in feature.description:
-                        feature.description = feature.description + ' ' + description
-                        feature.save()
-                        features_updated += 1
-                    continue
-                else:
+    print('Annotating', len(jobs), 'plasmids with', workers, 'workers:', PLANNOTATE_COMMAND)
+    annotated = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(annotate_plasmid, plasmid_dir, fasta_file): plasmid
+                   for plasmid, plasmid_dir, fasta_file in jobs}
+        for i, future in enumerate(as_completed(futures), start=1):
+            plasmid = futures[future]
+            progress = f'[{i}/{len(jobs)}] {plasmid.name}'
+            try:
+                returncode, output, seconds = future.result()
+            except OSError as e:
+                print(f'{progress}: failed to start pLannotate: {e}')
+                failed.append(plasmid)
+                continue
+            if returncode != 0:
+                print(f'{progress}: failed with exit code {returncode}')
+                for line in output.splitlines()[-OUTPUT_LINES_ON_ERROR:]:
+                    print('    ' + line)
+                failed.append(plasmid)
+                continue
+            print(f'{progress}: done in {seconds:.1f} s')
+            annotated.append(plasmid)
+    if failed:
+        print('pLannotate failed for', len(failed), 'plasmids:', ', '.join(plasmid.name for plasmid in failed))
+    return annotated
+
+
+def read_result(plasmid, working_dir):
+    """
+        Returns content of pLannotate output file for a plasmid
+    """
+    in_file = os.path.join(working_dir, str(plasmid.id), str(plasmid.id) + '_pLann.csv')
+    with open(in_file, 'r') as infile:
+        return infile.read()
+
+
+def _feature_description(row):
+    return 'pLannotate: ' + row['Feature'] + ' [' + row['Type'] + '] - ' + row['percent identity'].split('.')[0] + '% ident.; ' + row['percent match length'].split('.')[0] + '% length; ' + row['Description']
+
+
+def _apply_annotations(annotations, feature_types):
+    """
+        Creates and updates Features for a batch of plasmids
+        in a single transaction.
+        Output:
+            (number of created features, number of updated features)
+    """
+    with transaction.atomic():
+        # Existing features by (plasmid ID, start, end, strand, feature type ID)
+        features = {}
+        for feature in Feature.objects.filter(plasmid__in=[plasmid for plasmid, _ in annotations]).order_by('id'):
+            key = (feature.plasmid_id, feature.start, feature.end, feature.strand, feature.feature_type_id)
+            features.setdefault(key, feature)
+        created = []
+        updated = {}
+        for plasmid, result in annotations:
+            with io.StringIO(result) as infile:
+                for row in csv.DictReader(infile):
+                    feature_type = feature_types.get(row['Type'])
+                    feature_start = int(row['start location'])
+                    feature_end = int(row['end location'])
+                    feature_strand = int(row['strand'])
+                    description = _feature_description(row)
+                    key = (plasmid.id, feature_start, feature_end, feature_strand, feature_type.id)
+                    feature = features.get(key)
+                    if feature is not None:
+                        # Feature exists. Update description.
+                        if description not in feature.description:
+                            feature.description = feature.description + ' ' + description
+                            if feature.pk is not None:
+                                updated[feature.pk] = feature
+                        continue
                     # Feature does not exist. Create it.
                     if feature_strand == -1:
                         location_str = f'[{feature_start}:{feature_end}](-)'
                     else:
                         location_str = f'[{feature_start}:{feature_end}](+)'
-                        feature = Feature.objects.create(name = row['Feature'].replace(' ', '_'),
-                            plasmid = plasmid,
-                            feature_type = feature_type,
-                            sequence = row['sequence'],
-                            sequence_id = plasmid.name,
-                            start = feature_start,
-                            end = feature_end,
-                            strand = feature_strand,
-                            location_str = location_str,
-                            description = description
-                            )
-                        features_created += 1
-    print('Features created: ', features_created)
-    print('Features updated: ', features_updated)
-    _cleanup(working_dir)
+                    feature = Feature(name = row['Feature'].replace(' ', '_'),
+                        plasmid = plasmid,
+                        feature_type = feature_type,
+                        sequence_id = plasmid.name,
+                        start = feature_start,
+                        end = feature_end,
+                        strand = feature_strand,
+                        location_str = location_str,
+                        description = description
+                        )
+                    features[key] = feature
+                    created.append(feature)
+        Feature.objects.bulk_create(created, batch_size=POSTPROCESS_BATCH_SIZE)
+        Feature.objects.bulk_update(list(updated.values()), ['description'], batch_size=POSTPROCESS_BATCH_SIZE)
+        text_index.update(Feature, [feature.id for feature in created] + list(updated))
+    return len(created), len(updated)
+
+
+def postprocess(annotations):
+    """
+        Creates new Features from pLannotate output and adds pLannotate
+        descriptions to existing Features with the same location and type.
+        Running it again with the same output changes nothing.
+        Input:
+            annotations(list): list of (Plasmid, pLannotate output) tuples
+        Output:
+            (number of created features, number of updated features)
+    """
+    start_time = time.perf_counter()
+    feature_types = FeatureTypeCache()
+    features_created = 0
+    features_updated = 0
+    for i in range(0, len(annotations), POSTPROCESS_BATCH_SIZE):
+        created, updated = _apply_annotations(annotations[i:i + POSTPROCESS_BATCH_SIZE], feature_types)
+        features_created += created
+        features_updated += updated
+    print(f'Plasmids: {len(annotations)}, features created: {features_created}, '
+          f'features updated: {features_updated}, in {time.perf_counter() - start_time:.1f} s')
+    return features_created, features_updated
 
 
 def _cleanup(working_dir):
     shutil.rmtree(working_dir)
 
-def application(plasmids):
+def plasmids_to_annotate(select_all=False, since=None, limit=None):
+    """
+        Selects plasmids with sequences that have never been annotated,
+        changed since the last annotation or were annotated by another
+        pLannotate version. Sequence hashes stored at import are compared
+        in the database, so sequences of up-to-date plasmids are not loaded.
+        Input:
+            select_all(bool): select all plasmids with sequences
+            since(datetime): also select plasmids last annotated before this time
+            limit(int): max. number of plasmids
+        Output:
+            list of Plasmid objects
+    """
+    version = annotator_version()
+    plasmids = Plasmid.objects.exclude(sequence='')
+    if not select_all:
+        outdated = Q(plasmid_annotation__isnull=True) | \
+            ~Q(plasmid_annotation__annotator_version=version) | \
+            ~Q(plasmid_annotation__sequence_hash=F('sequence_hash'))
+        if since is not None:
+            outdated |= Q(plasmid_annotation__annotated__lt=since)
+        plasmids = plasmids.filter(outdated)
+    plasmids = plasmids.order_by('id')
+    if limit is not None:
+        plasmids = plasmids[:limit]
+    result = list(plasmids)
+    print('Plasmids to annotate:', len(result), 'of', Plasmid_annotation.objects.count(), 'annotated before')
+    return result
+
+
+def _save_annotation_state(plasmids, version):
+    """
+        Records sequence hash and pLannotate version of annotated plasmids
+    """
+    Plasmid_annotation.objects.bulk_create(
+        [Plasmid_annotation(plasmid=plasmid, sequence_hash=sequence_hash(plasmid.sequence),
+                            annotator_version=version)
+         for plasmid in plasmids],
+        batch_size=POSTPROCESS_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['plasmid'],
+        update_fields=['sequence_hash', 'annotator_version', 'annotated']
+    )
+
+
+def application(plasmids, workers=PLANNOTATE_WORKERS, no_cache=False):
     """
         This function is an entry point of the module.
+        Plasmids with cached results are not annotated again, and
+        pLannotate runs only once for plasmids with identical sequences.
         Input:
             plasmids(list(Plasmid)): list of Plasmid objects
+            workers(int): number of pLannotate processes
+            no_cache(bool): ignore cached results
+        Output:
+            report string
     """
-    working_dir = os.path.join(TEMP_DIR,str(uuid.uuid4()))
+    version = annotator_version()
+    plasmids_by_hash = {}
+    for plasmid in plasmids:
+        if plasmid.sequence is None or plasmid.sequence == '':
+            print(f"Plasmid {plasmid.name} has no sequence")
+            continue
+        plasmids_by_hash.setdefault(sequence_hash(plasmid.sequence), []).append(plasmid)
+    results = {} if no_cache else get_results(plasmids_by_hash.keys(), version)
+    cached_count = sum(len(plasmids_by_hash[key]) for key in results)
+    print('pLannotate version:', version, 'sequences:', len(plasmids_by_hash), 'cached:', len(results))
     
-    script_path = preprocess(plasmids, working_dir)
-    run(script_path)
-    postprocess(plasmids, working_dir)
+    new_results = {}
+    uncached = [same_plasmids[0] for key, same_plasmids in plasmids_by_hash.items() if key not in results]
+    if uncached:
+        working_dir = os.path.join(TEMP_DIR,str(uuid.uuid4()))
+        jobs = preprocess(uncached, working_dir)
+        for plasmid in run(jobs, workers):
+            new_results[sequence_hash(plasmid.sequence)] = read_result(plasmid, working_dir)
+        _cleanup(working_dir)
+        save_results(new_results, version)
+        results.update(new_results)
     
+    annotations = [(plasmid, results[key]) for key, same_plasmids in plasmids_by_hash.items() if key in results
+                   for plasmid in same_plasmids]
+    features_created, features_updated = postprocess(annotations)
+    _save_annotation_state([plasmid for plasmid, _ in annotations], version)
+    failed_count = sum(len(same_plasmids) for key, same_plasmids in plasmids_by_hash.items() if key not in results)
+    return 'pLannotate: plasmids annotated ' + str(len(annotations)) + ', from cache ' + str(cached_count) + \
+        ', failed ' + str(failed_count) + '. Features created and/or updated: ' + \
+        str(features_created + features_updated)
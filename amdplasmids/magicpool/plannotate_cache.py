@@ -0,0 +1,71 @@
+"""
+    Cache of pLannotate results.
+
+    pLannotate output (the content of the _pLann.csv file) is saved per
+    plasmid sequence, keyed by MD5 hash of the sequence and pLannotate
+    version. Plasmids with a cached result for their sequence are not
+    annotated again, unless a refresh is forced.
+"""
+import shlex
+import hashlib
+import subprocess
+from magicpool.models import Plannotate_cache
+from amdplasmids.settings import PLANNOTATE_COMMAND, PLANNOTATE_VERSION
+
+# Max. number of hashes in a single "IN (...)" query
+CHUNK_SIZE = 500
+
+_annotator_version = None
+
+
+def sequence_hash(sequence):
+    return hashlib.md5(sequence.upper().encode('utf-8')).hexdigest()
+
+
+def annotator_version():
+    '''
+        Returns PLANNOTATE_VERSION or, if it is not set,
+        version reported by "plannotate --version"
+    '''
+    global _annotator_version
+    if PLANNOTATE_VERSION != '':
+        return PLANNOTATE_VERSION
+    if _annotator_version is None:
+        try:
+            proc = subprocess.run(shlex.split(PLANNOTATE_COMMAND) + ['--version'], stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL, universal_newlines=True)
+        except OSError:
+            raise RuntimeError('Unable to run pLannotate: ' + PLANNOTATE_COMMAND)
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            raise RuntimeError('Unable to get pLannotate version, set PLANNOTATE_VERSION')
+        _annotator_version = lines[-1].strip()
+    return _annotator_version
+
+
+def get_results(sequence_hashes, version):
+    '''
+        Returns dictionary of cached pLannotate results by sequence hash
+    '''
+    sequence_hashes = list(sequence_hashes)
+    result = {}
+    for i in range(0, len(sequence_hashes), CHUNK_SIZE):
+        for item in Plannotate_cache.objects.filter(sequence_hash__in=sequence_hashes[i:i + CHUNK_SIZE],
+                                                    annotator_version=version):
+            result[item.sequence_hash] = item.result
+    return result
+
+
+def save_results(results, version):
+    '''
+        Saves pLannotate results given as dictionary by sequence hash,
+        replacing existing entries
+    '''
+    Plannotate_cache.objects.bulk_create(
+        [Plannotate_cache(sequence_hash=key, annotator_version=version, result=value)
+         for key, value in results.items()],
+        batch_size=CHUNK_SIZE,
+        update_conflicts=True,
+        unique_fields=['sequence_hash', 'annotator_version'],
+        update_fields=['result']
+    )
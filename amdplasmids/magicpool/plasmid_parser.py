@@ -0,0 +1,106 @@
+"""
+    Parsing of plasmid map files in worker processes.
+
+    parse_plasmid_file() reads a SnapGene, GenBank or FASTA file and
+    computes its checksum without touching the database, so it can run
+    in a process pool. It returns a compact payload: the first record
+    reduced to its sequence and features, and feature qualifiers limited
+    to those used by create_feature(). The payload is applied to the
+    database in the main process by import_plasmid_payload() in util.
+"""
+import gzip
+import hashlib
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from magicpool.feature_library import annotate_record
+
+# Size of blocks read for checksums
+CHECKSUM_BLOCK_SIZE = 1 << 20
+# Qualifiers read by create_feature() and import_features()
+FEATURE_QUALIFIERS = ('locus_tag', 'label', 'name', 'gene', 'note', 'product', 'translation')
+
+
+def plasmid_file_kind(filename):
+    '''
+        Returns type of plasmid map file or None for other files
+    '''
+    if filename.endswith('.dna'):
+        return 'snapgene'
+    elif filename.endswith('.gb') or filename.endswith('.ape'):
+        return 'genbank'
+    elif filename.endswith('.fa') or filename.endswith('.fna'):
+        return 'fasta'
+    return None
+
+
+def plasmid_name(filename, kind):
+    if kind == 'snapgene':
+        return filename.split('.dna')[0]
+    return '.'.join(filename.split('.')[:-1])
+
+
+def file_checksum(filepath):
+    '''
+        Returns MD5 checksum of the file content.
+        Gzipped files are hashed after decompression.
+    '''
+    opener = gzip.open if filepath.endswith('.gz') else open
+    checksum = hashlib.md5()
+    with opener(filepath, 'rb') as infile:
+        for block in iter(lambda: infile.read(CHECKSUM_BLOCK_SIZE), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def _trim_feature(feature):
+    feature.qualifiers = {key: value for key, value in feature.qualifiers.items()
+                          if key in FEATURE_QUALIFIERS}
+    feature.id = '<unknown id>'
+    return feature
+
+
+def parse_plasmid_file(filepath, sequence_file, kind, checksum=None):
+    '''
+        Returns dictionary with checksum, plasmid name, number of records,
+        sequence and features of the first record. If the file
+        cannot be parsed, 'error' has the error message.
+        The checksum is computed if not provided.
+    '''
+    filename = filepath.split('/')[-1]
+    payload = {'filepath': filepath,
+               'sequence_file': sequence_file,
+               'kind': kind,
+               'seq_name': plasmid_name(filename, kind),
+               'record_count': 0,
+               'sequence': '',
+               'features': [],
+               'error': None
+               }
+    payload['checksum'] = checksum if checksum is not None else file_checksum(filepath)
+    opener = gzip.open if filepath.endswith('.gz') else open
+    try:
+        if kind == 'genbank':
+            with opener(filepath, 'rt') as infile:
+                records = list(SeqIO.parse(infile, 'genbank'))
+        else:
+            records = list(SeqIO.parse(filepath, kind))
+    except Exception as e:
+        payload['error'] = str(e)
+        return payload
+    payload['record_count'] = len(records)
+    if records:
+        if kind == 'fasta':
+            annotate_record(records[0])
+        payload['sequence'] = str(records[0].seq)
+        payload['features'] = [_trim_feature(feature) for feature in records[0].features]
+    return payload
+
+
+def payload_records(payload):
+    '''
+        Returns list with SeqRecord rebuilt from the payload
+    '''
+    if not payload['record_count']:
+        return []
+    return [SeqRecord(Seq(payload['sequence']), features=payload['features'])]
@@ -0,0 +1,149 @@
+"""
+    Deletion of plasmids, oligos and strains that are no longer
+    in the data files.
+
+    Files in the plasmid maps directory and keys in the spreadsheets are
+    collected into sets once, compared with the database, and the objects
+    missing from the data files are deleted with queryset deletes
+    in a single transaction per stage, together with their rows
+    in the full-text index. With dry_run=True, Reconciliation
+    only reports what would be deleted.
+"""
+import os
+from django.db import transaction
+from magicpool.models import Plasmid, Feature, Oligo, Strain
+from magicpool import text_index
+from magicpool.table_import import read_sheets
+from magicpool.instrumentation import count
+
+# Max. number of IDs in a single "IN (...)" query
+CHUNK_SIZE = 500
+# Max. number of object names listed in a report
+MAX_LISTED = 50
+
+
+def list_files(top_dir):
+    '''
+        Returns set of paths of all files under top_dir relative to top_dir
+    '''
+    result = set()
+    for root, subdirs, files in os.walk(top_dir):
+        for filename in files:
+            result.add(os.path.normpath(os.path.relpath(os.path.join(root, filename), top_dir)))
+    return result
+
+
+def _first_column(xlsx_path, active_sheet_only=False):
+    '''
+        Yields values of the first column of spreadsheet rows after the header
+    '''
+    for _, _, rows in read_sheets(xlsx_path, active_sheet_only):
+        for row in rows:
+            if row:
+                yield row[0]
+
+
+def plasmid_table_names(plasmid_maps_dir):
+    '''
+        Returns names of plasmids in the plasmid tables, as import_plasmids reads them
+    '''
+    result = set()
+    for root, subdirs, files in os.walk(plasmid_maps_dir):
+        if 'Old_files' in root or 'Older_Files' in root:
+            continue
+        for filename in files:
+            if filename.endswith('.xlsx') and not filename.startswith('Old_'):
+                result.update(name for name in _first_column(os.path.join(root, filename), active_sheet_only=True)
+                              if name != '' and name is not None)
+    return result
+
+
+def oligo_table_names(xlsx_path):
+    '''
+        Returns oligo names, as import_oligos_table reads them
+    '''
+    return {str(name) for name in _first_column(xlsx_path) if str(name) != ''}
+
+
+def strain_table_amd_numbers(xlsx_path):
+    '''
+        Returns strain AMD numbers, as import_strains_table reads them
+    '''
+    return {str(amd_number) for amd_number in _first_column(xlsx_path) if str(amd_number).startswith('AMD')}
+
+
+class Reconciliation:
+    '''
+        Finds and deletes objects missing from the data files.
+        Every method returns a report string, which is empty
+        if there is nothing to delete.
+    '''
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+
+    def _delete(self, model, objects, description):
+        '''
+            Deletes objects given as (ID, name) tuples
+        '''
+        if not objects:
+            return ''
+        names = sorted(str(name) for _, name in objects)
+        for name in names:
+            print(description + ', to be deleted: ' + name)
+        if self.dry_run:
+            report = description + ' to be deleted: ' + str(len(objects))
+            listed = ', '.join(names[:MAX_LISTED])
+            if len(names) > MAX_LISTED:
+                listed += ' and ' + str(len(names) - MAX_LISTED) + ' more'
+            return report + ' (' + listed + ')'
+        ids = [object_id for object_id, _ in objects]
+        with transaction.atomic():
+            for i in range(0, len(ids), CHUNK_SIZE):
+                chunk = ids[i:i + CHUNK_SIZE]
+                # Index rows of features go with their plasmids
+                feature_ids = []
+                if model is Plasmid:
+                    feature_ids = list(Feature.objects.filter(plasmid_id__in=chunk).values_list('id', flat=True))
+                model.objects.filter(pk__in=chunk).delete()
+                text_index.delete(model, chunk)
+                text_index.delete(Feature, feature_ids)
+        count('deleted', len(objects))
+        return description + ' deleted: ' + str(len(objects))
+
+    def plasmids_without_files(self, plasmid_maps_dir):
+        '''
+            Deletes plasmids with sequence files that do not exist
+        '''
+        files = list_files(plasmid_maps_dir)
+        objects = [(plasmid_id, name) for plasmid_id, name, sequence_file
+                   in Plasmid.objects.exclude(sequence_file='').values_list('id', 'name', 'sequence_file')
+                   if os.path.normpath(sequence_file) not in files]
+        return self._delete(Plasmid, objects, 'Plasmids without sequence files')
+
+    def plasmids_without_maps(self, table_names):
+        '''
+            Deletes plasmids without sequence files that are not in plasmid tables
+        '''
+        table_names = set(table_names)
+        objects = [(plasmid_id, name) for plasmid_id, name
+                   in Plasmid.objects.filter(sequence_file='').values_list('id', 'name')
+                   if name not in table_names]
+        return self._delete(Plasmid, objects, 'Plasmids without maps')
+
+    def oligos(self, oligo_names):
+        '''
+            Deletes oligos that are not in the oligo table
+        '''
+        oligo_names = set(oligo_names)
+        objects = [(oligo_id, name) for oligo_id, name in Oligo.objects.values_list('id', 'name')
+                   if name not in oligo_names]
+        return self._delete(Oligo, objects, 'Oligos')
+
+    def strains(self, amd_numbers):
+        '''
+            Deletes strains that are not in the strain table
+        '''
+        amd_numbers = set(amd_numbers)
+        objects = [(strain_id, amd_number) for strain_id, amd_number in Strain.objects.values_list('id', 'amd_number')
+                   if amd_number not in amd_numbers]
+        return self._delete(Strain, objects, 'Strains')
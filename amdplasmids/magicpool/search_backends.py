@@ -0,0 +1,536 @@
+"""
+    Sequence search backends.
+
+    All backends take a list of (query_id, sequence) tuples and return hits
+    in BLAST tabular format (outfmt 6, optionally with query length in
+    the 13th column), so search results are parsed the same way regardless
+    of the backend.
+
+    BlastBackend runs NCBI BLAST+ against the databases built by
+    make_blast_databases. LocalAlignmentBackend needs neither BLAST+ nor
+    BLAST databases: it aligns queries directly to the sequences stored in
+    the database with a Smith-Waterman scan vectorized with NumPy. It is
+    intended for development machines and small collections.
+
+    The backend is selected by the SEARCH_BACKEND setting:
+        blast - always use BLAST+ (default)
+        local - always use local alignment
+        auto - use local alignment if BLAST+ or BLAST databases are missing
+            or the collection is smaller than LOCAL_SEARCH_MAX_RESIDUES
+"""
+import os
+import math
+import glob
+import shutil
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from subprocess import Popen, PIPE, STDOUT
+import numpy as np
+from Bio.Align import PairwiseAligner, substitution_matrices
+from Bio.Data import CodonTable
+from django.db.models import Sum
+from django.db.models.functions import Length
+from magicpool.models import Plasmid, Oligo, Protein
+from magicpool.blast_db import plasmid_fasta_header, oligo_fasta_header, protein_fasta_header
+from magicpool.blast_db import active_db_path, get_blast_db_version
+from amdplasmids.settings import BLAST_PROT_DB, BLAST_NUCL_DB, TEMP_DIR
+from amdplasmids.settings import SEARCH_BACKEND, LOCAL_SEARCH_MAX_RESIDUES
+
+
+class SearchBackendError(Exception):
+    '''
+        Raised if a search program fails
+    '''
+    pass
+
+
+def _query_name(query_id):
+    '''
+        Returns query ID as reported by BLAST
+    '''
+    return query_id.split()[0] if query_id.split() else 'Query_1'
+
+
+class BlastBackend:
+    '''
+        Runs searches with NCBI BLAST+ programs
+    '''
+    name = 'blast'
+    # Results depend on BLAST database version and can be cached
+    cacheable = True
+
+    def _args(self, tool, params, short_query, with_qlen):
+        outfmt = '6 std qlen' if with_qlen else '6'
+        # Resolve the "current" symlink once, so the search keeps reading
+        # the same database version if a new one is activated meanwhile
+        prot_db = active_db_path(BLAST_PROT_DB)
+        nucl_db = active_db_path(BLAST_NUCL_DB)
+        if tool == 'blastp':
+            args = [
+                'blastp',
+                '-db', prot_db,
+                '-max_target_seqs', params['hitstoshow'],
+                '-evalue', params['evalue'],
+                '-matrix=PAM30',
+                '-outfmt', outfmt
+                ]
+        elif tool == 'tblastn':
+            args = [
+                'tblastn',
+                '-db', nucl_db,
+                '-max_target_seqs', params['hitstoshow'],
+                '-evalue', params['evalue'],
+                '-soft_masking', 'false',
+                '-outfmt', outfmt
+                ]
+        else:
+            args = [
+                'blastn',
+                '-db', nucl_db,
+                '-max_target_seqs', params['hitstoshow'],
+                '-evalue', params['evalue'],
+                '-dust', 'no',
+                '-soft_masking', 'false',
+                '-outfmt', outfmt
+                ]
+            if short_query:
+                args.append('-task')
+                args.append('blastn')
+        return args
+
+    def search(self, tool, queries, params, short_query=False, with_qlen=False):
+        '''
+            Returns list of hits, at most hitstoshow per query.
+            A single query is sent to BLAST via stdin. Multiple queries
+            are written into a temporary file and hits are read
+            as BLAST writes them, so memory use does not grow with
+            the size of the whole report.
+        '''
+        args = self._args(tool, params, short_query, with_qlen)
+        query_fasta = ''.join('>' + query_id + '\n' + sequence + '\n' for query_id, sequence in queries)
+        min_columns = 13 if with_qlen else 12
+        max_hits = int(params['hitstoshow'])
+        result = []
+        messages = []
+        hit_counts = defaultdict(int)
+        query_file = None
+        if len(queries) > 1:
+            Path(TEMP_DIR).mkdir(parents=True, exist_ok=True)
+            query_file = os.path.join(TEMP_DIR, str(uuid.uuid4()) + '.faa')
+            with open(query_file, 'w') as outfile:
+                outfile.write(query_fasta)
+            args += ['-query', query_file]
+        try:
+            with Popen(args,
+                       stdin=PIPE if query_file is None else None,
+                       stdout=PIPE,
+                       stderr=STDOUT,
+                       bufsize=1,
+                       universal_newlines=True
+                       ) as p:
+                if query_file is None:
+                    output, _ = p.communicate(query_fasta)
+                    lines = output.split('\n')
+                else:
+                    lines = p.stdout
+                for line in lines:
+                    row = line.rstrip('\n\r').split('\t')
+                    if len(row) < min_columns:
+                        if line.strip() and not line.startswith('#'):
+                            messages.append(line.rstrip('\n\r'))
+                        continue
+                    if hit_counts[row[0]] >= max_hits:
+                        continue
+                    hit_counts[row[0]] += 1
+                    result.append('\t'.join(row))
+        finally:
+            if query_file is not None:
+                os.remove(query_file)
+        if p.returncode != 0:
+            if not messages:
+                messages = ['Execution error',]
+            raise SearchBackendError('\n'.join(messages))
+        return result
+
+    def is_available(self, tool):
+        '''
+            Checks if BLAST program and database for the tool exist
+        '''
+        db_path = BLAST_PROT_DB if tool == 'blastp' else BLAST_NUCL_DB
+        return shutil.which(tool) is not None and bool(glob.glob(db_path + '.*'))
+
+
+# Scoring systems of the BLAST programs: substitution scores, gap costs
+# (a gap of length L costs gap_open + L * gap_extend) and Karlin-Altschul
+# parameters for gapped alignments
+NUCLEOTIDE_SCORING = {'match': 2, 'mismatch': -3, 'gap_open': 5, 'gap_extend': 2,
+                      'lambda': 0.625, 'K': 0.41}
+BLASTP_SCORING = {'matrix': 'PAM30', 'gap_open': 9, 'gap_extend': 1,
+                  'lambda': 0.294, 'K': 0.11}
+TBLASTN_SCORING = {'matrix': 'BLOSUM62', 'gap_open': 11, 'gap_extend': 1,
+                   'lambda': 0.267, 'K': 0.041}
+NUCLEOTIDE_ALPHABET = 'ACGTN'
+# Bacterial genetic code is used for translation of plasmids
+GENETIC_CODE = 11
+
+# Score of any residue against a separator between database sequences
+_NEG = -(1 << 30)
+# Offset that keeps horizontal gaps from crossing database sequences
+_SEGMENT_OFFSET = 1 << 40
+
+
+class _Scoring:
+    '''
+        Alphabet, integer substitution table and aligner of a scoring system
+    '''
+    def __init__(self, scoring):
+        if 'matrix' in scoring:
+            matrix = substitution_matrices.load(scoring['matrix'])
+            self.alphabet = ''.join(matrix.alphabet)
+            self.unknown = 'X'
+        else:
+            self.alphabet = NUCLEOTIDE_ALPHABET
+            self.unknown = 'N'
+            matrix = substitution_matrices.Array(alphabet=self.alphabet, dims=2)
+            for a in self.alphabet:
+                for b in self.alphabet:
+                    if a == b and a != 'N':
+                        matrix[a, b] = scoring['match']
+                    else:
+                        matrix[a, b] = scoring['mismatch']
+        size = len(self.alphabet)
+        # Last code is the separator
+        self.table = np.full((size + 1, size + 1), _NEG, dtype=np.int64)
+        for i, a in enumerate(self.alphabet):
+            for j, b in enumerate(self.alphabet):
+                self.table[i, j] = int(matrix[a, b])
+        self.separator = size
+        self.lookup = np.full(256, self.alphabet.index(self.unknown), dtype=np.int8)
+        for i, a in enumerate(self.alphabet):
+            self.lookup[ord(a)] = i
+            self.lookup[ord(a.lower())] = i
+        self.letters = np.frombuffer((self.alphabet + '-').encode('ascii'), dtype=np.uint8)
+        self.gap_open = scoring['gap_open']
+        self.gap_extend = scoring['gap_extend']
+        self.lam = scoring['lambda']
+        self.K = scoring['K']
+        self.aligner = PairwiseAligner()
+        self.aligner.mode = 'local'
+        self.aligner.substitution_matrix = matrix
+        self.aligner.open_gap_score = -(self.gap_open + self.gap_extend)
+        self.aligner.extend_gap_score = -self.gap_extend
+
+    def encode(self, sequence):
+        return self.lookup[np.frombuffer(sequence.encode('ascii', errors='replace'), dtype=np.uint8)]
+
+    def decode(self, codes):
+        return self.letters[codes].tobytes().decode('ascii')
+
+
+class _Database:
+    '''
+        Database sequences encoded and joined into one array
+        with separators between sequences.
+        Segments are (header, frame, sequence length, start column, length)
+        tuples; frame is 0 for sequences searched as is.
+    '''
+    def __init__(self, scoring):
+        self.scoring = scoring
+        self.chunks = []
+        self.segments = []
+        self.column = 0
+        self.residues = 0
+
+    def add(self, header, codes, frame=0, sequence_len=0):
+        self.chunks.append(codes)
+        self.chunks.append(np.array([self.scoring.separator], dtype=np.int8))
+        self.segments.append((header, frame, sequence_len or len(codes), self.column, len(codes)))
+        self.column += len(codes) + 1
+        self.residues += len(codes)
+
+    def close(self):
+        if self.chunks:
+            self.codes = np.concatenate(self.chunks).astype(np.intp)
+        else:
+            self.codes = np.zeros(0, dtype=np.intp)
+        self.chunks = []
+        self.starts = np.array([segment[3] for segment in self.segments], dtype=np.intp)
+        segment_index = np.zeros(len(self.codes), dtype=np.int64)
+        if len(self.starts) > 1:
+            segment_index[self.starts[1:] - 1] = 1
+        self.segment_offset = np.cumsum(segment_index) * _SEGMENT_OFFSET
+
+
+def _nucleotide_targets():
+    '''
+        Yields (header, sequence) for plasmids and oligos,
+        with headers as in the BLAST nucleotide database
+    '''
+    for item in Plasmid.objects.exclude(sequence='').values('id', 'name', 'amd_number', 'sequence'):
+        yield plasmid_fasta_header(item['id'], item['name'], item['amd_number']), item['sequence']
+    for item in Oligo.objects.exclude(sequence='').values('id', 'name', 'sequence'):
+        yield oligo_fasta_header(item['id'], item['name']), item['sequence']
+
+
+def _protein_targets():
+    '''
+        Yields (header, sequence) for proteins,
+        with headers as in the BLAST protein database
+    '''
+    for item in Protein.objects.exclude(sequence='').values(
+        'id', 'name', 'sequence', 'feature__location_str', 'feature__plasmid__name'
+    ):
+        yield protein_fasta_header(item['id'],
+                                   item['name'],
+                                   item['feature__plasmid__name'],
+                                   item['feature__location_str']
+                                   ), item['sequence']
+
+
+def _codon_table(scoring):
+    '''
+        Returns array translating codon index (25 * a + 5 * b + c for
+        nucleotide codes a, b, c) into amino acid code
+    '''
+    table = CodonTable.unambiguous_dna_by_id[GENETIC_CODE]
+    unknown = scoring.alphabet.index('X')
+    codons = np.full(125, unknown, dtype=np.int8)
+    for i, a in enumerate(NUCLEOTIDE_ALPHABET):
+        for j, b in enumerate(NUCLEOTIDE_ALPHABET):
+            for k, c in enumerate(NUCLEOTIDE_ALPHABET):
+                codon = a + b + c
+                if codon in table.stop_codons:
+                    codons[25 * i + 5 * j + k] = scoring.alphabet.index('*')
+                elif codon in table.forward_table:
+                    codons[25 * i + 5 * j + k] = scoring.alphabet.index(table.forward_table[codon])
+    return codons
+
+
+class LocalAlignmentBackend:
+    '''
+        Runs searches with a NumPy Smith-Waterman implementation
+        over sequences in the database
+    '''
+    name = 'local'
+    # Database can change between searches without a new BLAST database version
+    cacheable = False
+
+    def __init__(self):
+        self.scorings = {}
+
+    def _scoring(self, tool):
+        if tool not in self.scorings:
+            if tool == 'blastp':
+                self.scorings[tool] = _Scoring(BLASTP_SCORING)
+            elif tool == 'tblastn':
+                self.scorings[tool] = _Scoring(TBLASTN_SCORING)
+            else:
+                self.scorings[tool] = _Scoring(NUCLEOTIDE_SCORING)
+        return self.scorings[tool]
+
+    def _database(self, tool):
+        scoring = self._scoring(tool)
+        db = _Database(scoring)
+        if tool == 'blastp':
+            for header, sequence in _protein_targets():
+                db.add(header, scoring.encode(sequence.upper()))
+        elif tool == 'tblastn':
+            nucleotide_scoring = self._scoring('blastn')
+            codons = _codon_table(scoring)
+            complement = np.array([3, 2, 1, 0, 4], dtype=np.int8)
+            for header, sequence in _nucleotide_targets():
+                forward = nucleotide_scoring.encode(sequence).astype(np.intp)
+                reverse = complement[forward][::-1].astype(np.intp)
+                for strand, nucleotides in ((1, forward), (-1, reverse)):
+                    for offset in range(3):
+                        codon_count = (len(nucleotides) - offset) // 3
+                        if codon_count < 1:
+                            continue
+                        end = offset + 3 * codon_count
+                        index = 25 * nucleotides[offset:end:3] + 5 * nucleotides[offset + 1:end:3] + nucleotides[offset + 2:end:3]
+                        db.add(header, codons[index], strand * (offset + 1), len(sequence))
+            # E-values are computed for the length of the translated database,
+            # as if the sequences were translated in one frame
+            db.residues //= 6
+        else:
+            for header, sequence in _nucleotide_targets():
+                db.add(header, scoring.encode(sequence))
+        db.close()
+        return db
+
+    def _scan(self, query_codes, db):
+        '''
+            Smith-Waterman scan of one query against all database columns
+            at once (Gotoh recurrences, one query position per iteration).
+            Horizontal gaps within a row are resolved with a running
+            maximum instead of a loop over columns.
+            Returns best score and query position for every database column.
+        '''
+        scoring = db.scoring
+        size = len(db.codes)
+        gap_first = scoring.gap_open + scoring.gap_extend
+        gap_extend = scoring.gap_extend
+        ramp = np.arange(size, dtype=np.int64) * gap_extend
+        ramp_offset = ramp + db.segment_offset
+        h_prev = np.zeros(size + 1, dtype=np.int64)
+        e = np.full(size, _NEG, dtype=np.int64)
+        best = np.zeros(size, dtype=np.int64)
+        best_row = np.zeros(size, dtype=np.int32)
+        for i, residue in enumerate(query_codes):
+            h = h_prev[:-1] + scoring.table[residue][db.codes]
+            np.maximum(h_prev[1:] - gap_first, e - gap_extend, out=e)
+            np.maximum(h, e, out=h)
+            np.maximum(h, 0, out=h)
+            if size > 1:
+                running = np.maximum.accumulate(h + ramp_offset)
+                f = running[:-1] - ramp_offset[1:] - gap_first
+                np.maximum(h[1:], f, out=h[1:])
+            improved = h > best
+            best[improved] = h[improved]
+            best_row[improved] = i
+            h_prev[1:] = h
+        return best, best_row
+
+    def _hit(self, query_id, query, strand, db, segment_index, column, row, with_qlen, query_len):
+        '''
+            Aligns query to the region of the database sequence ending
+            at the best-scoring column and returns hit in tabular format
+        '''
+        scoring = db.scoring
+        header, frame, sequence_len, start, length = db.segments[segment_index]
+        window_start = max(start, column - 2 * (row + 1) - 10)
+        target = scoring.decode(db.codes[window_start:column + 1])
+        alignment = scoring.aligner.align(target, query[:row + 1])[0]
+        target_blocks, query_blocks = alignment.aligned
+        matches = 0
+        columns = 0
+        gap_opens = 0
+        for k in range(len(target_blocks)):
+            t_start, t_end = target_blocks[k]
+            q_start, q_end = query_blocks[k]
+            columns += t_end - t_start
+            matches += sum(1 for a, b in zip(target[t_start:t_end], query[q_start:q_end]) if a == b)
+            if k > 0:
+                for gap in (t_start - target_blocks[k - 1][1], q_start - query_blocks[k - 1][1]):
+                    if gap:
+                        gap_opens += 1
+                        columns += gap
+        mismatches = sum(t_end - t_start for t_start, t_end in target_blocks) - matches
+        qstart = int(query_blocks[0][0]) + 1
+        qend = int(query_blocks[-1][1])
+        if strand == -1:
+            # Query was reverse complemented
+            qstart, qend = len(query) - qend + 1, len(query) - qstart + 1
+        sstart = int(target_blocks[0][0]) + window_start - start + 1
+        send = int(target_blocks[-1][1]) + window_start - start
+        if frame > 0:
+            # Protein coordinates in a translated frame
+            sstart = frame + 3 * (sstart - 1)
+            send = frame + 3 * send - 1
+        elif frame < 0:
+            sstart = sequence_len - (-frame - 1) - 3 * (sstart - 1)
+            send = sequence_len - (-frame - 1) - 3 * send + 1
+        if strand == -1:
+            sstart, send = send, sstart
+        score = alignment.score
+        bitscore = (scoring.lam * score - math.log(scoring.K)) / math.log(2)
+        evalue = scoring.K * query_len * db.residues * math.exp(-scoring.lam * score)
+        row_values = [_query_name(query_id),
+                      header,
+                      '{:.3f}'.format(matches * 100.0 / columns),
+                      str(columns),
+                      str(mismatches),
+                      str(gap_opens),
+                      str(qstart),
+                      str(qend),
+                      str(sstart),
+                      str(send),
+                      '{:.2e}'.format(evalue),
+                      '{:.1f}'.format(bitscore)
+                      ]
+        if with_qlen:
+            row_values.append(str(query_len))
+        return bitscore, '\t'.join(row_values)
+
+    def _search_query(self, tool, query_id, sequence, db, params, with_qlen):
+        scoring = db.scoring
+        sequence = sequence.upper()
+        query_len = len(sequence)
+        max_evalue = float(params['evalue'])
+        # Lowest score that can pass the e-value threshold
+        min_score = (math.log(scoring.K * query_len * max(db.residues, 1)) - math.log(max_evalue)) / scoring.lam
+        min_score = max(int(math.ceil(min_score)), 1)
+        strands = [(1, sequence)]
+        if tool == 'blastn':
+            reverse = sequence[::-1].translate(str.maketrans('ACGTRYKMBVDHN', 'TGCAYRMKVBHDN'))
+            strands.append((-1, reverse))
+        hits = []
+        for strand, query in strands:
+            query_codes = scoring.encode(query)
+            query = scoring.decode(query_codes)
+            best, best_row = self._scan(query_codes, db)
+            segment_best = np.maximum.reduceat(best, db.starts)
+            for segment_index in np.nonzero(segment_best >= min_score)[0]:
+                start = db.segments[segment_index][3]
+                length = db.segments[segment_index][4]
+                column = start + int(np.argmax(best[start:start + length]))
+                hits.append(self._hit(query_id, query, strand, db, segment_index,
+                                      column, int(best_row[column]), with_qlen, query_len))
+        hits.sort(key=lambda x: -x[0])
+        return [hit for _, hit in hits[:int(params['hitstoshow'])]]
+
+    def search(self, tool, queries, params, short_query=False, with_qlen=False):
+        '''
+            Returns list of hits, at most hitstoshow per query
+        '''
+        db = self._database(tool)
+        result = []
+        if not db.segments:
+            return result
+        for query_id, sequence in queries:
+            result += self._search_query(tool, query_id, sequence, db, params, with_qlen)
+        return result
+
+    def is_available(self, tool):
+        return True
+
+
+_backends = {'blast': BlastBackend(), 'local': LocalAlignmentBackend()}
+# Collection sizes by (BLAST database version, 'protein' or 'nucleotide')
+_collection_sizes = {}
+
+
+def _collection_size(tool):
+    '''
+        Returns number of residues in sequences searched by the tool.
+        Sizes are summed once per BLAST database version, so with
+        SEARCH_BACKEND=auto searches do not scan the sequence tables.
+    '''
+    global _collection_sizes
+    key = (get_blast_db_version(), 'protein' if tool == 'blastp' else 'nucleotide')
+    if key not in _collection_sizes:
+        if tool == 'blastp':
+            size = Protein.objects.aggregate(size=Sum(Length('sequence')))['size'] or 0
+        else:
+            size = (Plasmid.objects.aggregate(size=Sum(Length('sequence')))['size'] or 0) + \
+                (Oligo.objects.aggregate(size=Sum(Length('sequence')))['size'] or 0)
+        # Sizes of previous versions are not needed anymore
+        _collection_sizes = {old_key: old_size for old_key, old_size in _collection_sizes.items()
+                             if old_key[0] == key[0]}
+        _collection_sizes[key] = size
+    return _collection_sizes[key]
+
+
+def get_search_backend(tool):
+    '''
+        Returns search backend for the tool according to SEARCH_BACKEND setting
+    '''
+    if SEARCH_BACKEND == 'local':
+        return _backends['local']
+    if SEARCH_BACKEND == 'auto':
+        if not _backends['blast'].is_available(tool):
+            return _backends['local']
+        if _collection_size(tool) <= LOCAL_SEARCH_MAX_RESIDUES:
+            return _backends['local']
+    return _backends['blast']
@@ -0,0 +1,132 @@
+"""
+    Database-backed cache of sequence search results.
+
+    Cache keys combine hash of the sanitized query, search tool,
+    e-value, hitstoshow and BLAST database version stamp. Rebuilding
+    BLAST databases changes the version stamp, so old entries are never
+    served and get purged at the next write.
+"""
+import hashlib
+from django.db.models import F, Sum
+from django.utils import timezone
+from magicpool.models import Search_cache, Search_cache_counter
+from magicpool.blast_db import get_blast_db_version
+from amdplasmids.settings import SEARCH_CACHE_ENABLED, SEARCH_CACHE_MAX_ENTRIES
+from amdplasmids.settings import SEARCH_CACHE_MAX_SIZE
+
+HITS = 'hits'
+MISSES = 'misses'
+EVICTIONS = 'evictions'
+
+
+def make_key(tool, query, params, db_version):
+    '''
+        Returns cache key for a query sequence (or multi-FASTA text),
+        validated search parameters and BLAST database version stamp
+    '''
+    query_hash = hashlib.sha256(query.upper().encode('utf-8')).hexdigest()
+    key = '|'.join([tool,
+                    query_hash,
+                    params['evalue'],
+                    params['hitstoshow'],
+                    db_version
+                    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _increment(name, count=1):
+    if not Search_cache_counter.objects.filter(name=name).update(value=F('value') + count):
+        counter, _ = Search_cache_counter.objects.get_or_create(name=name)
+        Search_cache_counter.objects.filter(id=counter.id).update(value=F('value') + count)
+
+
+def get(key):
+    '''
+        Returns (hits, searchcontext, query_len) for the key 
+        or None if there is no cached result
+    '''
+    if not SEARCH_CACHE_ENABLED:
+        return None
+    try:
+        entry = Search_cache.objects.get(key=key)
+    except Search_cache.DoesNotExist:
+        _increment(MISSES)
+        return None
+    Search_cache.objects.filter(id=entry.id).update(last_used=timezone.now(),
+                                                    hit_count=F('hit_count') + 1
+                                                    )
+    _increment(HITS)
+    hits = [row for row in entry.hits.split('\n') if row]
+    return hits, entry.searchcontext, entry.query_len
+
+
+def put(key, tool, hits, searchcontext, query_len, db_version):
+    '''
+        Stores search results and evicts stale and least recently used entries.
+        db_version is the BLAST database version stamp the key was made with.
+    '''
+    if not SEARCH_CACHE_ENABLED:
+        return
+    hits_text = '\n'.join(hits)
+    Search_cache.objects.update_or_create(
+        key=key,
+        defaults={'tool':tool,
+                  'db_version':db_version,
+                  'hits':hits_text,
+                  'searchcontext':searchcontext,
+                  'query_len':query_len,
+                  'size':len(hits_text),
+                  'last_used':timezone.now()
+                  }
+        )
+    evict(db_version)
+
+
+def evict(db_version=None):
+    '''
+        Deletes entries for other BLAST database versions, then least 
+        recently used entries over SEARCH_CACHE_MAX_ENTRIES or SEARCH_CACHE_MAX_SIZE
+    '''
+    if db_version is None:
+        db_version = get_blast_db_version()
+    evicted, _ = Search_cache.objects.exclude(db_version=db_version).delete()
+    entry_count = Search_cache.objects.count()
+    total_size = Search_cache.objects.aggregate(total=Sum('size'))['total'] or 0
+    if entry_count > SEARCH_CACHE_MAX_ENTRIES or total_size > SEARCH_CACHE_MAX_SIZE:
+        delete_ids = []
+        for entry_id, size in Search_cache.objects.order_by(
+            'last_used'
+        ).values_list('id', 'size'):
+            if entry_count <= SEARCH_CACHE_MAX_ENTRIES and total_size <= SEARCH_CACHE_MAX_SIZE:
+                break
+            delete_ids.append(entry_id)
+            entry_count -= 1
+            total_size -= size
+        Search_cache.objects.filter(id__in=delete_ids).delete()
+        evicted += len(delete_ids)
+    if evicted:
+        _increment(EVICTIONS, evicted)
+    return evicted
+
+
+def clear():
+    '''
+        Deletes all cache entries and resets counters
+    '''
+    Search_cache.objects.all().delete()
+    Search_cache_counter.objects.all().delete()
+
+
+def stats():
+    '''
+        Returns dictionary of cache counters and current cache size
+    '''
+    result = {HITS:0, MISSES:0, EVICTIONS:0}
+    for counter in Search_cache_counter.objects.all():
+        result[counter.name] = counter.value
+    lookups = result[HITS] + result[MISSES]
+    result['hit_rate'] = result[HITS] / lookups if lookups else 0.0
+    result['entries'] = Search_cache.objects.count()
+    result['size'] = Search_cache.objects.aggregate(total=Sum('size'))['total'] or 0
+    result['db_version'] = get_blast_db_version()
+    return result
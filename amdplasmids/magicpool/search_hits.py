@@ -0,0 +1,132 @@
+"""
+    Annotation of tabular BLAST hits for search result pages and exports.
+
+    All rows are parsed first, then database objects are resolved with
+    one in_bulk query per target type, so the number of queries does not
+    depend on the number of hits.
+"""
+from magicpool.models import Plasmid, Oligo, Protein
+from magicpool.sequence_index import ORIGIN_SPANNING
+
+
+def parse_hits(hits, query_len=0):
+    '''
+        Splits tabular hits (outfmt 6, optionally with query length
+        in the 13th column) and computes query coverage and hit coordinates.
+        Hits of the sequence index across the origin have ORIGIN_SPANNING
+        in the 14th column, and their end coordinate wraps around.
+        Returns list of dictionaries.
+    '''
+    result = []
+    for line in hits:
+        row = line.split('\t')
+        if len(row) < 12:
+            continue
+        row_query_len = int(row[12]) if len(row) > 12 else query_len
+        unaligned_part = int(row[6]) - 1 + row_query_len - int(row[7])
+        if row_query_len:
+            query_cov = (row_query_len - unaligned_part) * 100.0 / row_query_len
+        else:
+            query_cov = 0.0
+        wrapped = len(row) > 13 and row[13] == ORIGIN_SPANNING
+        if (int(row[8]) < int(row[9])) != wrapped:
+            hit_coord = row[8] + '..' + row[9]
+        else:
+            hit_coord = 'complement(' + row[9] + '..' + row[8] + ')'
+        target_tokens = row[1].split('|')
+        result.append({'query':row[0],
+                       'target_id':int(target_tokens[0]),
+                       'target_type':target_tokens[2] if len(target_tokens) > 2 else '',
+                       'identity':'{:.1f}'.format(float(row[2])),
+                       'length':row[3],
+                       'query_cov':'{:.1f}'.format(query_cov),
+                       'qstart':row[6],
+                       'qend':row[7],
+                       'sstart':row[8],
+                       'send':row[9],
+                       'evalue':row[10],
+                       'bitscore':row[11],
+                       'hit_coord':hit_coord
+                       })
+    return result
+
+
+def _group_by_query(parsed_hits):
+    result = {}
+    for hit in parsed_hits:
+        if hit['query'] not in result:
+            result[hit['query']] = []
+    return result
+
+
+def annotate_nucleotide_hits(hits, query_len=0):
+    '''
+        Returns hits in plasmids and oligos grouped by query.
+        Used for blastn and tblastn searches.
+    '''
+    parsed_hits = parse_hits(hits, query_len)
+    plasmid_ids = {hit['target_id'] for hit in parsed_hits if hit['target_type'] == 'plasmid'}
+    oligo_ids = {hit['target_id'] for hit in parsed_hits if hit['target_type'] == 'oligo'}
+    plasmids = Plasmid.objects.only('id', 'name', 'amd_number').in_bulk(plasmid_ids)
+    oligos = Oligo.objects.only('id', 'name').in_bulk(oligo_ids)
+    result = _group_by_query(parsed_hits)
+    for hit in parsed_hits:
+        if hit['target_type'] == 'plasmid' and hit['target_id'] in plasmids:
+            plasmid = plasmids[hit['target_id']]
+            if plasmid.amd_number != '':
+                label = plasmid.name + '/' + plasmid.amd_number
+            else:
+                label = plasmid.name
+            target = ['Plasmid', plasmid.id, label]
+        elif hit['target_type'] == 'oligo' and hit['target_id'] in oligos:
+            oligo = oligos[hit['target_id']]
+            target = ['Oligo', oligo.id, oligo.name]
+        else:
+            # Object was deleted after BLAST database was built
+            continue
+        result[hit['query']].append(target + [hit['identity'],
+                                              hit['length'],
+                                              hit['query_cov'],
+                                              hit['evalue'],
+                                              hit['bitscore'],
+                                              hit['hit_coord']
+                                              ])
+    return result
+
+
+def annotate_protein_hits(hits, query_len=0):
+    '''
+        Returns hits in proteins grouped by query.
+        Used for blastp searches.
+    '''
+    parsed_hits = parse_hits(hits, query_len)
+    proteins = Protein.objects.select_related(
+        'feature', 'feature__plasmid'
+    ).only(
+        'id', 'name', 'function', 'feature', 'feature__plasmid',
+        'feature__plasmid__id', 'feature__plasmid__name'
+    ).in_bulk({hit['target_id'] for hit in parsed_hits})
+    result = _group_by_query(parsed_hits)
+    for hit in parsed_hits:
+        if hit['target_id'] not in proteins:
+            continue
+        protein = proteins[hit['target_id']]
+        result[hit['query']].append([protein.name + ': ' + protein.function + ' [' + hit['sstart'] + '..' + hit['send'] + ']',
+                                     protein.feature.plasmid.id,
+                                     protein.feature.plasmid.name,
+                                     hit['identity'],
+                                     hit['length'],
+                                     hit['query_cov'],
+                                     hit['evalue'],
+                                     hit['bitscore']
+                                     ])
+    return result
+
+
+def annotate_hits(hits, query_len, tool):
+    '''
+        Returns annotated hits grouped by query for any search tool
+    '''
+    if tool == 'blastp':
+        return annotate_protein_hits(hits, query_len)
+    return annotate_nucleotide_hits(hits, query_len)
@@ -0,0 +1,194 @@
+"""
+    Database-backed queue for sequence search jobs.
+
+    The search views create a Search_job record and return immediately.
+    Jobs are claimed from the database by a bounded pool of worker threads
+    in the web process (or by the process_search_jobs command), so no
+    external message broker is needed. Workers update the heartbeat of
+    their running jobs, and jobs of a stopped worker are queued again.
+"""
+import json
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from magicpool.models import Search_job
+from magicpool.blast_search import run_nucleotide_search, run_protein_search
+from magicpool.blast_search import run_batch_search
+from magicpool.blast_db import get_blast_db_version
+from amdplasmids.settings import SEARCH_JOB_WORKERS, SEARCH_JOB_MAX_QUEUED
+from amdplasmids.settings import SEARCH_JOB_TIMEOUT, SEARCH_JOB_EXPIRE_DAYS
+from amdplasmids.settings import SEARCH_JOB_HEARTBEAT_INTERVAL, SEARCH_JOB_HEARTBEAT_TIMEOUT
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_ERROR = 'error'
+
+SEARCH_FUNCTIONS = {
+    'nucleotide': run_nucleotide_search,
+    'protein': run_protein_search,
+    'batch': run_batch_search,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(SEARCH_JOB_WORKERS, 1),
+                                           thread_name_prefix='search_job'
+                                           )
+    return _executor
+
+
+def submit_job(search_type, params):
+    '''
+        Creates a new search job and wakes up a local worker.
+        Returns None if the queue is full.
+    '''
+    if search_type not in SEARCH_FUNCTIONS:
+        raise ValueError('Unknown search type: ' + str(search_type))
+    expire_jobs()
+    if Search_job.objects.filter(status=JOB_QUEUED).count() >= SEARCH_JOB_MAX_QUEUED:
+        return None
+    job = Search_job.objects.create(search_type=search_type,
+                                    params=json.dumps(params),
+                                    tool=search_tool(search_type, params)
+                                    )
+    _get_executor().submit(process_queue)
+    return job
+
+
+def search_tool(search_type, params):
+    '''
+        Returns BLAST program of a search
+    '''
+    if search_type == 'nucleotide':
+        return 'blastn'
+    return params.get('tool') or 'blastp'
+
+
+def queue_position(job):
+    '''
+        Returns number of queued jobs submitted before the job
+    '''
+    return Search_job.objects.filter(status=JOB_QUEUED, id__lt=job.id).count()
+
+
+def requeue_stale_jobs():
+    '''
+        Queues again running jobs without a heartbeat
+        for SEARCH_JOB_HEARTBEAT_TIMEOUT seconds
+    '''
+    return Search_job.objects.filter(
+        status=JOB_RUNNING,
+        heartbeat__lt=timezone.now() - timedelta(seconds=SEARCH_JOB_HEARTBEAT_TIMEOUT)
+    ).update(status=JOB_QUEUED, started=None, heartbeat=None)
+
+
+def claim_next_job():
+    '''
+        Marks the oldest queued job as running and returns it.
+        Returns None if the queue is empty or all workers are busy.
+    '''
+    requeue_stale_jobs()
+    if Search_job.objects.filter(status=JOB_RUNNING).count() >= SEARCH_JOB_WORKERS:
+        return None
+    queued_ids = Search_job.objects.filter(
+        status=JOB_QUEUED
+    ).order_by('id').values_list('id', flat=True)[:SEARCH_JOB_WORKERS]
+    for job_id in queued_ids:
+        # Conditional update makes the claim atomic across threads and processes
+        now = timezone.now()
+        if Search_job.objects.filter(id=job_id, status=JOB_QUEUED).update(
+            status=JOB_RUNNING, started=now, heartbeat=now
+        ):
+            return Search_job.objects.get(id=job_id)
+    return None
+
+
+class Heartbeat(threading.Thread):
+    '''
+        Updates heartbeat of a running job until stopped
+    '''
+    def __init__(self, job_id):
+        super().__init__(daemon=True, name='search_job_heartbeat')
+        self.job_id = job_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(SEARCH_JOB_HEARTBEAT_INTERVAL):
+                Search_job.objects.filter(id=self.job_id, status=JOB_RUNNING).update(heartbeat=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job):
+    '''
+        Runs search for a claimed job and stores the results
+    '''
+    search_function = SEARCH_FUNCTIONS[job.search_type]
+    # Searches read the version that is active when they start
+    job.db_version = get_blast_db_version()
+    if job.tool == '':
+        # Jobs queued before the program was stored on submit
+        job.tool = search_tool(job.search_type, json.loads(job.params))
+    heartbeat = Heartbeat(job.id)
+    heartbeat.start()
+    try:
+        hits, searchcontext, query_len, _ = search_function(json.loads(job.params))
+    except Exception as e:
+        job.status = JOB_ERROR
+        job.searchcontext = 'Search failed: ' + str(e)
+    else:
+        job.status = JOB_DONE
+        job.hits = '\n'.join(hits)
+        job.searchcontext = searchcontext
+        job.query_len = query_len
+    finally:
+        heartbeat.stop()
+    job.finished = timezone.now()
+    job.save()
+    return job
+
+
+def process_queue():
+    '''
+        Runs queued jobs until the queue is empty or the concurrency limit is reached
+    '''
+    close_old_connections()
+    try:
+        job = claim_next_job()
+        while job is not None:
+            run_job(job)
+            job = claim_next_job()
+    finally:
+        close_old_connections()
+
+
+def expire_jobs():
+    '''
+        Fails jobs that have been running longer than SEARCH_JOB_TIMEOUT
+        and deletes jobs older than SEARCH_JOB_EXPIRE_DAYS
+    '''
+    now = timezone.now()
+    Search_job.objects.filter(
+        status=JOB_RUNNING,
+        started__lt=now - timedelta(seconds=SEARCH_JOB_TIMEOUT)
+    ).update(status=JOB_ERROR,
+             searchcontext='Search job timed out',
+             finished=now
+             )
+    Search_job.objects.filter(
+        created__lt=now - timedelta(days=SEARCH_JOB_EXPIRE_DAYS)
+    ).delete()
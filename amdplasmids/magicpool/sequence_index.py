@@ -0,0 +1,325 @@
+"""
+    In-process index of plasmid and oligo sequences for short queries.
+
+    The index is written next to the BLAST databases by update_blast_databases().
+    It consists of four files:
+        sequences.txt - all sequences in upper case, one per line.
+            Plasmids are circular, so each plasmid line is extended with
+            the first SEQUENCE_INDEX_MAX_QUERY - 1 bases of its sequence
+            to find matches across the origin.
+        kmer_starts.npy, kmer_positions.npy - positions in sequences.txt
+            sorted by the KMER_LENGTH-mer starting there, and start of
+            every k-mer in the position array. K-mers cut short by
+            a line end or an ambiguous base are padded with A.
+        targets.tsv - offset, sequence length, circular flag and
+            BLAST-style header of every sequence.
+
+    Web workers memory-map the files. Matches with mismatches are found
+    with the pigeonhole principle: a query with m mismatches contains
+    at least one of its m + 1 segments without mismatches. Positions
+    of a segment are looked up in the k-mer index: a segment shorter
+    than KMER_LENGTH is a prefix of a range of adjacent k-mers, and
+    a longer one is looked up by its first KMER_LENGTH bases. All
+    candidate positions are then verified at once with numpy.
+"""
+import os
+import mmap
+import math
+import threading
+import numpy as np
+from pathlib import Path
+from amdplasmids.settings import SEQUENCE_INDEX_DIR, SEQUENCE_INDEX_MAX_MISMATCHES
+
+# Longest query served from the index. Longer queries go to BLAST.
+SEQUENCE_INDEX_MAX_QUERY = 30
+# Shortest segment used as a seed for matches with mismatches
+MIN_SEED_LENGTH = 5
+# Karlin-Altschul parameters for blastn scoring (reward 2, penalty -3, gaps 5/2)
+MATCH_SCORE = 2
+MISMATCH_SCORE = -3
+LAMBDA = 0.625
+K = 0.41
+# Value of the 14th column of hits across the origin of a circular sequence
+ORIGIN_SPANNING = 'origin'
+
+# Length of k-mers in the index. The k-mer start array has 4 ** KMER_LENGTH + 1 items.
+KMER_LENGTH = 10
+
+SEQUENCES_FILE = 'sequences.txt'
+TARGETS_FILE = 'targets.tsv'
+KMER_STARTS_FILE = 'kmer_starts.npy'
+KMER_POSITIONS_FILE = 'kmer_positions.npy'
+
+_COMPLEMENT = bytes.maketrans(b'ACGTRYKMBVDHN', b'TGCAYRMKVBHDN')
+# 2-bit codes of bases, 4 for anything else
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+    _BASE_CODES[_base] = _code
+_NEWLINE = ord('\n')
+
+
+def _reverse_complement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def build_kmer_index(text):
+    '''
+        Returns k-mer start array and array of positions of the text
+        sorted by k-mer. Positions of ambiguous bases and line ends
+        are left out.
+    '''
+    bases = _BASE_CODES[np.frombuffer(text, dtype=np.uint8)]
+    text_length = len(bases)
+    codes = np.zeros(text_length, dtype=np.uint32)
+    # Positions where the k-mer is not cut short before base j
+    unbroken = np.ones(text_length, dtype=bool)
+    for j in range(KMER_LENGTH):
+        shifted = np.full(text_length, 4, dtype=np.uint8)
+        shifted[:text_length - j] = bases[j:]
+        unbroken &= shifted < 4
+        codes |= np.where(unbroken, shifted, 0).astype(np.uint32) << np.uint32(2 * (KMER_LENGTH - 1 - j))
+    positions = np.flatnonzero(bases < 4)
+    codes = codes[positions]
+    positions = positions[np.argsort(codes, kind='stable')].astype(np.uint32)
+    starts = np.zeros(4 ** KMER_LENGTH + 1, dtype=np.uint32)
+    starts[1:] = np.cumsum(np.bincount(codes, minlength=4 ** KMER_LENGTH))
+    return starts, positions
+
+
+class SequenceIndexWriter:
+    '''
+        Writes sequence index files. Files are written under temporary
+        names and moved into place by close(), so readers never see
+        a partially written index.
+    '''
+    def __init__(self, index_dir=SEQUENCE_INDEX_DIR):
+        self.index_dir = index_dir
+        Path(index_dir).mkdir(parents=True, exist_ok=True)
+        self.sequences_path = os.path.join(index_dir, SEQUENCES_FILE)
+        self.targets_path = os.path.join(index_dir, TARGETS_FILE)
+        self.kmer_starts_path = os.path.join(index_dir, KMER_STARTS_FILE)
+        self.kmer_positions_path = os.path.join(index_dir, KMER_POSITIONS_FILE)
+        self.sequences_file = open(self.sequences_path + '.tmp', 'wb')
+        self.targets_file = open(self.targets_path + '.tmp', 'w')
+        self.offset = 0
+
+    def add(self, header, sequence, circular):
+        '''
+            Adds sequence with BLAST-style header (id|name|type|...)
+        '''
+        sequence = sequence.upper().encode('ascii', errors='replace')
+        if not sequence:
+            return
+        line = sequence
+        if circular:
+            pad_length = SEQUENCE_INDEX_MAX_QUERY - 1
+            line += (sequence * (pad_length // len(sequence) + 1))[:pad_length]
+        self.sequences_file.write(line + b'\n')
+        self.targets_file.write('\t'.join([str(self.offset),
+                                           str(len(sequence)),
+                                           '1' if circular else '0',
+                                           header
+                                           ]) + '\n')
+        self.offset += len(line) + 1
+
+    def close(self):
+        self.sequences_file.close()
+        self.targets_file.close()
+        starts, positions = build_kmer_index(np.fromfile(self.sequences_path + '.tmp', dtype=np.uint8))
+        for path, array in ((self.kmer_starts_path, starts), (self.kmer_positions_path, positions)):
+            with open(path + '.tmp', 'wb') as outfile:
+                np.save(outfile, array)
+        os.replace(self.sequences_path + '.tmp', self.sequences_path)
+        os.replace(self.kmer_starts_path + '.tmp', self.kmer_starts_path)
+        os.replace(self.kmer_positions_path + '.tmp', self.kmer_positions_path)
+        # Readers reload the index when the targets file changes
+        os.replace(self.targets_path + '.tmp', self.targets_path)
+
+    def abort(self):
+        '''
+            Discards written files and keeps the current index
+        '''
+        self.sequences_file.close()
+        self.targets_file.close()
+        os.remove(self.sequences_path + '.tmp')
+        os.remove(self.targets_path + '.tmp')
+
+    def exists(self):
+        '''
+            Checks if there is a complete index in the index directory
+        '''
+        return all(os.path.exists(path) for path in (self.sequences_path, self.targets_path,
+                                                     self.kmer_starts_path, self.kmer_positions_path))
+
+
+class SequenceIndex:
+    '''
+        Read-only memory-mapped sequence index
+    '''
+    def __init__(self, index_dir=SEQUENCE_INDEX_DIR):
+        self.targets_path = os.path.join(index_dir, TARGETS_FILE)
+        self.mtime = os.path.getmtime(self.targets_path)
+        self.offsets = []
+        self.lengths = []
+        self.circular = []
+        self.headers = []
+        with open(self.targets_path, 'r') as infile:
+            for line in infile:
+                offset, length, circular, header = line.rstrip('\n').split('\t', 3)
+                self.offsets.append(int(offset))
+                self.lengths.append(int(length))
+                self.circular.append(circular == '1')
+                self.headers.append(header)
+        self.db_length = sum(self.lengths)
+        self.offset_array = np.array(self.offsets, dtype=np.int64)
+        with open(os.path.join(index_dir, SEQUENCES_FILE), 'rb') as infile:
+            if os.fstat(infile.fileno()).st_size:
+                self.text = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                self.array = np.frombuffer(self.text, dtype=np.uint8)
+            else:
+                self.text = b''
+                self.array = np.zeros(0, dtype=np.uint8)
+        self.kmer_starts = np.load(os.path.join(index_dir, KMER_STARTS_FILE), mmap_mode='r')
+        self.kmer_positions = np.load(os.path.join(index_dir, KMER_POSITIONS_FILE), mmap_mode='r')
+
+    def _seed_positions(self, seed):
+        '''
+            Returns array of positions where the seed may start
+        '''
+        length = min(len(seed), KMER_LENGTH)
+        code = 0
+        for base in seed[:length]:
+            code = code * 4 + int(_BASE_CODES[base])
+        shift = 2 * (KMER_LENGTH - length)
+        return self.kmer_positions[self.kmer_starts[code << shift]:self.kmer_starts[(code + 1) << shift]]
+
+    def find(self, sequence, max_mismatches=0):
+        '''
+            Finds occurrences of the sequence with up to max_mismatches
+            mismatches on both strands. Returns list of
+            (target index, start, strand, mismatches) tuples, where start
+            is a 0-based position of the leftmost base in the target.
+            Sequences with bases other than A, C, G and T are not found.
+        '''
+        sequence = sequence.upper().encode('ascii')
+        query_len = len(sequence)
+        if query_len == 0 or sequence.translate(None, b'ACGT'):
+            return []
+        max_mismatches = min(max_mismatches, query_len // MIN_SEED_LENGTH - 1)
+        max_mismatches = max(max_mismatches, 0)
+        window_offsets = np.arange(query_len)
+        result = {}
+        strands = [(1, sequence)]
+        reverse = _reverse_complement(sequence)
+        if reverse != sequence:
+            strands.append((-1, reverse))
+        for strand, pattern in strands:
+            seed_length = query_len // (max_mismatches + 1)
+            seeds = [(i * seed_length, pattern[i * seed_length:(i + 1) * seed_length])
+                     for i in range(max_mismatches)]
+            seeds.append((max_mismatches * seed_length, pattern[max_mismatches * seed_length:]))
+            candidates = np.unique(np.concatenate([self._seed_positions(seed).astype(np.int64) - seed_offset
+                                                   for seed_offset, seed in seeds]))
+            candidates = candidates[(candidates >= 0) & (candidates <= len(self.array) - query_len)]
+            if len(candidates) == 0:
+                continue
+            windows = self.array[candidates[:, None] + window_offsets]
+            mismatches = np.count_nonzero(windows != np.frombuffer(pattern, dtype=np.uint8), axis=1)
+            # Windows across a line end belong to two sequences
+            found = (mismatches <= max_mismatches) & ~(windows == _NEWLINE).any(axis=1)
+            positions = candidates[found]
+            targets = np.searchsorted(self.offset_array, positions, side='right') - 1
+            for position, target, position_mismatches in zip(positions.tolist(), targets.tolist(),
+                                                              mismatches[found].tolist()):
+                start = position - self.offsets[target]
+                if start >= self.lengths[target]:
+                    # Copy of a match at the beginning of a circular sequence
+                    continue
+                result[(target, start, strand)] = position_mismatches
+        return [(target, start, strand, mismatches)
+                for (target, start, strand), mismatches in result.items()]
+
+    def search(self, query_id, sequence, evalue, hitstoshow, max_mismatches=SEQUENCE_INDEX_MAX_MISMATCHES):
+        '''
+            Returns hits in BLAST tabular format with query length
+            (outfmt "6 std qlen") sorted by bit-score. Hits across
+            the origin have ORIGIN_SPANNING in an extra 14th column.
+        '''
+        query_len = len(sequence)
+        hits = []
+        for target, start, strand, mismatches in self.find(sequence, max_mismatches):
+            score = MATCH_SCORE * (query_len - mismatches) + MISMATCH_SCORE * mismatches
+            bitscore = (LAMBDA * score - math.log(K)) / math.log(2)
+            hit_evalue = query_len * self.db_length * 2 ** -bitscore
+            if hit_evalue > evalue:
+                continue
+            # Coordinates of matches across the origin wrap around
+            # to the beginning of the sequence
+            end = (start + query_len - 1) % self.lengths[target] + 1
+            extra = [str(query_len)]
+            if start + query_len > self.lengths[target]:
+                extra.append(ORIGIN_SPANNING)
+            if strand == 1:
+                sstart, send = start + 1, end
+            else:
+                sstart, send = end, start + 1
+            hits.append((bitscore, [query_id,
+                                    self.headers[target],
+                                    '{:.3f}'.format((query_len - mismatches) * 100.0 / query_len),
+                                    str(query_len),
+                                    str(mismatches),
+                                    '0',
+                                    '1',
+                                    str(query_len),
+                                    str(sstart),
+                                    str(send),
+                                    '{:.2e}'.format(hit_evalue),
+                                    '{:.1f}'.format(bitscore)
+                                    ] + extra))
+        hits.sort(key=lambda x: -x[0])
+        return ['\t'.join(row) for _, row in hits[:hitstoshow]]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_sequence_index():
+    '''
+        Returns memory-mapped index, reloading it if the index was rebuilt.
+        Returns None if the index does not exist.
+    '''
+    global _index
+    targets_path = os.path.join(SEQUENCE_INDEX_DIR, TARGETS_FILE)
+    try:
+        mtime = os.path.getmtime(targets_path)
+    except FileNotFoundError:
+        return None
+    with _index_lock:
+        if _index is None or _index.mtime != mtime:
+            try:
+                _index = SequenceIndex()
+            except FileNotFoundError:
+                # Index made before the k-mer files were added
+                return None
+    return _index
+
+
+def search_short_query(query_id, sequence, params):
+    '''
+        Searches short nucleotide query in the sequence index.
+        Returns None if the query cannot be served from the index.
+    '''
+    if len(sequence) > SEQUENCE_INDEX_MAX_QUERY:
+        return None
+    if set(sequence.upper()) - set('ACGT'):
+        # Ambiguous nucleotides are left to BLAST
+        return None
+    index = get_sequence_index()
+    if index is None:
+        return None
+    return index.search(query_id,
+                        sequence,
+                        float(params['evalue']),
+                        int(params['hitstoshow'])
+                        )
@@ -0,0 +1,60 @@
+"""
+    Signal receivers keeping the full-text index up to date
+    for objects saved one by one and proteins deleted one by one.
+
+    Objects are not removed from the index by post_delete receivers,
+    because receivers turn off the fast queryset delete of Django.
+    Code deleting plasmids, features, oligos and strains calls
+    text_index.delete() with IDs collected before the deletion. Rows of
+    objects deleted otherwise, e.g. in the admin, are left in the index
+    until rebuild_text_index. Text search skips them.
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from magicpool.models import Plasmid, Feature, Protein
+from magicpool import text_index
+
+
+def update_text_index(sender, instance, **kwargs):
+    text_index.update(sender, [instance.id])
+
+
+for model in text_index.MODEL_ENTITIES:
+    post_save.connect(update_text_index, sender=model, dispatch_uid='text_index_save_' + model.__name__)
+
+
+@receiver(pre_save, sender=Plasmid, dispatch_uid='text_index_plasmid_name')
+def remember_plasmid_name(sender, instance, **kwargs):
+    '''
+        Keeps the stored plasmid name to find out if the plasmid is renamed
+    '''
+    instance._indexed_name = None
+    if instance.id is not None:
+        instance._indexed_name = Plasmid.objects.filter(id=instance.id).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Plasmid, dispatch_uid='text_index_save_plasmid_features')
+def update_plasmid_features(sender, instance, created, **kwargs):
+    '''
+        Plasmid name is indexed as a part of the text of its features
+    '''
+    if not created and getattr(instance, '_indexed_name', None) not in (None, instance.name):
+        text_index.update(Feature, Feature.objects.filter(plasmid_id=instance.id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Protein, dispatch_uid='text_index_save_Protein')
+def update_protein_feature(sender, instance, **kwargs):
+    '''
+        Protein function is indexed as a part of the feature text
+    '''
+    text_index.update(Feature, [instance.feature_id])
+
+
+@receiver(post_delete, sender=Protein, dispatch_uid='text_index_delete_Protein')
+def delete_protein_function(sender, instance, origin=None, **kwargs):
+    '''
+        Removes function of a deleted protein from the feature text.
+        Proteins deleted together with their features are skipped.
+    '''
+    if isinstance(origin, Protein) or getattr(origin, 'model', None) is Protein:
+        text_index.update(Feature, [instance.feature_id])
@@ -0,0 +1,91 @@
+"""
+    Shared helpers for spreadsheet import.
+
+    Workbooks are opened in openpyxl read-only mode, so rows are streamed
+    from the file instead of loading the whole workbook into memory.
+    Existing *_info rows are loaded into a dictionary once per table,
+    and new and changed rows are written with bulk_create and bulk_update.
+"""
+import time
+import openpyxl
+from magicpool.instrumentation import count
+
+BATCH_SIZE = 500
+
+
+def read_sheets(xlsx_path, active_sheet_only=False):
+    '''
+        Yields (sheet title, header row, iterator over the other rows)
+        for every sheet of the workbook
+    '''
+    wb_obj = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        sheets = [wb_obj.active] if active_sheet_only else wb_obj.worksheets
+        for sheet in sheets:
+            rows = sheet.iter_rows(values_only=True)
+            yield sheet.title, next(rows, ()), rows
+    finally:
+        wb_obj.close()
+
+
+def row_values(xlsx_header, row):
+    '''
+        Yields (column header, value as string) for non-empty cells
+        of the row except the first column
+    '''
+    for key, cell in zip(xlsx_header[1:], row[1:]):
+        if cell != '' and cell != 'None' and cell is not None:
+            yield key, str(cell)
+
+
+class InfoRows:
+    '''
+        Existing param/value rows of an *_info model by (owner ID, param).
+        set() records new and changed rows, save() writes them.
+    '''
+    def __init__(self, info_model, owner_field):
+        self.info_model = info_model
+        self.owner_field = owner_field
+        self.rows = {}
+        for info in info_model.objects.all():
+            self.rows[(getattr(info, owner_field + '_id'), info.param)] = info
+        self.created = []
+        self.updated = {}
+
+    def set(self, owner, param, value):
+        info = self.rows.get((owner.pk, param))
+        if info is None:
+            info = self.info_model(param=param, value=value, **{self.owner_field: owner})
+            self.rows[(owner.pk, param)] = info
+            self.created.append(info)
+        elif info.value != value:
+            info.value = value
+            if info.pk is not None:
+                self.updated[info.pk] = info
+
+    def save(self):
+        self.info_model.objects.bulk_create(self.created, batch_size=BATCH_SIZE)
+        self.info_model.objects.bulk_update(list(self.updated.values()), ['value'], batch_size=BATCH_SIZE)
+        self.created = []
+        self.updated = {}
+
+
+class SheetStats:
+    '''
+        Row counts and import time of spreadsheet sheets
+    '''
+    def __init__(self):
+        self.sheets = []
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def add(self, title, row_count):
+        seconds = time.perf_counter() - self.start_time
+        print('Sheet ' + title + ': ' + str(row_count) + ' rows in {:.1f} s'.format(seconds))
+        self.sheets.append(title + ' ({} rows, {:.1f} s)'.format(row_count, seconds))
+        count('rows', row_count)
+
+    def report(self):
+        return 'sheets ' + ', '.join(self.sheets)
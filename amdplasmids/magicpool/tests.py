@@ -1,3 +1,488 @@
-from django.test import TestCase
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+
+from magicpool.models import Plasmid, Plasmid_info, Drug_marker, Magic_pool_part_type, Oligo, Search_cache
+from magicpool.models import Feature, Protein, Search_job
+from magicpool import oligo_binding, search_backends, search_cache, search_jobs, text_index
+from magicpool.pagination import keyset_page, ranked_page
+from magicpool.search_hits import parse_hits
+from magicpool.sequence_index import SequenceIndexWriter, SequenceIndex, ORIGIN_SPANNING
+from magicpool.text_index import TABLE as TEXT_INDEX_TABLE
+from magicpool.util import import_plasmids_table
+
+
+# Arbitrary plasmid sequence without repeats of the query lengths used below
+PLASMID_SEQUENCE = ('ATGACCATGATTACGCCAAGCTTGCATGCCTGCAGGTCGACTCTAGAGGATCCCCGGGTA'
+                    'CCGAGCTCGAATTCACTGGCCGTCGTTTTACAACGTCGTGACTGGGAAAACCCTGGCGTT'
+                    'ACCCAACTTAATCGCCTTGCAGCACATCCCCCTTTCGCCAGCTGGCGTAATAGCGAAGAG')
+
+
+# Protein and its coding sequence
+PROTEIN_SEQUENCE = 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQ'
+CODONS = {'M': 'ATG', 'K': 'AAA', 'T': 'ACC', 'A': 'GCG', 'Y': 'TAT', 'I': 'ATT', 'Q': 'CAG', 'R': 'CGT',
+          'S': 'AGC', 'F': 'TTT', 'V': 'GTG', 'H': 'CAT', 'L': 'CTG', 'E': 'GAA', 'G': 'GGC'}
+CODING_SEQUENCE = ''.join(CODONS[amino_acid] for amino_acid in PROTEIN_SEQUENCE)
+
+
+def _reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+
+class ParseHitsTests(SimpleTestCase):
+    def _row(self, sstart, send, *extra):
+        return '\t'.join(['query', '5|pTEST|plasmid', '98.5', '100', '1', '0', '1', '100',
+                          str(sstart), str(send), '1e-50', '190.0'] + list(extra))
+
+    def test_blastn_forward_and_reverse(self):
+        forward, reverse = parse_hits([self._row(101, 200), self._row(200, 101)], 100)
+        self.assertEqual(forward['hit_coord'], '101..200')
+        self.assertEqual(reverse['hit_coord'], 'complement(101..200)')
+        self.assertEqual(forward['target_id'], 5)
+        self.assertEqual(forward['target_type'], 'plasmid')
+        self.assertEqual(forward['query_cov'], '100.0')
+
+    def test_tblastn_subject_span_in_nucleotides(self):
+        # 100 amino acids of the query cover 300 bases of the subject
+        forward, reverse = parse_hits([self._row(100, 399, '100'), self._row(399, 100, '100')])
+        self.assertEqual(forward['hit_coord'], '100..399')
+        self.assertEqual(reverse['hit_coord'], 'complement(100..399)')
+
+    def test_origin_spanning_hits(self):
+        forward, reverse = parse_hits([self._row(171, 10, '20', ORIGIN_SPANNING),
+                                       self._row(10, 171, '20', ORIGIN_SPANNING)])
+        self.assertEqual(forward['hit_coord'], '171..10')
+        self.assertEqual(reverse['hit_coord'], 'complement(171..10)')
+
+    def test_short_rows_are_skipped(self):
+        self.assertEqual(parse_hits(['query\t5|pTEST|plasmid\t100.0']), [])
+
+
+class SequenceIndexTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.index_dir = tempfile.mkdtemp()
+        writer = SequenceIndexWriter(cls.index_dir)
+        writer.add('5|pTEST|plasmid', PLASMID_SEQUENCE, True)
+        writer.add('7|oTEST|oligo', 'GGGAAACCCTTTGGGAAACCC', False)
+        writer.close()
+        cls.index = SequenceIndex(cls.index_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.index_dir)
+        super().tearDownClass()
+
+    def _search(self, sequence):
+        return [line.split('\t') for line in self.index.search('query', sequence, 10.0, 10)]
+
+    def test_forward_match(self):
+        rows = self._search(PLASMID_SEQUENCE[30:50])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][1], '5|pTEST|plasmid')
+        self.assertEqual(rows[0][8:10], ['31', '50'])
+        self.assertEqual(rows[0][12:], ['20'])
+        self.assertEqual(parse_hits(self.index.search('query', PLASMID_SEQUENCE[30:50], 10.0, 10))[0]['hit_coord'],
+                         '31..50')
+
+    def test_reverse_strand_match(self):
+        rows = self._search(_reverse_complement(PLASMID_SEQUENCE[30:50]))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][8:10], ['50', '31'])
+        hit = parse_hits(['\t'.join(rows[0])])[0]
+        self.assertEqual(hit['hit_coord'], 'complement(31..50)')
+
+    def test_mismatch(self):
+        query = PLASMID_SEQUENCE[60:80]
+        query = query[:10] + ('A' if query[10] != 'A' else 'C') + query[11:]
+        rows = self._search(query)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][4], '1')
+        self.assertEqual(rows[0][2], '95.000')
+        self.assertEqual(rows[0][8:10], ['61', '80'])
+        self.assertEqual(self.index.find(query, 0), [])
+
+    def test_origin_spanning_match(self):
+        length = len(PLASMID_SEQUENCE)
+        query = PLASMID_SEQUENCE[-10:] + PLASMID_SEQUENCE[:10]
+        rows = self._search(query)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][8:10], [str(length - 9), '10'])
+        self.assertEqual(rows[0][13], ORIGIN_SPANNING)
+        hit = parse_hits(['\t'.join(rows[0])])[0]
+        self.assertEqual(hit['hit_coord'], '{}..10'.format(length - 9))
+        reverse_rows = self._search(_reverse_complement(query))
+        self.assertEqual(reverse_rows[0][8:10], ['10', str(length - 9)])
+        hit = parse_hits(['\t'.join(reverse_rows[0])])[0]
+        self.assertEqual(hit['hit_coord'], 'complement({}..10)'.format(length - 9))
+
+    def test_linear_sequences_do_not_wrap(self):
+        self.assertEqual(self._search('CCCGGGAAACCCTTTGGGAA'), [])
+
+
+class TextIndexTestCase(TestCase):
+    '''
+        Creates the full-text index table, which is made by a migration
+        and missing when tests run without migrations
+    '''
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS ' + TEXT_INDEX_TABLE +
+                           " USING fts5(name, content, tokenize='trigram')")
+            cursor.execute('INSERT INTO ' + TEXT_INDEX_TABLE + ' (' + TEXT_INDEX_TABLE +
+                           ", rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
+
+class ImportPlasmidsTableTests(TextIndexTestCase):
+    HEADER = ['Plasmid', 'AMD number', 'Drug marker', 'Description', 'Magic pool part type', 'Backbone']
+
+    def setUp(self):
+        self.old_plasmid = Plasmid.objects.create(name='pOLD', amd_number='AMD1', description='Old',
+                                                  sequence='', footprint='')
+        Plasmid_info.objects.create(plasmid=self.old_plasmid, param='Backbone', value='pUC')
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _import(self, rows, overwrite_existing):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(self.HEADER)
+        for row in rows:
+            workbook.active.append(row)
+        xlsx_path = os.path.join(self.work_dir, 'plasmids.xlsx')
+        workbook.save(xlsx_path)
+        return import_plasmids_table(xlsx_path, overwrite_existing)
+
+    def _info(self, plasmid_name):
+        return dict(Plasmid_info.objects.filter(plasmid__name=plasmid_name).values_list('param', 'value'))
+
+    def test_new_and_existing_plasmids_share_new_drug_marker(self):
+        names, report = self._import([['pNEW', 'AMD2', 'ZeoR', 'New', 'Promoter', 'pET'],
+                                      ['pOLD', 'AMD1', 'ZeoR', None, 'Promoter', None]], True)
+        self.assertEqual(names, ['pNEW', 'pOLD'])
+        self.assertIn('Plasmids created: 1', report)
+        self.assertEqual(Drug_marker.objects.filter(name='ZeoR').count(), 1)
+        self.assertEqual(Magic_pool_part_type.objects.filter(name='Promoter').count(), 1)
+        for name in ('pNEW', 'pOLD'):
+            plasmid = Plasmid.objects.get(name=name)
+            self.assertEqual([marker.name for marker in plasmid.drug_markers.all()], ['ZeoR'])
+            self.assertEqual(plasmid.magic_pool_part.name, 'Promoter')
+        new_plasmid = Plasmid.objects.get(name='pNEW')
+        self.assertEqual((new_plasmid.amd_number, new_plasmid.description), ('AMD2', 'New'))
+        self.assertEqual(self._info('pNEW'), {'Backbone': 'pET'})
+
+    def test_without_overwrite_existing_plasmids_are_kept(self):
+        self._import([['pOLD', 'AMD9', 'KanR', 'Changed', None, 'pET'],
+                      ['pNEW', 'AMD2', 'KanR; AmpR', None, None, 'pET']], False)
+        old_plasmid = Plasmid.objects.get(name='pOLD')
+        self.assertEqual((old_plasmid.amd_number, old_plasmid.description), ('AMD1', 'Old'))
+        self.assertFalse(old_plasmid.drug_markers.exists())
+        self.assertEqual(self._info('pOLD'), {'Backbone': 'pUC'})
+        new_plasmid = Plasmid.objects.get(name='pNEW')
+        self.assertEqual(sorted(marker.name for marker in new_plasmid.drug_markers.all()), ['AmpR', 'KanR'])
+        self.assertEqual(self._info('pNEW'), {'Backbone': 'pET'})
+
+    def test_overwrite_updates_fields_and_info(self):
+        self._import([['pOLD', 'AMD9', 'KanR', ' changed', None, 'pET']], True)
+        old_plasmid = Plasmid.objects.get(name='pOLD')
+        self.assertEqual((old_plasmid.amd_number, old_plasmid.description), ('AMD9', 'Old changed'))
+        self.assertEqual(self._info('pOLD'), {'Backbone': 'pET'})
+        self.assertEqual(Plasmid_info.objects.filter(plasmid=old_plasmid).count(), 1)
+        # Importing the same table again changes nothing
+        self._import([['pOLD', 'AMD9', 'KanR', ' changed', None, 'pET']], True)
+        old_plasmid = Plasmid.objects.get(name='pOLD')
+        self.assertEqual(old_plasmid.description, 'Old changed')
+        self.assertEqual(old_plasmid.drug_markers.count(), 1)
+
+
+class TextIndexSearchTests(TextIndexTestCase):
+    def setUp(self):
+        self.described = Plasmid.objects.create(name='pAMD100', description='Expresses GFP in yeast',
+                                                sequence='', footprint='')
+        self.named = Plasmid.objects.create(name='pGFP-1', description='Reporter', sequence='', footprint='')
+        self.short = Plasmid.objects.create(name='pU2', description='', sequence='', footprint='')
+        Oligo.objects.create(name='GFP_fw', sequence='ACGT', description='')
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(text_index.search('plasmid', 'gfp'), [self.named.id, self.described.id])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(text_index.search('plasmid', 'gfp yeast'), [self.described.id])
+        self.assertEqual(text_index.search('plasmid', 'gfp bacteria'), [])
+
+    def test_short_words_are_left_out_of_match(self):
+        self.assertEqual(text_index.search('plasmid', 'gfp in'), [self.named.id, self.described.id])
+
+    def test_short_word_query_scans_table(self):
+        self.assertEqual(text_index.search('plasmid', 'U2'), [self.short.id])
+        self.assertEqual(text_index.search('plasmid', '%'), [])
+        self.assertEqual(text_index.search('plasmid', '  '), [])
+
+    def test_rename_and_delete(self):
+        self.named.name = 'pRFP-1'
+        self.named.save()
+        self.assertEqual(text_index.search('plasmid', 'gfp'), [self.described.id])
+        text_index.delete(Plasmid, [self.described.id])
+        self.assertEqual(text_index.search('plasmid', 'gfp'), [])
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM ' + TEXT_INDEX_TABLE)
+        counts = text_index.rebuild()
+        self.assertEqual(counts['plasmid'], 3)
+        self.assertEqual(counts['oligo'], 1)
+        self.assertEqual(text_index.search('plasmid', 'gfp'), [self.named.id, self.described.id])
+
+
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        self.cache_enabled = search_cache.SEARCH_CACHE_ENABLED
+        search_cache.SEARCH_CACHE_ENABLED = True
+
+    def tearDown(self):
+        search_cache.SEARCH_CACHE_ENABLED = self.cache_enabled
+
+    def test_entry_keeps_version_of_the_key(self):
+        params = {'evalue': '10', 'hitstoshow': '50'}
+        key = search_cache.make_key('blastn', 'acgt', params, 'v1')
+        self.assertEqual(key, search_cache.make_key('blastn', 'ACGT', params, 'v1'))
+        self.assertNotEqual(key, search_cache.make_key('blastn', 'ACGT', params, 'v2'))
+        search_cache.put(key, 'blastn', ['hit'], '', 4, 'v1')
+        self.assertEqual(Search_cache.objects.get(key=key).db_version, 'v1')
+        self.assertEqual(search_cache.get(key), (['hit'], '', 4))
+        # Entries of other versions are evicted by the next write
+        search_cache.put(search_cache.make_key('blastn', 'ACGT', params, 'v2'), 'blastn', [], '', 4, 'v2')
+        self.assertFalse(Search_cache.objects.filter(key=key).exists())
+
+
+class LocalAlignmentBackendTests(TextIndexTestCase):
+    PARAMS = {'evalue': '0.001', 'hitstoshow': '10'}
+
+    def setUp(self):
+        self.backend = search_backends.LocalAlignmentBackend()
+        self.plasmid = Plasmid.objects.create(name='pFWD', amd_number='AMD1', footprint='',
+                                              sequence=PLASMID_SEQUENCE[:50] + CODING_SEQUENCE + PLASMID_SEQUENCE[50:])
+        self.reverse_plasmid = Plasmid.objects.create(name='pREV', footprint='',
+                                                      sequence=_reverse_complement(self.plasmid.sequence))
+        feature = Feature.objects.create(name='gene', plasmid=self.plasmid, sequence_id='pFWD', start=50,
+                                         end=50 + len(CODING_SEQUENCE), strand=1, location_str='51..149')
+        self.protein = Protein.objects.create(name='Gene', sequence=PROTEIN_SEQUENCE, feature=feature)
+
+    def _rows(self, tool, query, **kwargs):
+        return {row.split('\t')[1].split('|')[1]: row.split('\t')
+                for row in self.backend.search(tool, [('query', query)], self.PARAMS, **kwargs)}
+
+    def test_blastn(self):
+        coding_end = 50 + len(CODING_SEQUENCE)
+        rows = self._rows('blastn', CODING_SEQUENCE, with_qlen=True)
+        self.assertEqual(set(rows), {'pFWD', 'pREV'})
+        self.assertEqual(rows['pFWD'][1], '{}|pFWD|plasmid|AMD1'.format(self.plasmid.id))
+        self.assertEqual(rows['pFWD'][2:4], ['100.000', str(len(CODING_SEQUENCE))])
+        self.assertEqual(rows['pFWD'][6:10], ['1', str(len(CODING_SEQUENCE)), '51', str(coding_end)])
+        self.assertEqual(rows['pFWD'][12], str(len(CODING_SEQUENCE)))
+        reverse_start = len(self.plasmid.sequence) - coding_end + 1
+        self.assertEqual(rows['pREV'][8:10], [str(reverse_start + len(CODING_SEQUENCE) - 1), str(reverse_start)])
+        self.assertEqual(parse_hits(['\t'.join(rows['pREV'])])[0]['hit_coord'],
+                         'complement({}..{})'.format(reverse_start, reverse_start + len(CODING_SEQUENCE) - 1))
+
+    def test_blastp(self):
+        rows = self._rows('blastp', PROTEIN_SEQUENCE[5:])
+        self.assertEqual(list(rows), ['Gene'])
+        self.assertEqual(rows['Gene'][1], '{}|Gene|pFWD|51..149'.format(self.protein.id))
+        self.assertEqual(rows['Gene'][2], '100.000')
+        self.assertEqual(rows['Gene'][6:10], ['1', str(len(PROTEIN_SEQUENCE) - 5), '6', str(len(PROTEIN_SEQUENCE))])
+        self.assertEqual(len(rows['Gene']), 12)
+
+    def test_tblastn(self):
+        coding_end = 50 + len(CODING_SEQUENCE)
+        rows = self._rows('tblastn', PROTEIN_SEQUENCE)
+        self.assertEqual(set(rows), {'pFWD', 'pREV'})
+        self.assertEqual(rows['pFWD'][2], '100.000')
+        self.assertEqual(rows['pFWD'][6:10], ['1', str(len(PROTEIN_SEQUENCE)), '51', str(coding_end)])
+        reverse_start = len(self.plasmid.sequence) - coding_end + 1
+        self.assertEqual(rows['pREV'][8:10], [str(reverse_start + len(CODING_SEQUENCE) - 1), str(reverse_start)])
+        hits = parse_hits(['\t'.join(rows['pFWD']), '\t'.join(rows['pREV'])], len(PROTEIN_SEQUENCE))
+        self.assertEqual([hit['hit_coord'] for hit in hits],
+                         ['51..{}'.format(coding_end),
+                          'complement({}..{})'.format(reverse_start, reverse_start + len(CODING_SEQUENCE) - 1)])
+
+    def test_collection_size_is_summed_once_per_version(self):
+        versions = ['v1']
+        get_version = search_backends.get_blast_db_version
+        search_backends.get_blast_db_version = lambda: versions[0]
+        try:
+            size = len(self.plasmid.sequence) * 2
+            self.assertEqual(search_backends._collection_size('blastn'), size)
+            Oligo.objects.create(name='oligo', sequence='ACGTACGT', description='')
+            with self.assertNumQueries(0):
+                self.assertEqual(search_backends._collection_size('tblastn'), size)
+            self.assertEqual(search_backends._collection_size('blastp'), len(PROTEIN_SEQUENCE))
+            versions[0] = 'v2'
+            self.assertEqual(search_backends._collection_size('blastn'), size + 8)
+            self.assertNotIn(('v1', 'protein'), search_backends._collection_sizes)
+        finally:
+            search_backends.get_blast_db_version = get_version
+
+
+class OligoBindingTests(SimpleTestCase):
+    def setUp(self):
+        generator = random.Random(1)
+        self.plasmid_sequence = PLASMID_SEQUENCE[:90] + 'N' + PLASMID_SEQUENCE[91:]
+        self.oligo_regions = {
+            1: PLASMID_SEQUENCE[20:40],
+            # Across the origin
+            2: PLASMID_SEQUENCE[-8:] + PLASMID_SEQUENCE[:12],
+            # Reverse strand with a mismatch
+            3: _reverse_complement(PLASMID_SEQUENCE[100:115] + 'A' + PLASMID_SEQUENCE[116:120]),
+            # Across the ambiguous base
+            4: PLASMID_SEQUENCE[80:100],
+        }
+        for oligo_id in range(5, 45):
+            self.oligo_regions[oligo_id] = ''.join(generator.choice('ACGT') for _ in range(20))
+
+    def _sites(self, oligo_ids):
+        seeds = oligo_binding.make_seeds({oligo_id: self.oligo_regions[oligo_id] for oligo_id in oligo_ids})
+        return oligo_binding.find_binding_sites(self.plasmid_sequence, seeds)
+
+    def test_sites_found_with_few_and_many_seeds(self):
+        length = len(PLASMID_SEQUENCE)
+        few_seeds = self._sites([1, 2, 3, 4])
+        self.assertEqual(few_seeds, [(1, 20, 40, 1, 0), (3, 100, 120, -1, 1), (2, length - 8, 12, 1, 0)])
+        many_seeds = self._sites(self.oligo_regions)
+        self.assertGreater(2 * len(self.oligo_regions), oligo_binding.MAX_FIND_SEEDS)
+        self.assertEqual([site for site in many_seeds if site[0] <= 4], few_seeds)
+        seeds = oligo_binding.make_seeds(self.oligo_regions)
+        self.assertIsNotNone(oligo_binding.seed_codes(seeds))
+        # Dictionary scan used for seeds too long for the k-mer table
+        with mock.patch.object(oligo_binding, 'MAX_CODE_LENGTH', 0):
+            self.assertIsNone(oligo_binding.seed_codes(seeds))
+            self.assertEqual(oligo_binding.find_binding_sites(self.plasmid_sequence, seeds), many_seeds)
+
+    def test_kmer_codes(self):
+        k = oligo_binding.OLIGO_BINDING_EXACT_3PRIME
+        codes, valid = oligo_binding._kmer_codes(self.plasmid_sequence)
+        self.assertEqual(len(codes), len(self.plasmid_sequence) - k + 1)
+        self.assertEqual(codes[0], oligo_binding._kmer_codes(self.plasmid_sequence[:k])[0][0])
+        self.assertEqual(oligo_binding._kmer_codes('A' * (k - 1) + 'C')[0].tolist(), [1])
+        self.assertEqual(list(valid[90 - k + 1:91]), [False] * k)
+        self.assertEqual(valid.sum(), len(codes) - k)
+        self.assertEqual(len(oligo_binding._kmer_codes('ACG')[0]), 0)
+
+
+@mock.patch.object(search_jobs, 'SEARCH_JOB_WORKERS', 2)
+class SearchJobQueueTests(TestCase):
+    def _job(self, **kwargs):
+        return Search_job.objects.create(search_type='nucleotide', params='{}', **kwargs)
+
+    def test_oldest_queued_job_is_claimed(self):
+        first = self._job()
+        second = self._job()
+        job = search_jobs.claim_next_job()
+        self.assertEqual(job.id, first.id)
+        self.assertEqual(job.status, search_jobs.JOB_RUNNING)
+        self.assertIsNotNone(job.started)
+        self.assertIsNotNone(job.heartbeat)
+        self.assertEqual(search_jobs.claim_next_job().id, second.id)
+        self.assertIsNone(search_jobs.claim_next_job())
+
+    def test_no_job_claimed_when_workers_are_busy(self):
+        now = timezone.now()
+        self._job(status=search_jobs.JOB_RUNNING, started=now, heartbeat=now)
+        self._job(status=search_jobs.JOB_RUNNING, started=now, heartbeat=now)
+        queued = self._job()
+        self.assertIsNone(search_jobs.claim_next_job())
+        self.assertEqual(Search_job.objects.get(id=queued.id).status, search_jobs.JOB_QUEUED)
+
+    def test_stale_jobs_are_queued_again(self):
+        now = timezone.now()
+        stale_time = now - timedelta(seconds=search_jobs.SEARCH_JOB_HEARTBEAT_TIMEOUT + 1)
+        stale = self._job(status=search_jobs.JOB_RUNNING, started=stale_time, heartbeat=stale_time)
+        alive = self._job(status=search_jobs.JOB_RUNNING, started=now, heartbeat=now)
+        self._job(status=search_jobs.JOB_DONE, heartbeat=stale_time)
+        self.assertEqual(search_jobs.requeue_stale_jobs(), 1)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.started, stale.heartbeat), (search_jobs.JOB_QUEUED, None, None))
+        self.assertEqual(Search_job.objects.get(id=alive.id).status, search_jobs.JOB_RUNNING)
+        # The requeued job is claimed again by the free worker
+        self.assertEqual(search_jobs.claim_next_job().id, stale.id)
+
+
+class PaginationTests(TextIndexTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        # Names in reverse order of IDs, AMD numbers with ties
+        self.plasmids = [Plasmid.objects.create(name='p{:02d}'.format(10 - i), amd_number='AMD' + str(i // 3),
+                                                sequence='', footprint='') for i in range(10)]
+
+    def _page(self, key, **params):
+        return keyset_page(self.factory.get('/', params), Plasmid.objects.all(), key)
+
+    def _names(self, page):
+        return [plasmid.name for plasmid in page]
+
+    def test_keyset_pages_by_unique_key(self):
+        first = self._page('name', size=4)
+        self.assertEqual(self._names(first), ['p01', 'p02', 'p03', 'p04'])
+        self.assertEqual((first.count, first.has_previous, first.has_next), (10, False, True))
+        second = self._page('name', size=4, after=first.next_cursor)
+        self.assertEqual(self._names(second), ['p05', 'p06', 'p07', 'p08'])
+        self.assertTrue(second.has_previous and second.has_next)
+        previous = self._page('name', size=4, before=second.previous_cursor)
+        self.assertEqual(self._names(previous), self._names(first))
+        self.assertEqual((previous.has_previous, previous.has_next), (False, True))
+        last = self._page('name', size=4, last=1)
+        self.assertEqual(self._names(last), ['p07', 'p08', 'p09', 'p10'])
+        self.assertEqual((last.has_previous, last.has_next), (True, False))
+
+    def test_keyset_pages_by_key_with_ties(self):
+        rows = []
+        page = self._page('amd_number', size=4)
+        while True:
+            rows += [plasmid.id for plasmid in page]
+            if not page.has_next:
+                break
+            page = self._page('amd_number', size=4, after=page.next_cursor)
+        expected = [plasmid.id for plasmid in sorted(self.plasmids, key=lambda x: (x.amd_number, x.id))]
+        self.assertEqual(rows, expected)
+        page = self._page('amd_number', size=4, before=expected[4])
+        self.assertEqual([plasmid.id for plasmid in page], expected[:4])
+
+    def test_deleted_cursor_row_starts_from_the_beginning(self):
+        cursor = self.plasmids[5].id
+        Plasmid.objects.filter(id=cursor).delete()
+        page = self._page('name', size=3, after=cursor)
+        self.assertEqual(self._names(page), ['p01', 'p02', 'p03'])
+        self.assertFalse(page.has_previous)
+        self.assertEqual(self._names(self._page('name', size=3, after='x')), ['p01', 'p02', 'p03'])
+
+    def test_ranked_pages(self):
+        ids = [plasmid.id for plasmid in reversed(self.plasmids)]
+        missing_id = max(ids) + 100
+        ids.insert(3, missing_id)
+
+        def page(**params):
+            return [plasmid.id for plasmid in ranked_page(self.factory.get('/', dict(size=4, **params)),
+                                                          Plasmid.objects.all(), ids)]
+
+        first = ranked_page(self.factory.get('/', {'size': 4}), Plasmid.objects.all(), ids)
+        # IDs missing from the queryset are skipped, the rank order is kept
+        self.assertEqual([plasmid.id for plasmid in first], ids[:3])
+        self.assertEqual((first.count, first.has_previous, first.has_next), (11, False, True))
+        self.assertEqual(page(after=first.next_cursor), ids[4:7])
+        self.assertEqual(page(before=ids[7]), ids[4:7])
+        self.assertEqual(page(last=1), ids[7:])
+        last = ranked_page(self.factory.get('/', {'size': 4, 'last': 1}), Plasmid.objects.all(), ids)
+        self.assertEqual((last.has_previous, last.has_next), (True, False))
+        self.assertEqual(page(after=missing_id - 1), ids[:3])
@@ -0,0 +1,153 @@
+"""
+    Full-text index for the text search.
+
+    Searchable text of plasmids, Magic Pool parts, vectors, Magic Pools,
+    strains, oligos and features (including functions of their proteins)
+    is stored in the magicpool_text_index SQLite FTS5 table, one row per
+    object. The table uses the trigram tokenizer, so query words match
+    any part of the indexed words, e.g. "gfp" finds pGFP-1. Every row has
+    a name column (names and AMD numbers), which weighs more in ranking,
+    and a content column (descriptions and other text). Row ID is
+    object ID * ENTITY_CODES + entity code, so rows of an object can be
+    replaced without scanning the table.
+
+    Objects saved one by one are indexed by the signal receivers in
+    magicpool.signals. Import functions writing with bulk_create and
+    bulk_update call update() for the written objects, and code deleting
+    objects calls delete() with their IDs. Migration 0019 creates an empty
+    table, so after migrating an existing database run
+
+        python manage.py rebuild_text_index
+
+    to index the existing objects. rebuild() indexes everything again.
+"""
+from collections import defaultdict
+from django.db import connection, transaction
+from magicpool.models import Plasmid, Magic_pool_part_type, Vector_type, Magic_pool, Strain, Oligo
+from magicpool.models import Feature, Protein
+
+TABLE = 'magicpool_text_index'
+# Row ID multiplier, greater than any entity code
+ENTITY_CODES = 8
+# Entity code, model, fields of the name column, fields of the content column
+ENTITIES = {
+    'plasmid': (1, Plasmid, ('name', 'amd_number'), ('magic_pool_designation', 'description')),
+    'part': (2, Magic_pool_part_type, ('name',), ('description',)),
+    'vector': (3, Vector_type, ('name',), ('description',)),
+    'magicpool': (4, Magic_pool, ('name',), ('description', 'antibiotic_resistance')),
+    'strain': (5, Strain, ('amd_number', 'name'), ('species', 'description')),
+    'oligo': (6, Oligo, ('name',), ('description', 'contact__name')),
+    'feature': (7, Feature, ('name',), ('description', 'plasmid__name')),
+}
+MODEL_ENTITIES = {model: entity for entity, (_, model, _, _) in ENTITIES.items()}
+# Max. number of IDs in a single "IN (...)" query
+CHUNK_SIZE = 500
+# Shortest query word found with the index, the trigram length
+MIN_WORD_LENGTH = 3
+
+
+def _join(values):
+    return ' '.join(str(value) for value in values if value)
+
+
+def _documents(entity, ids):
+    '''
+        Returns list of (row ID, name, content) for objects with given IDs
+    '''
+    code, model, name_fields, content_fields = ENTITIES[entity]
+    rows = model.objects.filter(id__in=ids).values_list('id', *name_fields, *content_fields)
+    functions = defaultdict(list)
+    if entity == 'feature':
+        for feature_id, function in Protein.objects.filter(feature_id__in=ids).exclude(
+            function=''
+        ).values_list('feature_id', 'function'):
+            functions[feature_id].append(function)
+    name_end = 1 + len(name_fields)
+    return [(row[0] * ENTITY_CODES + code, _join(row[1:name_end]), _join(row[name_end:] + tuple(functions[row[0]])))
+            for row in rows]
+
+
+def _delete_rows(cursor, row_ids):
+    if row_ids:
+        cursor.execute('DELETE FROM ' + TABLE + ' WHERE rowid IN (' + ','.join(['%s'] * len(row_ids)) + ')', row_ids)
+
+
+def _insert_rows(cursor, documents):
+    cursor.executemany('INSERT INTO ' + TABLE + ' (rowid, name, content) VALUES (%s, %s, %s)', documents)
+
+
+def update(model, ids):
+    '''
+        Replaces index rows of objects with given IDs.
+        Rows of objects that do not exist anymore are deleted.
+    '''
+    entity = MODEL_ENTITIES[model]
+    code = ENTITIES[entity][0]
+    ids = list(ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[i:i + CHUNK_SIZE]
+            _delete_rows(cursor, [object_id * ENTITY_CODES + code for object_id in chunk])
+            _insert_rows(cursor, _documents(entity, chunk))
+
+
+def delete(model, ids):
+    '''
+        Deletes index rows of objects with given IDs
+    '''
+    code = ENTITIES[MODEL_ENTITIES[model]][0]
+    ids = list(ids)
+    with connection.cursor() as cursor:
+        for i in range(0, len(ids), CHUNK_SIZE):
+            _delete_rows(cursor, [object_id * ENTITY_CODES + code for object_id in ids[i:i + CHUNK_SIZE]])
+
+
+def rebuild():
+    '''
+        Indexes all objects from scratch and returns dictionary
+        with number of index rows by entity
+    '''
+    result = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM ' + TABLE)
+        for entity, (_, model, _, _) in ENTITIES.items():
+            ids = list(model.objects.values_list('id', flat=True).order_by('id'))
+            result[entity] = 0
+            for i in range(0, len(ids), CHUNK_SIZE):
+                documents = _documents(entity, ids[i:i + CHUNK_SIZE])
+                _insert_rows(cursor, documents)
+                result[entity] += len(documents)
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO ' + TABLE + ' (' + TABLE + ") VALUES ('optimize')")
+    return result
+
+
+def fts_query(query):
+    '''
+        Returns FTS5 query matching rows containing all words of the query.
+        Words shorter than MIN_WORD_LENGTH are left out, because
+        the trigram index cannot find them.
+    '''
+    return ' AND '.join('"' + word.replace('"', '""') + '"' for word in query.split()
+                        if len(word) >= MIN_WORD_LENGTH)
+
+
+def search(entity, query):
+    '''
+        Returns list of IDs of objects matching the query,
+        best matches first
+    '''
+    code = ENTITIES[entity][0]
+    match = fts_query(query)
+    with connection.cursor() as cursor:
+        if match != '':
+            cursor.execute('SELECT rowid FROM ' + TABLE + ' WHERE ' + TABLE + ' MATCH %s AND rowid %% ' +
+                           str(ENTITY_CODES) + ' = %s ORDER BY rank, rowid', [match, code])
+        elif query.strip() != '':
+            # Short words only. Scan the index table.
+            pattern = '%' + query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            cursor.execute('SELECT rowid FROM ' + TABLE + " WHERE (name LIKE %s ESCAPE '\\' OR content LIKE %s ESCAPE '\\')"
+                           ' AND rowid %% ' + str(ENTITY_CODES) + ' = %s ORDER BY rowid', [pattern, pattern, code])
+        else:
+            return []
+        return [row_id // ENTITY_CODES for row_id, in cursor.fetchall()]
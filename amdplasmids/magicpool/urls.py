@@ -22,6 +22,10 @@ urlpatterns = [
     path('nuclsearch/',views.nucleotidesearch,name="nucleotidesearch"),
     path('protsearchform/',views.proteinsearchform,name="proteinsearchform"),
     path('protsearch/',views.proteinsearch,name="proteinsearch"),
+    path('batchsearchform/',views.batchsearchform,name="batchsearchform"),
+    path('batchsearch/',views.batchsearch,name="batchsearch"),
+    path('searchjob/<uuid:job_id>/',views.search_job,name="searchjob"),
+    path('searchjob/<uuid:job_id>/tsv/',views.search_job_tsv,name="searchjobtsv"),
     path('export/',views.export,name="export"),
     path('about/', views.show_help, name='about'),
     path('textsearch/', views.textsearch, name='textsearch'),
@@ -7,73 +7,47 @@ import gzip
 import openpyxl
 import hashlib
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, deque
 from Bio import SeqIO
 from Bio import GenBank
 from subprocess import Popen, PIPE, CalledProcessError
 from magicpool.models import *
-from amdplasmids.settings import DATA_DIR
+from magicpool.blast_db import update_blast_databases
+from magicpool.oligo_binding import update_oligo_binding_sites
+from magicpool import search_cache, text_index
+from magicpool.plasmid_parser import plasmid_file_kind, plasmid_name, parse_plasmid_file, payload_records
+from magicpool.plasmid_parser import file_checksum
+from magicpool.file_manifest import FileManifest, SKIP, STATUS_ERROR, import_status
+from magicpool.feature_import import FeatureTypeCache, feature_type_name, feature_name, feature_description
+from magicpool.feature_import import make_protein, import_features
+from magicpool.feature_library import annotate_records
+from magicpool.reconcile import Reconciliation
+from magicpool.table_import import BATCH_SIZE, InfoRows, SheetStats, read_sheets, row_values
+from magicpool.instrumentation import RunLog, stage, count
+from magicpool.plannotate import application as annotate_plasmids, plasmids_to_annotate
+from magicpool.plannotate_cache import sequence_hash
+from django.db import transaction
+from concurrent.futures import ProcessPoolExecutor
+from amdplasmids.settings import DATA_DIR, IMPORT_WORKERS, PLANNOTATE_AFTER_UPDATE
+
+# Plasmid fields loaded and updated by import_plasmids_table
+PLASMID_TABLE_FIELDS = ('id', 'name', 'amd_number', 'description', 'magic_pool_part', 'magic_pool_designation')
+# Spreadsheet columns stored in Strain and Oligo fields
+STRAIN_TABLE_FIELDS = {'Strain': 'name', 'Plasmid': 'plasmid', 'Description': 'description', 'Species': 'species'}
+OLIGO_TABLE_FIELDS = {'Sequence': 'sequence', 'Purpose': 'description'}
+# Plasmid map files parsed ahead of the import per worker process
+PARSE_WINDOW = 2
 
 def autovivify(levels=1, final=dict):
     return (defaultdict(final) if levels < 2 else
             defaultdict(lambda: autovivify(levels - 1, final)))
 
 def guess_feature_type(name, type_label):
-    feature_type_dict = {item.name:item for item in Feature_type.objects.all()}
-    if type_label=='misc_feature':
-        if name.endswith('romoter'):
-            if 'promoter' in feature_type_dict:
-                return feature_type_dict['promoter']
-            else:
-                return Feature_type.objects.create(name='promoter')
-        elif 'origin of replication' in name:
-            if 'rep_origin' in feature_type_dict:
-                return feature_type_dict['rep_origin']
-            else:
-                return Feature_type.objects.create(name='rep_origin')
-        elif name.startswith('Ori'):
-            if 'rep_origin' in feature_type_dict:
-                return feature_type_dict['rep_origin']
-            else:
-                return Feature_type.objects.create(name='rep_origin')
-        elif name == 'ColE1':
-            if 'rep_origin' in feature_type_dict:
-                return feature_type_dict['rep_origin']
-            else:
-                return Feature_type.objects.create(name='rep_origin')
-        elif 'BsmBI' in name:
-            if 'restriction_site' in feature_type_dict:
-                return feature_type_dict['restriction_site']
-            else:
-                return Feature_type.objects.create(name='restriction_site')
-        elif 'inverted repeat' in name:
-            if 'IR' in feature_type_dict:
-                return feature_type_dict['IR']
-            else:
-                return Feature_type.objects.create(name='IR')
-        elif 'transposase enzyme' in name:
-            if 'gene' in feature_type_dict:
-                return feature_type_dict['gene']
-            else:
-                return Feature_type.objects.create(name='gene')
-        else:
-            if 'misc_feature' in feature_type_dict:
-                return feature_type_dict['misc_feature']
-            else:
-                return Feature_type.objects.create(name='misc_feature')
-    elif type_label in feature_type_dict:
-        return feature_type_dict[type_label]
-    elif type_label == 'CDS':
-            if 'CDS' in feature_type_dict:
-                return feature_type_dict['CDS']
-            else:
-                return Feature_type.objects.create(name='CDS')
-    else:
-        return Feature_type.objects.create(name=type_label)
+    return FeatureTypeCache().get(feature_type_name(name, type_label))
 
 def create_feature(feature, plasmid_obj):
-    feature_type_label = feature.type
-
+    # Creates one feature with its protein. Plasmid import uses
+    # import_features, which creates the same rows in bulk.
     feature_start = int(feature.location.start)
     feature_end = int(feature.location.end)
     feature_strand = int(feature.location.strand)
@@ -85,92 +59,44 @@ def create_feature(feature, plasmid_obj):
         # Feature exists. Skip it.
         return 0
 
-    if feature_type_label == 'source':
+    if feature.type == 'source':
         return 0
-    feature_name = ''
-    if 'locus_tag' in feature.qualifiers:
-        feature_name = str(feature.qualifiers['locus_tag'][0])
-    elif 'label' in feature.qualifiers:
-        feature_name = str(feature.qualifiers['label'][0])
-    elif 'name' in feature.qualifiers:
-        feature_name = str(feature.qualifiers['name'][0])
-    if feature_name == '':
+    feature_name_str = feature_name(feature)
+    if feature_name_str == '':
         print('This feature has no name:')
         print(str(feature))
         return 0
-    feature_name = feature_name.replace('\n','')
-    description = ''
-    if 'gene' in feature.qualifiers:
-        description += str(';' .join(feature.qualifiers['gene']))
-    if 'label' in feature.qualifiers:
-        if description != '':
-            description += '; '
-        description += str(';' .join(feature.qualifiers['label']))
-    if 'note' in feature.qualifiers:
-        if description != '':
-            description += '; '
-        description += str(feature.qualifiers['note'][0])
-    description = description.replace('\n','')
-    feature_type = guess_feature_type(feature_name, feature_type_label)
+    feature_type = guess_feature_type(feature_name_str, feature.type)
     feature_obj = Feature.objects.create(
-        name = feature_name,
+        name = feature_name_str,
         plasmid = plasmid_obj,
         feature_type = feature_type,
-        sequence = plasmid_obj.sequence[feature_start:feature_end],
         sequence_id = plasmid_obj.name,
         start = feature_start,
         end = feature_end,
         strand = feature_strand,
         location_str = str(feature.location),
-        description = description
+        description = feature_description(feature)
         )
     if feature_type.name == 'gene' or 'translation' in feature.qualifiers:
-        if 'gene' in feature.qualifiers:
-            protein_name = str(feature.qualifiers['gene'][0])
-        elif 'label' in feature.qualifiers:
-            protein_name = str(feature.qualifiers['label'][0])
-        elif 'locus_tag' in feature.qualifiers:
-            protein_name = str(feature.qualifiers['locus_tag'][0])
-        else:
-            protein_name = 'unknown_protein'
-        protein_name = protein_name.replace('\n','')
-        protein_name = protein_name.replace('&nbsp;',' ')
-        if 'product' in feature.qualifiers:
-            protein_function = str(feature.qualifiers['product'][0])
-        elif 'note' in feature.qualifiers:
-            protein_function = str(feature.qualifiers['note'][0])
-        elif 'label' in feature.qualifiers:
-            protein_function = str(feature.qualifiers['label'][0])
-        else:
-            protein_function = 'unidentified function'
-
-        if 'translation' in feature.qualifiers:
-            protein_sequence = ''.join(feature.qualifiers['translation'])
-        else:
-            protein_sequence = ''
-            
-        protein_obj = Protein.objects.create(
-            name = protein_name,
-            sequence = protein_sequence,
-            function = protein_function,
-            feature = feature_obj
-        )
+        make_protein(feature, feature_obj).save()
     return 1    
 
     
 def update_plasmid(plasmid, seq_record, sequence_file, checksum):
     # Replace sequence, wipe out old features and create new features
     ret_val = 0
-    feature_count = 0
-    plasmid.sequence = str(seq_record.seq)
-    plasmid.sequence_file = sequence_file
-    plasmid.footprint = checksum
-    plasmid.save()
-    Feature.objects.filter(plasmid=plasmid.id).delete()
-    Protein.objects.filter(feature=None).delete()
-    
-    for feature in seq_record.features:
-        feature_count += create_feature(feature, plasmid)
+    with transaction.atomic():
+        plasmid.sequence = str(seq_record.seq)
+        plasmid.sequence_hash = sequence_hash(plasmid.sequence)
+        plasmid.sequence_file = sequence_file
+        plasmid.footprint = checksum
+        plasmid.save()
+        feature_ids = list(Feature.objects.filter(plasmid=plasmid.id).values_list('id', flat=True))
+        Feature.objects.filter(plasmid=plasmid.id).delete()
+        text_index.delete(Feature, feature_ids)
+        Protein.objects.filter(feature=None).delete()
+        feature_count = import_features(seq_record.features, plasmid)
     print(plasmid.name, 'object updated')
     ret_val = 1
     return ret_val, feature_count
@@ -221,16 +147,17 @@ def import_seq_records(records, seq_name, sequence_file, checksum, overwrite_exi
                 ret_val = 0
         else:
             # Create new plasmid object and features
-            plasmid_obj = Plasmid.objects.create(
-                name = seq_name,
-                amd_number = '',
-                description = '',
-                sequence = str(seq_record.seq),
-                footprint = checksum,
-                sequence_file = sequence_file
-            )
-            for feature in seq_record.features:
-                feature_count += create_feature(feature, plasmid_obj)
+            with transaction.atomic():
+                plasmid_obj = Plasmid.objects.create(
+                    name = seq_name,
+                    amd_number = '',
+                    description = '',
+                    sequence = str(seq_record.seq),
+                    sequence_hash = sequence_hash(str(seq_record.seq)),
+                    footprint = checksum,
+                    sequence_file = sequence_file
+                )
+                feature_count = import_features(seq_record.features, plasmid_obj)
             print(seq_name, ' object created')
             ret_val = 1
     if record_count > 1:
@@ -238,10 +165,10 @@ def import_seq_records(records, seq_name, sequence_file, checksum, overwrite_exi
     print(feature_count, 'features created')
     return ret_val
 
-def import_plasmid_snapgene(dna_file, sequence_file, overwrite_existing):
+def import_plasmid_snapgene(dna_file, sequence_file, overwrite_existing, checksum=None):
     print('Working on Snapgene file', dna_file)
-    with open(dna_file, 'rb') as infile:
-        checksum = hashlib.md5(infile.read()).hexdigest()
+    if checksum is None:
+        checksum = file_checksum(dna_file)
     records = SeqIO.parse(dna_file, "snapgene")
     filename = dna_file.split('/')[-1]
     try:
@@ -251,11 +178,11 @@ def import_plasmid_snapgene(dna_file, sequence_file, overwrite_existing):
         ret_val = 0
     return ret_val
             
-def import_plasmid_fasta(fna_file, sequence_file, overwrite_existing):
+def import_plasmid_fasta(fna_file, sequence_file, overwrite_existing, checksum=None):
     print('Working on FASTA file', fna_file)
-    with open(fna_file, 'rb') as infile:
-        checksum = hashlib.md5(infile.read()).hexdigest()
-    records = SeqIO.parse(fna_file, "fasta")
+    if checksum is None:
+        checksum = file_checksum(fna_file)
+    records = annotate_records(SeqIO.parse(fna_file, "fasta"))
     filename = fna_file.split('/')[-1]
     try:
         ret_val = import_seq_records(records, '.'.join(filename.split('.')[:-1]), sequence_file, checksum, overwrite_existing)
@@ -264,15 +191,10 @@ def import_plasmid_fasta(fna_file, sequence_file, overwrite_existing):
         ret_val = 0
     return ret_val
             
-def import_plasmid_gbk(gbk_file, sequence_file, overwrite_existing):
+def import_plasmid_gbk(gbk_file, sequence_file, overwrite_existing, checksum=None):
     print('Working on GenBank file', gbk_file)
-    if gbk_file.endswith('.gz'):
-        gbk_handle = gzip.open(gbk_file, 'rb')
-    else:
-        gbk_handle = open(gbk_file, 'rb')
-    checksum = hashlib.md5(gbk_handle.read()).hexdigest()
-    gbk_handle.close()
-
+    if checksum is None:
+        checksum = file_checksum(gbk_file)
     if gbk_file.endswith('.gz'):
         gbk_handle = gzip.open(gbk_file, 'rt')
     else:
@@ -284,7 +206,64 @@ def import_plasmid_gbk(gbk_file, sequence_file, overwrite_existing):
     return ret_val
 
 
+def import_plasmid_payload(payload, overwrite_existing):
+    '''
+        Imports plasmid file parsed by parse_plasmid_file()
+    '''
+    print('Importing', payload['filepath'])
+    if payload['error'] is not None:
+        if payload['kind'] == 'genbank':
+            raise ValueError('GenBank file parsing error ' + payload['filepath'] + ': ' + payload['error'])
+        print(payload['kind'], 'file conversion error', payload['filepath'], payload['error'])
+        return 0
+    if not payload['record_count']:
+        print('No records found in', payload['filepath'])
+        return 0
+    if payload['record_count'] > 1:
+        print(payload['record_count'], 'records provided for import. Only the first record will be imported')
+    try:
+        return import_seq_records(payload_records(payload),
+                                  payload['seq_name'],
+                                  payload['sequence_file'],
+                                  payload['checksum'],
+                                  overwrite_existing
+                                  )
+    except:
+        if payload['kind'] == 'genbank':
+            raise
+        print(payload['kind'], 'file conversion error', payload['filepath'])
+        return 0
+
+
+def _import_payload(manifest, payload, overwrite_existing):
+    '''
+        Imports parsed plasmid file, records the result in the manifest
+        and returns number of plasmids created or updated.
+        Files that cannot be parsed get STATUS_ERROR.
+    '''
+    ret_val = import_plasmid_payload(payload, overwrite_existing)
+    if payload['error'] is not None:
+        status = STATUS_ERROR
+    else:
+        status = import_status(ret_val, overwrite_existing)
+    manifest.record(payload['filepath'], payload['sequence_file'], payload['checksum'], status)
+    return ret_val
+
+
 def update_alldata(overwrite=False):
+    '''
+        Downloads data files and updates the database and BLAST databases.
+        Timing and resource usage of every stage are appended to the report
+        and saved into a JSON run log.
+    '''
+    with RunLog('update_alldata') as run_log:
+        ret, subject = _update_alldata(overwrite)
+    ret += run_log.report()
+    ret.append('Run log: ' + run_log.path)
+    return ret, subject
+
+
+def _update_alldata(overwrite):
     ret = []
     subject = 'Plasmidoro: no new data'
     if not os.path.exists(DATA_DIR):
@@ -308,9 +287,10 @@ def update_alldata(overwrite=False):
         outfile.write('rclone copyto --config ./rclone.conf "gdriveR:Deutschbauer_Lab_Documents/Oligos_and_gBlocks/oAD_oligos_and_gAD_gBlocks.xlsx" --drive-shared-with-me ./oligos.xlsx\n')
     cmd = ['bash', os.path.join(DATA_DIR, 'data_download.sh')]
     print(' '.join(cmd))
-    with Popen(cmd, stdout=PIPE, bufsize=1, universal_newlines=True) as proc:
-        for line in proc.stdout:
-            print(line.rstrip('\n\r'))
+    with stage('download'):
+        with Popen(cmd, stdout=PIPE, bufsize=1, universal_newlines=True) as proc:
+            for line in proc.stdout:
+                print(line.rstrip('\n\r'))
     if proc.returncode != 0:
         # Suppress false positive no-member error
         # (see https://github.com/PyCQA/pylint/issues/1860)
@@ -319,7 +299,8 @@ def update_alldata(overwrite=False):
         subject = 'Plasmidoro: rclone error'
 
     # Import magic pool types and vector designs before importing plasmid files
-    report = import_magic_pool_types(os.path.join(plasmid_maps_dir, 'magicpool_vector_designs', 'magic_pool_design.xlsx'))
+    with stage('magic pool types'):
+        report = import_magic_pool_types(os.path.join(plasmid_maps_dir, 'magicpool_vector_designs', 'magic_pool_design.xlsx'))
     if not report.endswith(' 0'):
         subject = 'Plasmidoro: database updated'
     ret.append(report)
@@ -331,75 +312,66 @@ def update_alldata(overwrite=False):
         return ret, subject
     else:
         print("Plasmid data directory found: " + plasmid_maps_dir)
-    existing_plasmids_nomap = Plasmid.objects.filter(sequence_file='')
-    delete_objects = []
-    for plasmid in Plasmid.objects.exclude(sequence_file=''):
-        if not os.path.exists(os.path.join(plasmid_maps_dir, plasmid.sequence_file)):
-            print('File not found: ' + os.path.join(plasmid_maps_dir, plasmid.sequence_file))
-            print(plasmid.name + ' plasmid to be deleted')
-            delete_objects.append(plasmid)
-    if delete_objects:
-        for item in delete_objects:
-            item.delete()
-        ret.append('Plasmids without sequence files were deleted: ' + str(len(delete_objects)))
-        delete_objects = []
-
-    plasmids_nomap, report = import_plasmids(plasmid_maps_dir, overwrite)
-    if not report.endswith(' 0'):
-        subject = 'Plasmidoro: database updated'
-    ret.append(report)
-    for plasmid_obj in existing_plasmids_nomap:
-        if plasmid_obj.name not in plasmids_nomap:
-            print(plasmid.name + ' plasmid to be deleted')
-            delete_objects.append(plasmid)
-    if delete_objects:
-        for item in delete_objects:
-            item.delete()
-        ret.append('Plasmids without maps were deleted: ' + str(len(delete_objects)))
-        delete_objects = []
+    reconciliation = Reconciliation()
+    with stage('plasmid maps'):
+        report = reconciliation.plasmids_without_files(plasmid_maps_dir)
+        if report:
+            ret.append(report)
+
+        plasmids_nomap, report = import_plasmids(plasmid_maps_dir, overwrite)
+        if not report.endswith(' 0'):
+            subject = 'Plasmidoro: database updated'
+        ret.append(report)
+        report = reconciliation.plasmids_without_maps(plasmids_nomap)
+        if report:
+            ret.append(report)
     
-    report = import_magic_pools(os.path.join(plasmid_maps_dir, 'Magic_Pools', 'Magic_Pool_Summary_Sheet.xlsx'))
+    with stage('magic pools'):
+        report = import_magic_pools(os.path.join(plasmid_maps_dir, 'Magic_Pools', 'Magic_Pool_Summary_Sheet.xlsx'))
     if not report.endswith(' 0'):
         subject = 'Plasmidoro: database updated'
     ret.append(report)
     
-    existing_oligos = Oligo.objects.all()
-    new_oligo_names, report = import_oligos_table(oligos_file)
-    if not report.endswith(' 0'):
-        subject = 'Plasmidoro: database updated'
-    ret.append(report)
-    delete_objects = []
-    for oligo_obj in existing_oligos:
-        if oligo_obj.name not in new_oligo_names:
-            print(oligo_obj.name + ' oligo to be deleted')
-            delete_objects.append(oligo_obj)
-    if delete_objects:
-        for item in delete_objects:
-            item.delete()
-        ret.append('Oligos deleted: ' + str(len(delete_objects)))
-        delete_objects = []
+    with stage('oligos'):
+        new_oligo_names, report = import_oligos_table(oligos_file)
+        if not report.endswith(' 0'):
+            subject = 'Plasmidoro: database updated'
+        ret.append(report)
+        report = reconciliation.oligos(new_oligo_names)
+        if report:
+            ret.append(report)
     
-    existing_strains = Strain.objects.all()
-    new_strain_amd_numbers, report = import_strains_table(strains_file)
+    with stage('strains'):
+        new_strain_amd_numbers, report = import_strains_table(strains_file)
+        if not report.endswith(' 0'):
+            subject = 'Plasmidoro: database updated'
+        ret.append(report)
+        report = reconciliation.strains(new_strain_amd_numbers)
+        if report:
+            ret.append(report)
+    # Only plasmids and oligos with new sequences are searched
+    with stage('oligo binding sites'):
+        report = update_oligo_binding_sites()
     if not report.endswith(' 0'):
         subject = 'Plasmidoro: database updated'
     ret.append(report)
-    delete_objects = []
-    for strain_obj in existing_strains:
-        if strain_obj.amd_number not in new_strain_amd_numbers:
-            print(strain_obj.amd_number + ' strain to be deleted')
-            delete_objects.append(strain_obj)
-    if delete_objects:
-        for item in delete_objects:
-            item.delete()
-        ret.append('Strains deleted: ' + str(len(delete_objects)))
-    make_blast_databases()
+    ret.append(make_blast_databases())
+    if PLANNOTATE_AFTER_UPDATE:
+        with stage('pLannotate'):
+            report = annotate_plasmids(plasmids_to_annotate())
+        if not report.endswith(' 0'):
+            subject = 'Plasmidoro: database updated'
+        ret.append(report)
     return ret, subject
 
 
-def import_plasmids(work_dir, overwrite_existing):
+def import_plasmids(work_dir, overwrite_existing, workers=IMPORT_WORKERS):
+    if workers > 1:
+        return import_plasmids_parallel(work_dir, overwrite_existing, workers)
     obj_count = 0
     ret = []
+    table_reports = []
+    manifest = FileManifest()
     for root, subdirs, files in os.walk(work_dir):
         if 'Old_files' in root or 'Older_Files' in root:
             print('Skipping', root)
@@ -407,163 +379,216 @@ def import_plasmids(work_dir, overwrite_existing):
         print(files)
         for filename in sorted(files):
             filepath = os.path.join(root, filename)
-            if filename.endswith('.dna'):
-                obj_count += import_plasmid_snapgene(filepath, filepath.split(work_dir)[-1][1:], overwrite_existing)
-            elif filename.endswith('.gb') or filename.endswith('.ape'):
-                obj_count += import_plasmid_gbk(filepath, filepath.split(work_dir)[-1][1:], overwrite_existing)
-            elif filename.endswith('.xlsx'):
+            if filename.endswith('.xlsx'):
                 if filename.startswith('Old_'):
                     continue
-                ret = ret + import_plasmids_table(filepath, overwrite_existing)
-            elif filename.endswith('.fa') or filename.endswith('.fna'):
-                obj_count += import_plasmid_fasta(filepath, filepath.split(work_dir)[-1][1:], overwrite_existing)
-    report = 'Plasmids created and/or updated: ' + str(obj_count)
+                names, report = import_plasmids_table(filepath, overwrite_existing)
+                ret = ret + names
+                table_reports.append(report)
+                continue
+            kind = plasmid_file_kind(filename)
+            if kind is None:
+                continue
+            sequence_file = filepath.split(work_dir)[-1][1:]
+            action, checksum = manifest.check(filepath, sequence_file, plasmid_name(filename, kind), overwrite_existing)
+            if action == SKIP:
+                continue
+            obj_count += _import_payload(manifest,
+                                         parse_plasmid_file(filepath, sequence_file, kind, checksum),
+                                         overwrite_existing
+                                         )
+    manifest.save()
+    for name, value in manifest.counts.items():
+        count('files ' + name, value)
+    count('plasmids updated', obj_count)
+    report = '. '.join(table_reports + [manifest.report()]) + '. Plasmids created and/or updated: ' + str(obj_count)
+    return ret, report
+
+
+def import_plasmids_parallel(work_dir, overwrite_existing, workers):
+    '''
+        Same as import_plasmids, but plasmid map files are parsed
+        and checksummed by a pool of worker processes. Parsed files are
+        applied to the database in the main process in the order
+        import_plasmids would import them, so the file format preference
+        rules of import_seq_records give the same result.
+    '''
+    obj_count = 0
+    ret = []
+    table_reports = []
+    manifest = FileManifest()
+    # Changed plasmid map files and tables in import order
+    tasks = []
+    for root, subdirs, files in os.walk(work_dir):
+        if 'Old_files' in root or 'Older_Files' in root:
+            print('Skipping', root)
+            continue
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            kind = plasmid_file_kind(filename)
+            if kind is not None:
+                sequence_file = filepath.split(work_dir)[-1][1:]
+                action, checksum = manifest.check(filepath, sequence_file, plasmid_name(filename, kind), overwrite_existing)
+                if action != SKIP:
+                    tasks.append((kind, filepath, sequence_file, checksum))
+            elif filename.endswith('.xlsx') and not filename.startswith('Old_'):
+                tasks.append(('table', filepath, None, None))
+    map_files = [task for task in tasks if task[0] != 'table']
+    print(len(map_files), 'plasmid map files to parse with', workers, 'workers')
+    map_files = iter(map_files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Parsing runs ahead of the import by at most PARSE_WINDOW files per worker,
+        # so parsed payloads do not pile up in memory
+        window = deque()
+        for kind, filepath, sequence_file, checksum in tasks:
+            while len(window) < workers * PARSE_WINDOW:
+                task = next(map_files, None)
+                if task is None:
+                    break
+                window.append(executor.submit(parse_plasmid_file, task[1], task[2], task[0], task[3]))
+            if kind == 'table':
+                names, report = import_plasmids_table(filepath, overwrite_existing)
+                ret = ret + names
+                table_reports.append(report)
+                continue
+            obj_count += _import_payload(manifest, window.popleft().result(), overwrite_existing)
+    manifest.save()
+    for name, value in manifest.counts.items():
+        count('files ' + name, value)
+    count('plasmids updated', obj_count)
+    report = '. '.join(table_reports + [manifest.report()]) + '. Plasmids created and/or updated: ' + str(obj_count)
     return ret, report
 
     
-def create_plasmid(plasmid_name, plasmid_data):
-    amd_number = ''
-    description = ''
+def table_drug_marker(drug_markers, name):
+    '''
+        Returns drug marker by name from the dictionary of loaded markers,
+        creating the marker if it does not exist
+    '''
+    if name not in drug_markers:
+        drug_markers[name] = Drug_marker.objects.create(
+            name = name,
+            drug = name,
+            note = ''
+            )
+    return drug_markers[name]
+
+
+def table_part_type(part_types, name):
+    '''
+        Returns magic pool part type by name from the dictionary of loaded
+        part types, creating the part type if it does not exist
+    '''
+    if name not in part_types:
+        part_types[name] = Magic_pool_part_type.objects.create(
+            name = name,
+            description = '',
+            upstream_overhang = None,
+            downstream_overhang = None,
+        )
+    return part_types[name]
+
+
+def make_plasmid(plasmid_name, plasmid_data, part_types):
     sequence = ''
-    footprint = hashlib.md5(sequence.encode('utf-8')).hexdigest()
-    if 'AMD number' in plasmid_data:
-        amd_number = plasmid_data['AMD number']
-    if 'Description' in plasmid_data:
-        description = plasmid_data['Description']
-    plasmid_obj = Plasmid.objects.create(
+    plasmid = Plasmid(
         name = plasmid_name,
-        amd_number = amd_number,
-        description = description,
+        amd_number = plasmid_data.get('AMD number', ''),
+        description = plasmid_data.get('Description', ''),
+        magic_pool_designation = plasmid_data.get('Magic pool part number', ''),
         sequence = sequence,
-        footprint = footprint
+        sequence_hash = sequence_hash(sequence),
+        footprint = hashlib.md5(sequence.encode('utf-8')).hexdigest()
     )
-    if 'Magic pool part number' in plasmid_data:
-        plasmid_obj.magic_pool_designation = plasmid_data['Magic pool part number']
-        plasmid_obj.save()
-
     if 'Magic pool part type' in plasmid_data:
-        existing_parts = {item.name:item for item in Magic_pool_part_type.objects.all()}
-        part_name = plasmid_data['Magic pool part type']
-        if part_name in existing_parts:
-            plasmid_obj.magic_pool_part_type = existing_parts[part_name]
-            plasmid_obj.save()
-        else:
-            part_obj = Magic_pool_part_type.objects.create(
-                name = part_name,
-                description = '',
-                upstream_overhang = None,
-                downstream_overhang = None,
-            )
-            plasmid_obj.magic_pool_part = part_obj
-            plasmid_obj.save()
-        
-    if 'Drug marker' in plasmid_data:
-        for marker in plasmid_data['Drug marker'].split('; '):
-            try:
-                marker_obj = Drug_marker.objects.get(name=marker)
-            except Drug_marker.DoesNotExist:
-                marker_obj = Drug_marker.objects.create(
-                    name = marker,
-                    drug = marker,
-                    note = ''
-                    )
-            plasmid_obj.drug_markers.add(marker_obj)
-            plasmid_obj.save()
-    for key, value in plasmid_data.items():
-        if key in ('AMD number', 'Description', 'Drug marker', 'Magic pool part type', 'Magic pool part number'):
-            continue
-        plasmid_info_obj = Plasmid_info.objects.create(
-            plasmid = plasmid_obj,
-            param = key,
-            value = value
-        )
-    return 1
-    
+        plasmid.magic_pool_part = table_part_type(part_types, plasmid_data['Magic pool part type'])
+    return plasmid
+
+
 def import_plasmids_table(xlsx_path, overwrite_existing=False):
     print(xlsx_path)
     ret = []
-    xlsx_path = Path(xlsx_path)
-    wb_obj = openpyxl.load_workbook(xlsx_path, data_only=True)
-    sheet = wb_obj.active
-    xlsx_header = []
     data_imported = defaultdict(dict)
     created_count = 0
-    for i, row in enumerate(sheet.iter_rows(values_only=True)):
-        if i == 0:
-            xlsx_header = row[1:]
-        else:   
-            plasmid_name = row[0]
+    sheet_stats = SheetStats()
+    sheet_stats.start()
+    for title, xlsx_header, rows in read_sheets(xlsx_path, active_sheet_only=True):
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            plasmid_name = row[0] if row else None
             if plasmid_name == '' or plasmid_name is None:
                 continue
             ret.append(plasmid_name)
-            for j, cell in enumerate(row[1:]):
-                if cell != '' and cell != 'None' and cell is not None:
-                    data_imported[plasmid_name][xlsx_header[j]] = str(cell)
+            for key, value in row_values(xlsx_header, row):
+                data_imported[plasmid_name][key] = value
+        xlsx_header = xlsx_header[1:]
     if 'AMD number' not in xlsx_header:
+        sheet_stats.add(title, row_count)
         print(created_count, 'new plasmids created')
-        return ret
-    for plasmid_name, plasmid_data in data_imported.items():
-        if Plasmid.objects.filter(name=plasmid_name).exists():
-            plasmid = Plasmid.objects.get(name=plasmid_name)
+        return ret, 'Plasmids table ' + sheet_stats.report() + '. Plasmids created: ' + str(created_count)
+    plasmids = {item.name: item for item in Plasmid.objects.only(*PLASMID_TABLE_FIELDS)}
+    drug_markers = {item.name: item for item in Drug_marker.objects.all()}
+    part_types = {item.name: item for item in Magic_pool_part_type.objects.all()}
+    plasmid_markers = defaultdict(set)
+    marker_links = Plasmid.drug_markers.through
+    for plasmid_id, marker_name in marker_links.objects.values_list('plasmid_id', 'drug_marker__name'):
+        plasmid_markers[plasmid_id].add(marker_name)
+    plasmid_info = InfoRows(Plasmid_info, 'plasmid')
+    changed_plasmids = {}
+    new_links = []
+    new_plasmids = []
+    with transaction.atomic():
+        for plasmid_name, plasmid_data in data_imported.items():
+            if str(plasmid_name) not in plasmids:
+                new_plasmids.append((make_plasmid(str(plasmid_name), plasmid_data, part_types), plasmid_data))
+                continue
+            plasmid = plasmids[str(plasmid_name)]
             if not overwrite_existing:
                 continue
             for key,value in plasmid_data.items():
                 if key == 'AMD number':
                     if plasmid.amd_number != value:
                         plasmid.amd_number = value
-                        plasmid.save()
+                        changed_plasmids[plasmid.id] = plasmid
                 elif key == 'Drug marker':
-                    existing_markers = [item.name for item in plasmid.drug_markers.all()]
                     for marker in value.split('; '):
-                        if marker not in existing_markers:
-                            try:
-                                marker_obj = Drug_marker.objects.get(name=marker)
-                            except Drug_marker.DoesNotExist:
-                                marker_obj = Drug_marker.objects.create(
-                                    name = marker,
-                                    drug = marker,
-                                    note = ''
-                                    )
-                            plasmid.drug_markers.add(marker_obj)
-                            plasmid.save()
+                        if marker not in plasmid_markers[plasmid.id]:
+                            plasmid_markers[plasmid.id].add(marker)
+                            new_links.append(marker_links(plasmid_id=plasmid.id,
+                                                          drug_marker_id=table_drug_marker(drug_markers, marker).id))
                 elif key == 'Description':
                     if value not in plasmid.description:
                         plasmid.description += value
-                        plasmid.save()
+                        changed_plasmids[plasmid.id] = plasmid
                 elif key == 'Magic pool part type':
-                    existing_parts = {item.name:item for item in Magic_pool_part_type.objects.all()}
-                    if value in existing_parts:
-                        plasmid.magic_pool_part = existing_parts[value]
-                        plasmid.save()
-                    else:
-                        part_obj = Magic_pool_part_type.objects.create(
-                            name = value,
-                            description = '',
-                            upstream_overhang = None,
-                            downstream_overhang = None,
-                        )
-                        plasmid.magic_pool_part = part_obj
-                        plasmid.save()
+                    plasmid.magic_pool_part = table_part_type(part_types, value)
+                    changed_plasmids[plasmid.id] = plasmid
                 elif key == 'Magic pool part number':
                     if value != plasmid.magic_pool_designation:
                         plasmid.magic_pool_designation = value
-                        plasmid.save()
+                        changed_plasmids[plasmid.id] = plasmid
                 else:
-                    if Plasmid_info.objects.filter(plasmid=plasmid.id,param=key).exists():
-                        plasmid_info_obj = Plasmid_info.objects.get(plasmid=plasmid.id,param=key)
-                        if plasmid_info_obj.value != value:
-                            plasmid_info_obj.value = value
-                            plasmid_info_obj.save()
-                    else:
-                        Plasmid_info.objects.create(
-                            plasmid = plasmid,
-                            param = key,
-                            value = value
-                            )
-        else:
-            created_count += create_plasmid(plasmid_name, plasmid_data)
+                    plasmid_info.set(plasmid, key, value)
+        Plasmid.objects.bulk_create([plasmid for plasmid, _ in new_plasmids], batch_size=BATCH_SIZE)
+        for plasmid, plasmid_data in new_plasmids:
+            plasmids[plasmid.name] = plasmid
+            for key, value in plasmid_data.items():
+                if key == 'Drug marker':
+                    for marker in set(value.split('; ')):
+                        new_links.append(marker_links(plasmid_id=plasmid.id,
+                                                      drug_marker_id=table_drug_marker(drug_markers, marker).id))
+                elif key not in ('AMD number', 'Description', 'Magic pool part type', 'Magic pool part number'):
+                    plasmid_info.set(plasmid, key, value)
+        Plasmid.objects.bulk_update(list(changed_plasmids.values()), PLASMID_TABLE_FIELDS[2:], batch_size=BATCH_SIZE)
+        text_index.update(Plasmid, [plasmid.id for plasmid, _ in new_plasmids] + list(changed_plasmids))
+        marker_links.objects.bulk_create(new_links, batch_size=BATCH_SIZE)
+        plasmid_info.save()
+    created_count += len(new_plasmids)
+    sheet_stats.add(title, row_count)
     print(created_count, 'new plasmids created')
-    return ret
+    report = 'Plasmids table ' + sheet_stats.report() + '. Plasmids created: ' + str(created_count)
+    return ret, report
 
 def import_magic_pool_types(xlsx_path):
     xlsx_path = Path(xlsx_path)
@@ -785,262 +810,157 @@ def import_magic_pools(xlsx_path):
     print(created_count, 'new magic pools created')
     return 'New magic pools: ' + str(created_count)
 
-def create_strain(amd_number, strain_data):
-    species = ''
-    description = ''
-    plasmid = ''
-    name = ''
-    if 'Species' in strain_data:
-        species = strain_data['Species']
-    if 'Description' in strain_data:
-        description = strain_data['Description']
-    if 'Plasmid' in strain_data:
-        plasmid = strain_data['Plasmid']
-    if 'Strain' in strain_data:
-        name = strain_data['Strain']
-    strain_obj = Strain.objects.create(
-        name = name,
+def make_strain(amd_number, strain_data):
+    return Strain(
+        name = strain_data.get('Strain', ''),
         amd_number = amd_number,
-        description = description,
-        species = species,
-        plasmid = plasmid
+        description = strain_data.get('Description', ''),
+        species = strain_data.get('Species', ''),
+        plasmid = strain_data.get('Plasmid', '')
     )
-    for key, value in strain_data.items():
-        if key in ('Strain', 'Description', 'Species', 'Plasmid'):
-            continue
-        if key == '' or key is None:
-            continue
-        if value == '' or value is None:
-            continue
-        strain_info_obj = Strain_info.objects.create(
-            strain = strain_obj,
-            param = key,
-            value = value
-        )
-    return 1
 
 
 def import_strains_table(xlsx_path, overwrite_existing=False):
     print(xlsx_path)
     ret = []
-    xlsx_path = Path(xlsx_path)
-    wb_obj = openpyxl.load_workbook(xlsx_path, data_only=True)
     created_count = 0
-    for sheet in wb_obj.worksheets:
-        print('Working on ' + sheet.title)
-        xlsx_header = []
+    sheet_stats = SheetStats()
+    strains = {item.amd_number: item for item in Strain.objects.all()}
+    strain_info = InfoRows(Strain_info, 'strain')
+    for title, xlsx_header, rows in read_sheets(xlsx_path):
+        print('Working on ' + title)
+        sheet_stats.start()
         data_imported = defaultdict(dict)
-        for i, row in enumerate(sheet.iter_rows(values_only=True)):
-            if i == 0:
-                xlsx_header = row
-            else:
-                amd_number = str(row[0])
-                if amd_number is None or not amd_number.startswith('AMD'):
-                    continue
-                ret.append(amd_number)
-                for j, cell in enumerate(row):
-                    if j == 0:
-                        continue
-                    if cell != '' and cell != 'None' and cell is not None:
-                        data_imported[amd_number][xlsx_header[j]] = str(cell)
-        if str(xlsx_header[0]) != 'Strain':
-            print('Skipping ' + sheet.title)
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            amd_number = str(row[0]) if row else ''
+            if not amd_number.startswith('AMD'):
+                continue
+            ret.append(amd_number)
+            for key, value in row_values(xlsx_header, row):
+                data_imported[amd_number][key] = value
+        if not xlsx_header or str(xlsx_header[0]) != 'Strain':
+            print('Skipping ' + title)
+            sheet_stats.add(title, row_count)
             continue
-        for amd_number, strain_data in data_imported.items():
-            if Strain.objects.filter(amd_number=amd_number).exists():
-                strain = Strain.objects.get(amd_number=amd_number)
+        new_strains = []
+        changed_strains = {}
+        with transaction.atomic():
+            for amd_number, strain_data in data_imported.items():
+                if amd_number not in strains:
+                    new_strains.append((make_strain(amd_number, strain_data), strain_data))
+                    continue
+                strain = strains[amd_number]
                 if not overwrite_existing:
                     continue
                 for key,value in strain_data.items():
-                    if key == 'Strain':
-                        if strain.name != value:
-                            strain.name = value
-                            strain.save()
-                    elif key == 'Plasmid':
-                        if strain.plasmid != value:
-                            strain.plasmid = value
-                            strain.save()
-                    elif key == 'Description':
-                        if strain.description != value:
-                            strain.description = value
-                            strain.save()
-                    elif key == 'Species':
-                        if strain.species != value:
-                            strain.species = value
-                            strain.save()
+                    if key in STRAIN_TABLE_FIELDS:
+                        if getattr(strain, STRAIN_TABLE_FIELDS[key]) != value:
+                            setattr(strain, STRAIN_TABLE_FIELDS[key], value)
+                            changed_strains[strain.id] = strain
                     elif key == '' or key is None:
                         continue
                     else:
-                        if Strain_info.objects.filter(strain=strain.id,param=key).exists():
-                            strain_info_obj = Strain_info.objects.get(strain=strain.id,param=key)
-                            if strain_info_obj.value != value:
-                                strain_info_obj.value = value
-                                strain_info_obj.save()
-                        elif value != '' and not value is None:
-                            Strain_info.objects.create(
-                                strain = strain,
-                                param = key,
-                                value = value
-                                )
-            else:
-                created_count += create_strain(amd_number, strain_data)
-    report = 'Strains created: ' + str(created_count)
+                        strain_info.set(strain, key, value)
+            Strain.objects.bulk_create([strain for strain, _ in new_strains], batch_size=BATCH_SIZE)
+            for strain, strain_data in new_strains:
+                strains[strain.amd_number] = strain
+                for key, value in strain_data.items():
+                    if key in STRAIN_TABLE_FIELDS or key == '' or key is None:
+                        continue
+                    strain_info.set(strain, key, value)
+            Strain.objects.bulk_update(list(changed_strains.values()), list(STRAIN_TABLE_FIELDS.values()),
+                                       batch_size=BATCH_SIZE)
+            text_index.update(Strain, [strain.id for strain, _ in new_strains] + list(changed_strains))
+            strain_info.save()
+        created_count += len(new_strains)
+        sheet_stats.add(title, row_count)
+    report = 'Strains table ' + sheet_stats.report() + '. Strains created: ' + str(created_count)
     return ret, report
 
 
-def create_oligo(name, oligo_data):
-    sequence = ''
-    description = ''
-    if 'Sequence' in oligo_data:
-        sequence = oligo_data['Sequence']
-    if 'Purpose' in oligo_data:
-        description = oligo_data['Purpose']
-    oligo_obj = Oligo.objects.create(
+def make_oligo(name, oligo_data):
+    return Oligo(
         name = name,
-        sequence = sequence,
-        description = description
+        sequence = oligo_data.get('Sequence', ''),
+        description = oligo_data.get('Purpose', '')
     )
-    for key, value in oligo_data.items():
-        if key in ('Sequence', 'Purpose'):
-            continue
-        if key == '' or key is None:
-            continue
-        if value == '' or value is None:
-            continue
-        oligo_info_obj = Oligo_info.objects.create(
-            oligo = oligo_obj,
-            param = key,
-            value = value
-        )
-    return 1
 
 
 def import_oligos_table(xlsx_path, overwrite_existing=False):
     print(xlsx_path)
-    xlsx_path = Path(xlsx_path)
-    wb_obj = openpyxl.load_workbook(xlsx_path, data_only=True)
     created_count = 0
     ret = []
-    for sheet in wb_obj.worksheets:
-        print('Working on ' + sheet.title)
-        xlsx_header = []
+    sheet_stats = SheetStats()
+    oligos = {item.name: item for item in Oligo.objects.all()}
+    oligo_info = InfoRows(Oligo_info, 'oligo')
+    for title, xlsx_header, rows in read_sheets(xlsx_path):
+        print('Working on ' + title)
+        sheet_stats.start()
         data_imported = defaultdict(dict)
-        for i, row in enumerate(sheet.iter_rows(values_only=True)):
-            if i == 0:
-                xlsx_header = row
-            else:
-                name = str(row[0])
-                if name is None or name == '':
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            name = str(row[0]) if row else ''
+            if name == '':
+                continue
+            ret.append(name)
+            for key, value in row_values(xlsx_header, row):
+                data_imported[name][key] = value
+        new_oligos = []
+        changed_oligos = {}
+        with transaction.atomic():
+            for name, oligo_data in data_imported.items():
+                if name not in oligos:
+                    new_oligos.append((make_oligo(name, oligo_data), oligo_data))
                     continue
-                ret.append(name)
-                for j, cell in enumerate(row):
-                    if j == 0:
-                        continue
-                    if cell != '' and cell != 'None' and cell is not None:
-                        data_imported[name][xlsx_header[j]] = str(cell)
-        for name, oligo_data in data_imported.items():
-            if Oligo.objects.filter(name=name).exists():
-                oligo = Oligo.objects.get(name=name)
+                oligo = oligos[name]
                 if not overwrite_existing:
                     continue
                 for key,value in oligo_data.items():
-                    if key == 'Sequence':
-                        if oligo.sequence != value:
-                            oligo.sequence = value
-                            oligo.save()
-                    elif key == 'Purpose':
-                        if oligo.description != value:
-                            oligo.description = value
-                            oligo.save()
+                    if key in OLIGO_TABLE_FIELDS:
+                        if getattr(oligo, OLIGO_TABLE_FIELDS[key]) != value:
+                            setattr(oligo, OLIGO_TABLE_FIELDS[key], value)
+                            changed_oligos[oligo.id] = oligo
                     elif key == '' or key is None:
                         continue
                     else:
-                        if Oligo_info.objects.filter(oligo=oligo.id,param=key).exists():
-                            oligo_info_obj = Oligo_info.objects.get(oligo=oligo.id,param=key)
-                            if oligo_info_obj.value != value:
-                                oligo_info_obj.value = value
-                                oligo_info_obj.save()
-                        elif value != '' and not value is None:
-                            Oligo_info.objects.create(
-                                oligo = oligo,
-                                param = key,
-                                value = value
-                                )
-            else:
-                print(oligo_data)
-                created_count += create_oligo(name, oligo_data)
-    report = 'Oligos created: ' + str(created_count)
+                        oligo_info.set(oligo, key, value)
+            Oligo.objects.bulk_create([oligo for oligo, _ in new_oligos], batch_size=BATCH_SIZE)
+            for oligo, oligo_data in new_oligos:
+                oligos[oligo.name] = oligo
+                for key, value in oligo_data.items():
+                    if key in OLIGO_TABLE_FIELDS or key == '' or key is None:
+                        continue
+                    oligo_info.set(oligo, key, value)
+            Oligo.objects.bulk_update(list(changed_oligos.values()), list(OLIGO_TABLE_FIELDS.values()),
+                                      batch_size=BATCH_SIZE)
+            text_index.update(Oligo, [oligo.id for oligo, _ in new_oligos] + list(changed_oligos))
+            oligo_info.save()
+        created_count += len(new_oligos)
+        sheet_stats.add(title, row_count)
+    report = 'Oligos table ' + sheet_stats.report() + '. Oligos created: ' + str(created_count)
     print(report)
     return ret, report
     
 
-def make_blast_databases():
-    nucl_db_file = export_contigs()
-    cmd = ['makeblastdb', '-dbtype', 'nucl', '-in',
-           nucl_db_file, '-out',
-           '/mnt/data/work/Plasmids/plasmidoro/data/blast_nucl'
-           ]
-    print(' '.join(cmd))
-    with Popen(cmd, stdout=PIPE, bufsize=1, universal_newlines=True) as proc:
-        for line in proc.stdout:
-            print(line.rstrip('\n\r'))
-    if proc.returncode != 0:
-        # Suppress false positive no-member error
-        # (see https://github.com/PyCQA/pylint/issues/1860)
-        # pylint: disable=no-member
-        raise CalledProcessError(proc.returncode, proc.args)
-    
-    prot_db_file = export_proteins()
-    cmd = ['makeblastdb', '-dbtype', 'prot', '-in',
-           prot_db_file, '-out',
-           '/mnt/data/work/Plasmids/plasmidoro/data/blast_prot'
-           ]
-    print(' '.join(cmd))
-    with Popen(cmd, stdout=PIPE, bufsize=1, universal_newlines=True) as proc:
-        for line in proc.stdout:
-            print(line.rstrip('\n\r'))
-    if proc.returncode != 0:
-        # Suppress false positive no-member error
-        # (see https://github.com/PyCQA/pylint/issues/1860)
-        # pylint: disable=no-member
-        raise CalledProcessError(proc.returncode, proc.args)
-    
-    
-def export_contigs():
-    """
-        Writes all nucleotide sequences into FASTA file
-        for blast database generation
+def make_blast_databases(force=False):
     """
-    nucl_db_file = '/mnt/data/work/Plasmids/plasmidoro/data/nucl.fna'
-    with open(nucl_db_file, 'w') as outfile:
-        for item in Plasmid.objects.values('id', 'name', 'amd_number', 'sequence'):
-            if item['sequence'] != '':
-                outfile.write('>' + str(item['id']) + '|' + ''.join([i if ord(i) < 128 else '.' for i in item['name'].replace(' ', '_')]) + '|plasmid|' + item['amd_number'] +
-                          '\n' + item['sequence'] +
-                          '\n')
-        for item in Oligo.objects.values('id', 'name', 'sequence'):
-            if item['sequence'] != '':
-                outfile.write('>' + str(item['id']) + '|' + ''.join([i if ord(i) < 128 else '.' for i in item['name'].replace(' ', '_')]) + '|oligo|' +
-                          '\n' + item['sequence'] +
-                          '\n')
-    return nucl_db_file
-    
-    
-def export_proteins():
+        Rebuilds BLAST database shards with changed sequences
+        and activates a new database version.
+        Returns report string.
     """
-        Writes all protein sequences into FASTA file
-        for blast database generation
-    """
-    prot_db_file = '/mnt/data/work/Plasmids/plasmidoro/data/prot.fna'
-    with open(prot_db_file, 'w') as outfile:
-        for protein in Protein.objects.all():
-            if protein.sequence != '':
-                protein_name = protein.name.replace('&nbsp;', '_')
-                outfile.write('>' + str(protein.id) + '|' + ''.join([i if ord(i) < 128 else '.' for i in protein_name.replace(' ', '_')]) + '|' +
-                    ''.join([i if ord(i) < 128 else '.' for i in protein.feature.plasmid.name.replace(' ', '_')]) + '|' + protein.feature.location_str +
-                    '\n' + protein.sequence +
-                    '\n')
-    return prot_db_file
-    
-    
-
+    with stage('BLAST databases'):
+        rebuilt, deleted, version, timings = update_blast_databases(force)
+        if rebuilt or deleted:
+            # Cached search results of the previous version are stale
+            search_cache.evict()
+        count('shards rebuilt', len(rebuilt))
+        count('shards deleted', len(deleted))
+        for build_stage, seconds in timings.items():
+            count(build_stage + ' s', round(seconds, 1))
+    print('BLAST database build times: ' +
+          ', '.join(stage + ' {:.1f} s'.format(seconds) for stage, seconds in timings.items()))
+    return 'BLAST database version: ' + version + ', shards rebuilt: ' + str(len(rebuilt)) + \
+        ', deleted: ' + str(len(deleted))
@@ -1,13 +1,18 @@
 import os
-from django.shortcuts import render
+import csv
+from django.shortcuts import render, redirect
 from django.template import loader
-from django.http import HttpResponse
-from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db.models import Count
+from django.db.models.functions import Length
 from magicpool.models import *
-from magicpool.blast_search import run_protein_search
-from magicpool.blast_search import run_nucleotide_search
+from magicpool.search_jobs import submit_job, queue_position, JOB_QUEUED, JOB_RUNNING, JOB_DONE
+from magicpool.search_hits import annotate_hits
 from magicpool.export import export_plasmids
-from amdplasmids.settings import STATICFILES_DIRS, STATIC_URL
+from magicpool.pagination import keyset_page, ranked_page
+from magicpool import text_index
+from amdplasmids.settings import STATICFILES_DIRS, STATIC_URL, SEARCH_JOB_POLL_INTERVAL
+from amdplasmids.settings import BATCH_SEARCH_MAX_QUERIES
 
 
 def index(request):
@@ -36,8 +41,9 @@ def plasmid_detail(request, plasmid_id):
         'site_title':plasmid.name + ' [' + plasmid.amd_number + ']',
         'plasmid':plasmid,
         'plasmid_info':Plasmid_info.objects.filter(plasmid=plasmid.id),
-        'features': Feature.objects.filter(plasmid=plasmid.id).order_by('start')
-        
+        # Features of the plasmid manager share the loaded plasmid object
+        'features': plasmid.feature_set.select_related('feature_type').order_by('start'),
+        'binding_sites': Oligo_binding_site.objects.filter(plasmid=plasmid.id).select_related('oligo').order_by('start')
         }
     if Strain.objects.filter(amd_number=plasmid.amd_number).exists():
         context['strain'] = Strain.objects.get(amd_number=plasmid.amd_number)
@@ -55,8 +61,8 @@ def plasmid_viewer(request, plasmid_id):
     context = {
         'site_title':plasmid.name + ' [' + plasmid.amd_number + '] viewer',
         'plasmid':plasmid,
-        'features':Feature.objects.filter(plasmid=plasmid_id),
-        'translations':Feature.objects.filter(plasmid=plasmid_id, feature_type__name__in=['gene', 'CDS']),
+        'features':plasmid.feature_set.select_related('feature_type'),
+        'translations':plasmid.feature_set.select_related('feature_type').filter(feature_type__name__in=['gene', 'CDS']),
         }
     print(context)
     return HttpResponse(template.render(context, request))
@@ -131,6 +137,7 @@ def oligo_detail(request, oligo_id):
     oligo = Oligo.objects.get(id=oligo_id)
     context = {'oligo':oligo,
         'info':Oligo_info.objects.filter(oligo=oligo_id),
+        'binding_sites':Oligo_binding_site.objects.filter(oligo=oligo_id).select_related('plasmid').order_by('plasmid__name', 'start'),
         }
     return HttpResponse(template.render(context, request))
     
@@ -153,13 +160,54 @@ def strain_detail(request, strain_id):
     return HttpResponse(template.render(context, request))
 
     
+def _plasmid_rows(queryset):
+    '''
+        Restricts plasmid queryset to the columns shown in lists,
+        with sequence length instead of the sequence
+    '''
+    return queryset.select_related('magic_pool_part').only(
+        'name', 'amd_number', 'description', 'magic_pool_part__name'
+        ).annotate(size=Length('sequence'))
+
+
+def _part_rows(queryset):
+    return queryset.select_related('upstream_overhang', 'downstream_overhang').only(
+        'name', 'description', 'upstream_overhang__name', 'upstream_overhang__color',
+        'downstream_overhang__name', 'downstream_overhang__color'
+        )
+
+
+def _vector_rows(queryset):
+    return queryset.only('name', 'description').annotate(part_count=Count('vector_type_part'))
+
+
+def _magicpool_rows(queryset):
+    return queryset.only('name', 'description', 'antibiotic_resistance')
+
+
+def _strain_rows(queryset):
+    return queryset.only('amd_number', 'species', 'name', 'description')
+
+
+def _oligo_rows(queryset):
+    return queryset.select_related('contact').only('name', 'description', 'contact__name')
+
+
+def _feature_rows(queryset):
+    return queryset.select_related('plasmid', 'feature_type').only(
+        'name', 'location_str', 'description', 'feature_type__name', 'plasmid__name', 'plasmid__amd_number'
+        )
+
+
 def plasmids(request):
     '''
         Displays list of plasmids
     '''
     template = loader.get_template('magicpool/plasmids.html')
+    page = keyset_page(request, _plasmid_rows(Plasmid.objects.all()), 'name')
     context = {
-        'itemlist':Plasmid.objects.order_by('name')
+        'itemlist':page,
+        'page':page
         }
     return HttpResponse(template.render(context, request))
 
@@ -169,8 +217,10 @@ def parts(request):
         Displays list of parts
     '''
     template = loader.get_template('magicpool/parts.html')
+    page = keyset_page(request, _part_rows(Magic_pool_part_type.objects.all()), 'name')
     context = {
-        'itemlist':Magic_pool_part_type.objects.order_by('name')
+        'itemlist':page,
+        'page':page
         }
     return HttpResponse(template.render(context, request))
 
@@ -180,10 +230,11 @@ def vectors(request):
         Displays list of vectors
     '''
     template = loader.get_template('magicpool/vectors.html')
+    page = keyset_page(request, _vector_rows(Vector_type.objects.all()), 'name')
     context = {
-        'itemlist':Vector_type.objects.order_by('name')
+        'itemlist':page,
+        'page':page
         }
-    print(context)
     return HttpResponse(template.render(context, request))
 
 
@@ -192,10 +243,11 @@ def magicpools(request):
         Displays list of Magic Pools
     '''
     template = loader.get_template('magicpool/magicpools.html')
+    page = keyset_page(request, _magicpool_rows(Magic_pool.objects.all()), 'name')
     context = {
-        'itemlist':Magic_pool.objects.order_by('name')
+        'itemlist':page,
+        'page':page
         }
-    print(context)
     return HttpResponse(template.render(context, request))
 
 
@@ -204,10 +256,11 @@ def strains(request):
         Displays list of strains
     '''
     template = loader.get_template('magicpool/strains.html')
+    page = keyset_page(request, _strain_rows(Strain.objects.all()), 'amd_number')
     context = {
-        'itemlist':Strain.objects.order_by('amd_number')
+        'itemlist':page,
+        'page':page
         }
-    print(context)
     return HttpResponse(template.render(context, request))
 
 
@@ -216,10 +269,11 @@ def oligos(request):
         Displays list of oligos
     '''
     template = loader.get_template('magicpool/oligos.html')
+    page = keyset_page(request, _oligo_rows(Oligo.objects.all()), 'name')
     context = {
-        'itemlist':Oligo.objects.order_by('name')
+        'itemlist':page,
+        'page':page
         }
-    print(context)
     return HttpResponse(template.render(context, request))
     
     
@@ -232,74 +286,18 @@ def nucleotidesearchform(request):
 
 def nucleotidesearch(request):
     '''
-        Returns nucleotide search results 
+        Submits nucleotide search job 
     '''
-    context = {}
     if request.POST.get("sequence"):
-        result = {}
         params = {'sequence': request.POST.get("sequence"),
                   'evalue': request.POST.get("evalue"),
                   'hitstoshow': request.POST.get("hitstoshow")
                   }
-        hits, searchcontext, query_len, _ = run_nucleotide_search(params)
-        if searchcontext != '':
-            context['searchcontext'] = searchcontext
-        for row in hits:
-            row=row.split('\t')
-            print('Search for gene %s', row[1])
-            if row[0] not in result:
-                result[row[0]] = []
-            unaligned_part =  int(row[6]) - 1 + query_len - int(row[7])
-            query_cov = (query_len - unaligned_part) * 100.0 / query_len
-            target_tokens = row[1].split('|')
-            target_id = int(target_tokens[0])
-            if int(row[8]) < int(row[9]):
-                hit_coord = row[8] + '..' + row[9]
-            else:
-                hit_coord = 'complement(' + row[9] + '..' + row[8] + ')'
-            if target_tokens[2] == 'plasmid':
-                plasmid = Plasmid.objects.get(id = target_id)
-                if plasmid.amd_number != '':
-                    plasmid_label = plasmid.name + '/' + plasmid.amd_number
-                else:
-                    plasmid_label = plasmid.name
-                hit = ['Plasmid',
-                       plasmid.id,
-                       plasmid_label,
-                       '{:.1f}'.format(float(row[2])),
-                       row[3],
-                       '{:.1f}'.format(query_cov),
-                       row[10],
-                       row[11],
-                       hit_coord
-                       ]
-                result[row[0]].append(hit)
-            elif target_tokens[2] == 'oligo':
-                oligo = Oligo.objects.get(id = target_id)
-                hit = ['Oligo',
-                       oligo.id,
-                       oligo.name,
-                       '{:.1f}'.format(float(row[2])),
-                       row[3],
-                       '{:.1f}'.format(query_cov),
-                       row[10],
-                       row[11],
-                       hit_coord
-                       ]
-                result[row[0]].append(hit)
-        context['searchresult'] = result
-    else:
-        return render(request,
-                      '404.html',
-                      {'searchcontext': 'Provide nucleotide sequence in FASTA format'}
-                      )
-    return render(request, 'magicpool/nucleotidesearch.html', context)
-
-    '''
-        Displays nucleotide sequence search form
-    '''
-    #return render(request,'magicpool/nucleotidesearchform.html')
-    return HttpResponse("Not implemented.")
+        return _submit_search_job(request, 'nucleotide', params)
+    return render(request,
+                  '404.html',
+                  {'searchcontext': 'Provide nucleotide sequence in FASTA format'}
+                  )
 
 
 def proteinsearchform(request):
@@ -311,94 +309,143 @@ def proteinsearchform(request):
 
 def proteinsearch(request):
     '''
-        Returns protein search results 
+        Submits protein search job 
     '''
-    context = {}
     if request.POST.get("sequence"):
-        result = {}
         params = {'sequence': request.POST.get("sequence"),
                   'evalue': request.POST.get("evalue"),
                   'hitstoshow': request.POST.get("hitstoshow"),
                   'tool': request.POST.get("tool"),
                   }
-        hits, searchcontext, query_len, tool = run_protein_search(params)
-        if searchcontext != '':
-            context['searchcontext'] = searchcontext
-        if tool == 'blastp':
-            for row in hits:
-                row=row.split('\t')
-                print('Search for gene', row[1])
-                if row[0] not in result:
-                    result[row[0]] = []
-                unaligned_part =  int(row[6]) - 1 + query_len - int(row[7])
-                query_cov = (query_len - unaligned_part) * 100.0 / query_len
-                proteins = Protein.objects.select_related(
-                    'feature', 'feature__plasmid'
-                ).filter(
-                    id = int(row[1].split('|')[0])
-                )
-                for protein in proteins:
-                    hit = [protein.name + ': ' + protein.function + ' [' + row[8] + '..' + row[9] + ']',
-                           protein.feature.plasmid.id,
-                           protein.feature.plasmid.name,
-                           '{:.1f}'.format(float(row[2])),
-                           row[3],
-                           '{:.1f}'.format(query_cov),
-                           row[10],
-                           row[11]
-                           ]
-                    result[row[0]].append(hit)
-        elif tool == 'tblastn':
-            for row in hits:
-                row=row.split('\t')
-                print('Search for gene', row[1])
-                if row[0] not in result:
-                    result[row[0]] = []
-                unaligned_part =  int(row[6]) - 1 + query_len - int(row[7])
-                query_cov = (query_len - unaligned_part) * 100.0 / query_len
-                target_tokens = row[1].split('|')
-                target_id = int(target_tokens[0])
-                if int(row[8]) < int(row[9]):
-                    hit_coord = row[8] + '..' + row[9]
-                else:
-                    hit_coord = 'complement(' + row[9] + '..' + row[8] + ')'
-                if target_tokens[2] == 'plasmid':
-                    plasmid = Plasmid.objects.get(id = target_id)
-                    if plasmid.amd_number != '':
-                        plasmid_label = plasmid.name + '/' + plasmid.amd_number
-                    else:
-                        plasmid_label = plasmid.name
-                    hit = ['Plasmid',
-                           plasmid.id,
-                           plasmid_label,
-                           '{:.1f}'.format(float(row[2])),
-                           row[3],
-                           '{:.1f}'.format(query_cov),
-                           row[10],
-                           row[11],
-                           hit_coord
-                           ]
-                    result[row[0]].append(hit)
-                elif target_tokens[2] == 'oligo':
-                    oligo = Oligo.objects.get(id = target_id)
-                    hit = ['Oligo',
-                           oligo.id,
-                           oligo.name,
-                           '{:.1f}'.format(float(row[2])),
-                           row[3],
-                           '{:.1f}'.format(query_cov),
-                           row[10],
-                           row[11],
-                           hit_coord
-                           ]
-                    result[row[0]].append(hit)
-        context['searchresult'] = result
-    else:
+        return _submit_search_job(request, 'protein', params)
+    return render(request,
+                  '404.html',
+                  {'searchcontext': 'Provide protein sequence in FASTA format'}
+                  )
+
+
+def _submit_search_job(request, search_type, params):
+    '''
+        Queues search job and redirects to the job status page
+    '''
+    job = submit_job(search_type, params)
+    if job is None:
+        return render(request,
+                      '404.html',
+                      {'searchcontext': 'Too many searches in the queue. Please try again later.'}
+                      )
+    return redirect('searchjob', job_id=job.job_id)
+
+
+def search_job(request, job_id):
+    '''
+        Displays search job status or search results 
+    '''
+    try:
+        job = Search_job.objects.get(job_id=job_id)
+    except Search_job.DoesNotExist:
         return render(request,
                       '404.html',
-                      {'searchcontext': 'Provide protein sequence in FASTA format'}
+                      {'searchcontext': 'Search job not found. It may have expired.'}
                       )
-    return render(request, 'magicpool/proteinsearch.html', context)
+    if job.status in (JOB_QUEUED, JOB_RUNNING):
+        context = {'job':job,
+                   'refresh':SEARCH_JOB_POLL_INTERVAL
+                   }
+        if job.status == JOB_QUEUED:
+            context['position'] = queue_position(job)
+        return render(request, 'magicpool/searchjob.html', context)
+    context = {'job':job}
+    if job.searchcontext != '':
+        context['searchcontext'] = job.searchcontext
+    template_name, context['searchresult'] = _search_job_result(job)
+    return render(request, template_name, context)
+
+
+def _search_job_result(job):
+    '''
+        Returns template name and hits grouped by query for a finished job
+    '''
+    hits = [row for row in job.hits.split('\n') if row]
+    if job.tool == 'blastn':
+        return 'magicpool/nucleotidesearch.html', annotate_hits(hits, job.query_len, job.tool)
+    return 'magicpool/proteinsearch.html', annotate_hits(hits, job.query_len, job.tool)
+
+
+class _Echo:
+    '''
+        Pseudo-buffer that returns written value instead of storing it
+    '''
+    def write(self, value):
+        return value
+
+
+def search_job_tsv(request, job_id):
+    '''
+        Streams search job results as a tab-separated file 
+    '''
+    try:
+        job = Search_job.objects.get(job_id=job_id, status=JOB_DONE)
+    except Search_job.DoesNotExist:
+        return render(request,
+                      '404.html',
+                      {'searchcontext': 'Search results not found. The search may be unfinished or expired.'}
+                      )
+    _, searchresult = _search_job_result(job)
+    writer = csv.writer(_Echo(), delimiter='\t')
+
+    def tsv_rows():
+        yield writer.writerow(['Query',
+                               'Target',
+                               'Name',
+                               '%identity',
+                               'Alignment length',
+                               '%Query coverage',
+                               'E-value',
+                               'Bit-score',
+                               'Location'
+                               ])
+        for query, hits in searchresult.items():
+            for hit in hits:
+                if len(hit) > 8:
+                    yield writer.writerow([query, hit[0], hit[2]] + hit[3:9])
+                else:
+                    # blastp hit: protein label and plasmid name
+                    yield writer.writerow([query, 'Protein', hit[0] + ' ' + hit[2]] + hit[3:8] + [''])
+
+    response = StreamingHttpResponse(tsv_rows(), content_type='text/tab-separated-values')
+    response['Content-Disposition'] = 'attachment; filename="search_' + str(job.job_id) + '.tab"'
+    return response
+
+
+def batchsearchform(request):
+    '''
+        Displays multi-FASTA batch search form
+    '''
+    return render(request,'magicpool/batchsearchform.html',
+                  {'max_queries':BATCH_SEARCH_MAX_QUERIES}
+                  )
+
+
+def batchsearch(request):
+    '''
+        Submits multi-FASTA batch search job 
+    '''
+    sequence = request.POST.get("sequence", '')
+    fasta_file = request.FILES.get("fastafile")
+    if fasta_file is not None:
+        sequence = fasta_file.read().decode('utf-8', errors='replace')
+    if sequence.strip():
+        params = {'sequence': sequence,
+                  'evalue': request.POST.get("evalue"),
+                  'hitstoshow': request.POST.get("hitstoshow"),
+                  'tool': request.POST.get("tool"),
+                  }
+        return _submit_search_job(request, 'batch', params)
+    return render(request,
+                  '404.html',
+                  {'searchcontext': 'Provide sequences in FASTA format'}
+                  )
 
 
 def textsearchform(request):
@@ -410,124 +457,66 @@ def textsearchform(request):
 
 def textsearch(request):
     '''
-        Search in plasmids
+        Search in plasmids, parts, vectors, Magic Pools, strains,
+        oligos or features with the full-text index. Best matches
+        are shown first.
     '''
-    query = request.GET.get('query')
+    query = request.GET.get('query') or ''
     type = request.GET.get('type')
     if type == 'plasmid':
-        if query:
-            object_list = Plasmid.objects.filter(
-                    (Q(name__icontains=query) |
-                    Q(amd_number__icontains=query) |
-                    Q(magic_pool_designation__icontains=query) |
-                    Q(description__icontains=query))
-                ).distinct().order_by('name')
-        else:
-            query = ''
-            object_list = Plasmid.objects.none()
+        object_list = _plasmid_rows(Plasmid.objects.all())
         template = loader.get_template('magicpool/plasmids.html')
         context={
             'site_title':'Plasmid search results',
-            'itemlist':object_list,
             'searchcontext':query
             }
     elif type == 'part':
-        if query:
-            object_list = Magic_pool_part_type.objects.filter(
-                    (Q(name__icontains=query) |
-                    Q(description__icontains=query))
-                ).distinct().order_by('name')
-        else:
-            query = ''
-            object_list = Magic_pool_part_type.objects.none()
+        object_list = _part_rows(Magic_pool_part_type.objects.all())
         template = loader.get_template('magicpool/parts.html')
         context={
             'site_title':'Magic pool part search results',
-            'itemlist':object_list,
             'searchcontext':query
             }
     elif type == 'vector':
-        if query:
-            object_list = Vector_type.objects.filter(
-                    (Q(name__icontains=query) |
-                    Q(description__icontains=query))
-                ).distinct().order_by('name')
-        else:
-            query = ''
-            object_list = Vector_type.objects.none()
+        object_list = _vector_rows(Vector_type.objects.all())
         template = loader.get_template('magicpool/vectors.html')
         context={
             'site_title':'Vector search results',
-            'itemlist':object_list,
             'searchcontext':query
             }
     elif type == 'magicpool':
-        if query:
-            object_list = Magic_pool.objects.filter(
-                    (Q(name__icontains=query) |
-                    Q(description__icontains=query) |
-                    Q(antibiotic_resistance__icontains=query))
-                ).distinct().order_by('name')
-        else:
-            query = ''
-            object_list = Magic_pool.objects.none()
+        object_list = _magicpool_rows(Magic_pool.objects.all())
         template = loader.get_template('magicpool/magicpools.html')
         context={
             'site_title':'Magic pool search results',
-            'itemlist':object_list,
             'searchcontext':query
             }
     elif type == 'strain':
-        if query:
-            object_list = Strain.objects.filter(
-                    (Q(name__icontains=query) |
-                    Q(amd_number__icontains=query) |
-                    Q(species__icontains=query) |
-                    Q(description__icontains=query))
-                ).distinct().order_by('amd_number')
-        else:
-            query = ''
-            object_list = Strain.objects.none()
+        object_list = _strain_rows(Strain.objects.all())
         template = loader.get_template('magicpool/strains.html')
         context={
             'site_title':'Strain search results',
-            'itemlist':object_list,
             'searchcontext':query
             }
     elif type == 'oligo':
-        if query:
-            object_list = Oligo.objects.filter(
-                    (Q(name__icontains=query) |
-                    Q(contact__name__icontains=query) |
-                    Q(description__icontains=query))
-                ).distinct().order_by('name')
-        else:
-            query = ''
-            object_list = Oligo.objects.none()
+        object_list = _oligo_rows(Oligo.objects.all())
         template = loader.get_template('magicpool/oligos.html')
         context={
             'site_title':'Oligonucleotide search results',
-            'itemlist':object_list,
             'searchcontext':query
             }
     elif type == 'feature':
-        if query:
-            object_list = Feature.objects.filter(
-                    (Q(name__icontains=query) |
-                    Q(plasmid__name__icontains=query) |
-                    Q(description__icontains=query))
-                ).distinct().order_by('name')
-        else:
-            query = ''
-            object_list = Feature.objects.none()
+        object_list = _feature_rows(Feature.objects.all())
         template = loader.get_template('magicpool/features.html')
         context={
             'site_title':'Feature search results',
-            'itemlist':object_list,
             'searchcontext':query
             }
     else:
         return HttpResponse("Not implemented.")
+    page = ranked_page(request, object_list, text_index.search(type, query))
+    context['itemlist'] = page
+    context['page'] = page
     return HttpResponse(template.render(context, request))
 
 def export(request):